@@ -1,15 +1,41 @@
+import asyncio
+import contextlib
+import io
 import json
+import os
 import random
+import time
 from urllib.parse import quote_plus
 
 import discord
 import websockets
 
 # from namako import playtak_cl, discord_cl, GUILDS
+from clients import metrics
+from clients.board_executor import BoardExecutor
+from clients.embed_builder import EmbedTemplate
+from clients.frame_log import FRAME_LOG
+from clients.image_renderer import ImageRenderer
+from clients.playtak_client import PlaytakClient, STATE_DIR, URI
+from clients.tracing import TRACES, MoveTrace
+from tak import render
 from tak.board import TakBoard
+from tak.opening_index import OpeningBook
+from tak.position_index import PositionIndex
 
-#playtak websocket uri
-URI = "ws://www.playtak.com:9999/ws"
+#reconnecting: backoff doubles from BACKOFF_BASE up to BACKOFF_MAX seconds, for at most MAX_RECONNECTS tries in a row
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+MAX_RECONNECTS = 10
+
+#after Observe we PING, the server's OK comes after the whole backlog and marks its end
+FENCE = "OK"
+
+#in case the OK never comes, the backlog's taken to be over after this long (seconds)
+CATCHUP_MAX = 10
+
+#a game that's been silent this long gets checked on, in case it ended without us hearing (seconds)
+IDLE_CHECK = 120
 
 #default reserve counts by size
 RESERVE_COUNTS = {
@@ -33,6 +59,26 @@ with open("data/embeds.json") as f:
 with open("data/theme.json") as f:  # just need the string <3
     THEME = f.read()
 
+#escaped once, it's the same for every link
+THEME_URL = quote_plus(THEME)
+
+#board images are rendered locally and uploaded with the message
+RENDERER = ImageRenderer(THEME)
+IMAGE_NAME = "game.png"
+REPLAY_NAME = "replay.gif"
+
+#opening explorer, built with `python -m tak.opening_index <archive> data`
+OPENINGS = OpeningBook("data")
+
+#board work (moves, win checks, TPS, embeds) runs here, off the event loop, in order per game
+BOARD_EXECUTOR = BoardExecutor()
+
+#position search, finished games are added as they end
+POSITIONS = PositionIndex(os.path.join(STATE_DIR, "positions.db"))
+
+#only its HTTP side, for looking up games that went quiet (watchers may run in a worker, away from the bot's client)
+PLAYTAK_API = PlaytakClient()
+
 def timestamp(t):
     return f"{t}s" if t < 60 else f"{t // 60}:{t % 60:0=2}"
 
@@ -42,17 +88,22 @@ class GameWatcher:
     #currently active guest tokens
     tokens = []
 
-    def __init__(self, data, header, discord_cl, guilds):
+    #replays still rendering, hard references so they don't get garbage-collected
+    replays = set()
+
+    def __init__(self, data, header, discord_cl, guilds, store=None):
         self.gameId = data["game_no"]
         self.data = data
         self.head = header
         self.discord_cl = discord_cl
         self.guilds = guilds
+        self.store = store
 
         self.moves = []
+        self.serverMoves = []  # as received, so they can be saved and replayed after a restart
 
         self.player = "white"
-        self.engine = TakBoard(data["size"], data["half_komi"])
+        self.engine = None  # built off the loop, in start (or restore)
 
 
         #create and log a unique token
@@ -63,72 +114,312 @@ class GameWatcher:
         self.tokens.append(self.token)
 
 
-        self.embed = self.generateEmbed()
+        self.template = self.generateTemplate()
+        self.linkBase = self.generateLinkBase()
+
+        self.image = None
+        self.embed = None
         self.messages = []
 
+        self.finished = False
+        self.pending = [] # (ply, received, applied) of moves that aren't on Discord yet, for tracing
+
+        self.stale = False # the server's about to replay the game, the board gets reset when it starts
+        self.delivered = False # the current connection has had frames for our game
+
+    # Recreates a watcher saved by the state store, before a restart
+    @classmethod
+    async def restore(cls, saved, discord_cl, guilds, store):
+        watcher = cls(saved["data"], saved["header"], discord_cl, guilds, store)
+        await BOARD_EXECUTOR.run(watcher.gameId, watcher.replayMoves, saved["moves"])
+
+        return watcher
+
+    # Picks the messages posted before the restart back up, instead of announcing the game again
+    # (fetched in full - a partial message can't be edited with an image)
+    async def reattach(self, messages):
+        for channel, message_id in messages:
+            message = await self.discord_cl.fetch_message(channel, message_id)
+
+            if message is not None:  # deleted meanwhile, nothing to update
+                self.messages.append(message)
+
     # Starts sending messages and kick off the mainloop
     async def start(self):
-        for channel in self.guilds.values():
-            message = await self.discord_cl.send(channel, f"<@&{ROLE}>", embed=self.embed)
-            self.messages.append(message)
+        metrics.LIVE_WATCHERS.inc()
+        try:
+            await self.run()
+        finally:
+            metrics.LIVE_WATCHERS.dec()
+            metrics.QUEUE_DEPTH.remove(game=self.gameId)
+            BOARD_EXECUTOR.forget(self.gameId)
+
+    # Cancels the task running `start`, and waits for it - and any board work it left running - to stop
+    async def stop(self, task):
+        task.cancel()
+
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+        # a cancelled job keeps running in its thread, this queues behind it
+        await BOARD_EXECUTOR.run(self.gameId, lambda: None)
+        BOARD_EXECUTOR.forget(self.gameId)
+
+    # Watches the game until it ends, reconnecting as needed
+    async def run(self):
+        if self.engine is None:
+            await BOARD_EXECUTOR.run(self.gameId, self.resetBoard)
+
+        if not self.messages:
+            await self.announce()
+
+        attempt = 0
+
+        while not self.finished:
+            try:
+                await self.observe()
+
+            except (websockets.ConnectionClosed, OSError, asyncio.TimeoutError) as e:
+                print(f"Lost connection to {self.gameId}: {e!r}")
+
+            if self.finished:
+                break
+
+            # only a connection that actually got us the game counts - one that just closes cleanly doesn't
+            if self.delivered:
+                attempt = 0
+
+            attempt += 1
+            if attempt > MAX_RECONNECTS:
+                print(f"Giving up on {self.gameId} after {MAX_RECONNECTS} reconnects")
+                self.tokens.remove(self.token)
+                break
+
+            # jittered, so a server blip doesn't have every watcher reconnect at the same instant
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+
+        print(f"Ended watching {self.gameId}")
 
+    # One connection's worth of watching. Returns when the socket closes or the game ends
+    async def observe(self):
         # login using token, and start observing game
-        async with websockets.connect("ws://playtak.com:9999/ws", subprotocols=["binary"], ping_timeout=None) as ws:
+        async with websockets.connect(URI, subprotocols=["binary"], ping_timeout=None) as ws:
             # the idea is that unique tokens create unique guest accounts, lets hope thats in fact the case
             await ws.send(f"Login Guest {self.token}")
+
+            # the server sends every move so far when we observe. The board is reset once that backlog starts,
+            # not before, so a game that ended meanwhile (or a slow backlog) doesn't leave an empty board on Discord
+            before = (len(self.moves), self.engine.zobrist_hash)
+            self.stale = True
+            self.delivered = False
             await ws.send(f"Observe {self.gameId}")
+            await ws.send("PING")
 
             print(f"Started watching {self.gameId}")
 
-            await self.mainLoop(ws)
+            frames = asyncio.Queue()
+            reader = asyncio.create_task(self.readFrames(ws, frames))
 
-        #we always get an error here, but i cant catch it, and it doesnt stop the program, so its fine i guess?
-        #it just clogs the console ;-;
+            try:
+                end, rest = await self.catchUp(frames, before)
 
-        print(f"Ended watching {self.gameId}")
+                if end is None:
+                    await self.mainLoop(frames, rest)
+            finally:
+                reader.cancel()
+
+            if reader.done() and not reader.cancelled():
+                reader.result() # raises the ConnectionClosed, if that's why we stopped
+
+    # Queues up every frame as it arrives, so the loops below can take whatever piled up while they were editing
+    async def readFrames(self, ws, frames):
+        try:
+            async for msg in ws:
+                metrics.FRAMES.inc(source="watcher")
+                msg = msg.decode()[:-1]
+
+                if FRAME_LOG:
+                    FRAME_LOG.record(self.gameId, msg)
+
+                frames.put_nowait((time.monotonic(), msg))
+        finally:
+            frames.put_nowait(None) # the connection's gone
+
+    # Waits for the next frame, then takes every frame queued behind it
+    async def nextBatch(self, frames, timeout=None):
+        batch = [await asyncio.wait_for(frames.get(), timeout)]
 
+        while not frames.empty():
+            batch.append(frames.get_nowait())
 
-    # Main listener coroutine
-    async def mainLoop(self, ws):
-        async for msg in ws:
-            msg = msg.decode()[:-1]
-            if msg.startswith(f"GameList Remove {self.gameId}"):
-                # if we receive the remove, we usually won't receive the Game Over after that
-                # so calculate result manually
-                self.data['result'] = self.engine.generate_win_str()
-                self.data['result'] = self.data['result'] if self.data['result'] is not None else "unknown"
+        metrics.QUEUE_DEPTH.set(len(batch), game=self.gameId)
+
+        return batch
+
+    # Applies the moves the server replays after Observe in one go, then edits the embed once (if anything changed).
+    # Returns how the game/connection ended (if it did), and the live frames that came in behind the backlog
+    async def catchUp(self, frames, before):
+        end = None
+        rest = []
+        deadline = time.monotonic() + CATCHUP_MAX
+
+        while end is None:
+            try:
+                batch = await self.nextBatch(frames, timeout=max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                print(f"No end of backlog for {self.gameId}, carrying on")
+                break
+
+            fence = next((i for i, frame in enumerate(batch) if frame is not None and frame[1] == FENCE), None)
+
+            if fence is not None:  # anything after the OK is live
+                batch, rest = batch[:fence + 1], batch[fence + 1:]
+
+            _, end = await BOARD_EXECUTOR.run(self.gameId, self.handleFrames, batch)
+
+            if fence is not None:
                 break
 
-            if not msg.startswith(f"Game#{self.gameId}"):
-                continue
+        self.saveMoves()
+        self.pending = [] # replayed moves, their latency isn't ours
+
+        if end is None and self.stale and before[0] > 0 and await self.checkEnded():
+            end = "over" # nothing to replay, the game's gone
+
+        if end == "over":
+            await self.cleanUp()
+
+        elif (len(self.moves), self.engine.zobrist_hash) != before:
+            await self.updateEmbed()
 
+        return end, rest
 
-            msg = msg.split()[1:]
-            match msg:
-                case ["M", *_] | ["P", *_]:
-                    self.makeMove(msg)
-                    await self.updateEmbed()
+    # Asks the playtak API whether the game's over, and takes its result if it is
+    async def checkEnded(self):
+        game = await PLAYTAK_API.get_playtak_game(self.gameId)
+        result = (game or {}).get("result")
 
-                case ["Undo"]:
-                    self.undoMove()
-                    await self.updateEmbed()
+        if not result or result == "0-0":  # still going (or the API doesn't know)
+            return False
 
-                case ["Abandoned.", player, "quit"]:
-                    self.data["result"] = "1-0" if player == self.data["player_1"] else "0-1"
-                    await self.cleanUp()
-                    break
+        self.data["result"] = result
+        return True
 
-                case ["Over", result]:
-                    self.data["result"] = result
-                    await self.cleanUp()
-                    break
+    async def announce(self):
+        self.image = await self.renderImage()
+        self.embed = await BOARD_EXECUTOR.run(self.gameId, self.generateEmbed)
 
+        if self.store:
+            self.store.save_game(self.gameId, self.data, self.head)
+
+        for channel in self.guilds.values():
+            message = await self.discord_cl.send(channel, f"<@&{ROLE}>", embed=self.embed, file=self.imageFile())
+            self.messages.append(message)
+
+            if self.store:
+                self.store.save_message(self.gameId, channel, message.id)
+
+    # Main listener coroutine. However many moves arrived since the last edit, they get a single edit
+    async def mainLoop(self, frames, batch=None):
+        while True:
+            if not batch:
+                try:
+                    batch = await self.nextBatch(frames, timeout=IDLE_CHECK)
+                except asyncio.TimeoutError:
+                    # nothing for a while: the game may have ended without a Game Over or GameList Remove reaching us
+                    if await self.checkEnded():
+                        await self.cleanUp()
+                        break
+
+                    continue
+
+            changed, end = await BOARD_EXECUTOR.run(self.gameId, self.handleFrames, batch)
+
+            if changed or end == "over":
+                self.saveMoves()
+
+            if end == "over":
+                await self.cleanUp()
+                break
+
+            if changed:
+                await self.updateEmbed()
+
+            if end == "closed":
+                break
+
+            batch = None
+
+    # Applies frames in order. Returns whether the position changed, and "over"/"closed" if the game/connection ended
+    def handleFrames(self, batch):
+        changed = False
+
+        for frame in batch:
+            if frame is None:
+                return changed, "closed"
+
+            received, msg = frame
+            status = self.handleFrame(msg)
+
+            if status == "over":
+                return changed, "over"
+
+            if status == "board":
+                changed = True
+                self.pending.append((len(self.moves), received, time.monotonic()))
+
+        return changed, None
+
+    # Applies a single server frame. Returns "board" if the position changed, "over" if the game ended, else None
+    def handleFrame(self, msg):
+        if msg.startswith(f"GameList Remove {self.gameId}"):
+            # if we receive the remove, we usually won't receive the Game Over after that
+            # so calculate result manually
+            self.data['result'] = self.engine.generate_win_str()
+            self.data['result'] = self.data['result'] if self.data['result'] is not None else "unknown"
+            return "over"
+
+        if not msg.startswith(f"Game#{self.gameId}"):
+            return None
+
+        self.delivered = True
+
+        msg = msg.split()[1:]
+        match msg:
+            case ["M", *_] | ["P", *_]:
+                self.replayStarting()
+                self.makeMove(msg)
+                return "board"
+
+            case ["Undo"]:
+                self.undoMove()
+                return "board"
+
+            case ["Abandoned.", player, "quit"]:
+                self.data["result"] = "1-0" if player == self.data["player_1"] else "0-1"
+                return "over"
+
+            case ["Over", result]:
+                self.data["result"] = result
+                return "over"
+
+        return None
+
+    # The first move after Observe: the server replays the game from the start, so the old board goes
+    def replayStarting(self):
+        if self.stale:
+            self.stale = False
+            self.resetBoard()
 
     def makeMove(self, server_move):
-        move = self.engine.server_to_move(server_move, self.player)
-        self.moves.append(move)
-        self.engine.make_move(move, self.player)
-        self.player = self.engine.invert_player(self.player)
+        with metrics.MAKE_MOVE_TIME.time():
+            move = self.engine.server_to_move(server_move, self.player)
+            self.moves.append(move)
+            self.engine.make_move(move, self.player)
+            self.player = self.engine.invert_player(self.player)
+
+        self.serverMoves.append(server_move)
 
     def undoMove(self):
         move = self.moves[-1]
@@ -136,24 +427,65 @@ class GameWatcher:
         self.player = self.engine.invert_player(self.player)
         self.engine.undo_move(move, self.player)
 
-    def generateImageLink(self):
-        size, half_komi = self.data["size"], self.data["half_komi"]
+        self.serverMoves = self.serverMoves[:-1]
+
+    # Replays saved server moves from the start. Runs on the board executor
+    def replayMoves(self, server_moves):
+        self.resetBoard()
+
+        for server_move in server_moves:
+            self.makeMove(server_move)
+
+    def resetBoard(self):
+        self.moves = []
+        self.serverMoves = []
+        self.player = "white"
+        self.engine = TakBoard(self.data["size"], self.data["half_komi"])
+
+    def saveMoves(self):
+        if self.store:
+            self.store.save_moves(self.gameId, self.serverMoves)
+
+    # What the renderer needs from the board, taken on the board executor so it's in step with the moves
+    def imageState(self):
+        highlight = render.move_squares(self.moves[-1]) if len(self.moves) > 0 else ()
+
+        return render.snapshot(self.engine), self.engine.size, self.engine.zobrist_hash, highlight
+
+    async def renderImage(self):
+        # local render, falls back to the ptn.ninja link (image = None) if anything goes wrong
+        try:
+            state = await BOARD_EXECUTOR.run(self.gameId, self.imageState)
+            return await RENDERER.render_snapshot(*state)
+        except Exception as e:
+            print(f"Render failed for {self.gameId}: {e!r}")
+            return None
+
+    def imageFile(self):
+        # files are consumed when sent, so every message needs a fresh one
+        if self.image is None:
+            return None
+
+        return discord.File(io.BytesIO(self.image), filename=IMAGE_NAME)
+
+    def generateLinkBase(self):
+        # everything in the ptn.ninja link that doesn't change during the game
         caps, flats = self.data["capstones"], self.data["pieces"]
 
         # have to ensure compat with URL
         player_1, player_2 = quote_plus(self.data["player_1"]), quote_plus(self.data["player_2"])
-        theme = quote_plus(THEME)
 
-        tps = quote_plus(self.engine.position_to_TPS())  # quote_plus to ensure URL compat
+        return f"&imageSize=sm&caps={caps}&flats={flats}&player1={player_1}&player2={player_2}&name=game.png&theme={THEME_URL}"
 
+    def generateImageLink(self):
+        tps = quote_plus(self.engine.position_to_TPS())  # quote_plus to ensure URL compat
 
         last_move = "&hl=" + quote_plus(self.engine.move_to_ptn(self.moves[-1])) if len(self.moves) > 0 else ""
 
-        return f"https://tps.ptn.ninja/png?tps={tps}&imageSize=sm&caps={caps}&flats={flats}&player1={player_1}&player2={player_2}&name=game.png&theme={theme}" + last_move
+        return f"https://tps.ptn.ninja/png?tps={tps}" + self.linkBase + last_move
 
-    def generateEmbed(self, top=25):
-
-        out_format = EMBEDS["new_game"]
+    def generateTemplate(self):
+        # the static part of the embed, built once per game
         desc = self.head + f"\n**Game ID:** {self.gameId}"
 
         # STANDARD PARAMETERS
@@ -175,27 +507,82 @@ class GameWatcher:
             pl_capstone = "capstone" if self.data["capstones"] == 1 else "capstones"
             desc += f"\n**Altered counts:** {pieces} pieces, {capstones} {pl_capstone}."
 
-        # GAME RESULT
-        result_str = "Ongoing"
-        if self.data["result"]:
-            link_str = f"([playtak.com](https://playtak.com/games/{self.gameId}/playtakviewer) or [ptn.ninja](https://playtak.com/games/{self.gameId}/ninjaviewer))"
-            result_str = f"{self.data['result']} {link_str}"
-        desc += f"\n**Result:** {result_str}"
+        link_str = f"([playtak.com](https://playtak.com/games/{self.gameId}/playtakviewer) or [ptn.ninja](https://playtak.com/games/{self.gameId}/ninjaviewer))"
+
+        return EmbedTemplate.from_layout(EMBEDS["new_game"], desc, link_str)
 
-        out_format["description"] = desc
+    def explorerStr(self):
+        # how often this position has been reached before, and how white did from it
+        stats = OPENINGS.lookup(self.data["size"], self.engine.zobrist_hash)
 
-        # IMAGE
-        image_url = self.generateImageLink()
+        if stats is None:
+            return None
 
-        out_format["image"] = {"url": image_url}
+        times = "time" if stats.games == 1 else "times"
+        return f"Position seen {stats.games} {times}, White scores {stats.white_score:.0%}"
 
-        return discord.Embed.from_dict(out_format)
+    def generateEmbed(self):
+        # only the result, the explorer line and the image change between updates
+        with metrics.EMBED_BUILD_TIME.time():
+            image_url = f"attachment://{IMAGE_NAME}" if self.image is not None else self.generateImageLink()
+
+            return self.template.build(self.data["result"], image_url, self.explorerStr())
 
     async def updateEmbed(self):
-        embed = self.generateEmbed()
+        pending, self.pending = self.pending, []
+
+        self.image = await self.renderImage()
+        embed = await BOARD_EXECUTOR.run(self.gameId, self.generateEmbed)
+        built = time.monotonic()
+
+        delivered = False
+
         for message in self.messages:
-            await self.discord_cl.edit(message, embed=embed)
+            if await self.discord_cl.edit(message, embed=embed, file=self.imageFile()) is not None:
+                delivered = True
+
+        edited = time.monotonic()
+
+        # moves that never reached Discord would pass for fast ones
+        if delivered:
+            for ply, received, applied in pending:
+                TRACES.record(MoveTrace(self.gameId, ply, received, applied, built, edited))
 
     async def cleanUp(self):
+        self.finished = True
         await self.updateEmbed()
         self.tokens.remove(self.token)
+
+        if self.store:
+            self.store.finish_game(self.gameId)
+
+        # the replay can take a while on a busy evening, don't hold up the watcher for it
+        for job in (self.postReplay(), self.indexPositions()):
+            task = asyncio.create_task(job)
+            self.replays.add(task)
+            task.add_done_callback(self.replays.discard)
+
+    async def indexPositions(self):
+        # adds the finished game to the position search index
+        try:
+            await asyncio.to_thread(POSITIONS.add_game, self.gameId, self.data["size"], self.data["half_komi"], self.moves)
+        except Exception as e:
+            print(f"Indexing failed for {self.gameId}: {e!r}")
+
+    async def postReplay(self):
+        # swaps the final position for an animated replay of the whole game
+        if len(self.moves) == 0:
+            return
+
+        try:
+            replay = await RENDERER.render_replay(self.data["size"], self.data["half_komi"], self.moves)
+        except Exception as e:
+            print(f"Replay failed for {self.gameId}: {e!r}")
+            return
+
+        embed = await BOARD_EXECUTOR.run(self.gameId, self.generateEmbed)
+        BOARD_EXECUTOR.forget(self.gameId) # the watcher's done with its lane by now
+        embed.set_image(url=f"attachment://{REPLAY_NAME}")
+
+        for message in self.messages:
+            await self.discord_cl.edit(message, embed=embed, file=discord.File(io.BytesIO(replay), filename=REPLAY_NAME), timeout=10)
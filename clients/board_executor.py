@@ -0,0 +1,56 @@
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+class BoardExecutor:
+
+    """
+    Runs board work (building boards, applying moves, win checks, TPS and embeds) off the event loop, on a small thread pool.
+
+    Work is queued per game: jobs with the same key run one at a time, in the order they were submitted,
+    so a game's moves are always applied in order, while different games run side by side.
+
+    Threads rather than processes, because the boards live with their watchers. The engine still holds the GIL,
+    but the interpreter hands it back every few milliseconds, so the loop (and the Discord heartbeat) keeps running.
+    """
+
+    def __init__(self, workers: int = 2):
+
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="board")
+        self.lanes = {} # key -> asyncio.Lock, FIFO, so jobs run in submission order
+
+    async def run(self, key, fn, *args, **kwargs):
+
+        """
+        Runs `fn(*args, **kwargs)` on the pool, after every job submitted earlier under `key`, and returns its result.
+        """
+
+        lane = self.lanes.setdefault(key, asyncio.Lock())
+
+        await lane.acquire()
+
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.pool, functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            lane.release()
+            raise
+
+        # released when the job's actually done, even if whoever submitted it gets cancelled meanwhile
+        future.add_done_callback(lambda _: lane.release())
+
+        return await asyncio.shield(future)
+
+    def forget(self, key):
+
+        """
+        Drops the lane for `key`, once the game's finished.
+        """
+
+        lane = self.lanes.get(key)
+
+        if lane is not None and not lane.locked():
+            del self.lanes[key]
+
+    def close(self):
+        self.pool.shutdown(wait=False)
@@ -2,6 +2,8 @@
 import asyncio
 import discord
 
+from clients import metrics
+
 EDIT_INTERVAL = 2
 
 class DiscordClient:
@@ -16,6 +18,7 @@ class DiscordClient:
     
     def __init__(self, bot=None):
         self.ready = False
+        self.known_channels = set()
         
         if bot == None:
             self.bot = discord.Bot()
@@ -30,37 +33,102 @@ class DiscordClient:
         
         await self.bot.start(token)
     
-    async def send(self, channel_num: int, msg_str: str, embed: discord.Embed) -> discord.Message:
+    async def get_channel(self, channel_num: int) -> discord.abc.Messageable:
         
         """
-        Sends a message (`msg_str` & `embed`) to the given channel (`channel_num`).
+        Gets the channel `channel_num`, from the cache if possible.
         """
-
+        
         # Is channel in cache?
         channel = self.bot.get_channel(channel_num)
 
         # If it's not, fetch it
         if channel is None:
             channel = await self.bot.fetch_channel(channel_num)
-            got_channel = channel != None
         
         # Make sure we have a channel
         
-        assert got_channel, f"Couldn't find channel {channel_num}."
+        assert channel is not None, f"Couldn't find channel {channel_num}."
         
         # Add channel to cache
         
-        self.known_channels.append(channel_num)
+        self.known_channels.add(channel_num)
+        
+        return channel
+    
+    async def get_message(self, channel_num: int, message_id: int) -> discord.PartialMessage:
+        
+        """
+        Gets a handle to an existing message, e.g. one posted before a restart. Doesn't make a request for the message itself.
+        """
+        
+        channel = await self.get_channel(channel_num)
+        
+        return channel.get_partial_message(message_id)
+    
+    async def fetch_message(self, channel_num: int, message_id: int) -> discord.Message:
+        
+        """
+        Fetches an existing message in full. Unlike the handle from `get_message`, it can be edited with a `file`.
+        
+        Returns `None` if the message is gone (or we can't see it any more).
+        """
+        
+        channel = await self.get_channel(channel_num)
+        
+        try:
+            return await channel.fetch_message(message_id)
+        except discord.HTTPException as e:
+            print(f"Discord: Couldn't fetch message {message_id} in {channel_num}: {e!r}")
+            return None
+    
+    async def send(self, channel_num: int, msg_str: str, embed: discord.Embed, file: discord.File = None) -> discord.Message:
+        
+        """
+        Sends a message (`msg_str` & `embed`) to the given channel (`channel_num`).
+        
+        `file` is uploaded as an attachment - embeds can refer to it as `attachment://<filename>`.
+        """
+
+        channel = await self.get_channel(channel_num)
         
-        message = await channel.send(msg_str, embed=embed)
+        with metrics.DISCORD_LATENCY.time(op="send"):
+            if file is None:
+                message = await channel.send(msg_str, embed=embed)
+            else:
+                message = await channel.send(msg_str, embed=embed, file=file)
         
         return message
     
-    async def edit(self, message: discord.Message, msg_str: str, embed: discord.Embed, timeout=1) -> discord.Message:
+    async def edit(self, message: discord.Message, msg_str: str = None, embed: discord.Embed = None, file: discord.File = None, timeout=1) -> discord.Message:
+        
+        """
+        Edits `message`. Anything left as `None` is left as it was.
+        
+        If `file` is given, it replaces the message's existing attachments.
+        """
+        
+        fields = {}
+        
+        if msg_str is not None:
+            fields["content"] = msg_str
+        
+        if embed is not None:
+            fields["embed"] = embed
+        
+        if file is not None:
+            fields["file"] = file
+            fields["attachments"] = [] # drop the old image, otherwise they pile up
         
         try:
-            new_message = await asyncio.wait_for(message.edit(msg_str, embed=embed), timeout=timeout)
+            with metrics.DISCORD_LATENCY.time(op="edit"):
+                new_message = await asyncio.wait_for(message.edit(**fields), timeout=timeout)
         except asyncio.TimeoutError:
+            metrics.DROPPED_EDITS.inc()
+            return None
+        except (discord.HTTPException, TypeError) as e: # TypeError: a file on a PartialMessage, which can't carry one
+            print(f"Discord: Edit of message {message.id} failed: {e!r}")
+            metrics.DROPPED_EDITS.inc()
             return None
         
         return new_message
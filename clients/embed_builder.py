@@ -0,0 +1,55 @@
+from typing import NamedTuple, Optional
+
+import discord
+
+class EmbedTemplate(NamedTuple):
+
+    """
+    The parts of a game's embed that never change, computed once per game.
+
+    It's a tuple, so it can't be mutated - unlike the shared `EMBEDS` layout dicts.
+    Per update, `build` only has to fill in the result and the image.
+    """
+
+    description: str  # everything above the result line
+    links: str        # viewer links, shown next to the result once there is one
+    colour: int
+    author: tuple[str, str, str]  # name, url, icon_url
+
+    @classmethod
+    def from_layout(cls, layout: dict, description: str, links: str) -> "EmbedTemplate":
+
+        """
+        Creates a template from one of the layouts in `data/embeds.json`. The layout itself is only read.
+        """
+
+        author = layout.get("author", {})
+
+        return cls(
+            description,
+            links,
+            layout.get("color", 0),
+            (author.get("name"), author.get("url"), author.get("icon_url"))
+        )
+
+    def build(self, result: Optional[str], image_url: str, explorer: Optional[str] = None) -> discord.Embed:
+
+        """
+        Builds the embed for the current state of the game. A falsy `result` means the game is ongoing.
+
+        `explorer` is the opening explorer line for the current position, if there is one.
+        """
+
+        result_str = f"{result} {self.links}" if result else "Ongoing"
+        explorer_str = f"\n**Explorer:** {explorer}" if explorer else ""
+
+        embed = discord.Embed(description=f"{self.description}{explorer_str}\n**Result:** {result_str}", colour=self.colour)
+
+        name, url, icon_url = self.author
+
+        if name:
+            embed.set_author(name=name, url=url, icon_url=icon_url)
+
+        embed.set_image(url=image_url)
+
+        return embed
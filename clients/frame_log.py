@@ -0,0 +1,147 @@
+"""
+Append-only log of raw playtak protocol traffic, for reproducing incidents and for benchmarks.
+
+With `PLAYTAK_LOG=path` set, `PlaytakClient` logs every frame on the control connection (after login)
+and each `GameWatcher` logs every frame on its game's connection. `sim.replay_log` plays a log back
+through the bridge, at recorded speed or faster.
+
+On disk it's `MAGIC`, then records of `RECORD` followed by the frame's bytes. `stream` is 0 for the control
+connection, the game id for a watcher and `SESSION` for a process starting to log (the payload is the wall-clock time).
+Everything else is timed with `time.monotonic()`, which has an arbitrary starting point and restarts with every boot.
+Sessions on the same clock (watcher workers and the bot, say) share one timeline, later ones are laid end to end on replay.
+
+Every record is a single `os.write` to a file opened with `O_APPEND`, so processes logging to the same file
+never interleave mid-record, and nothing sits in a buffer waiting to be lost if the process is killed.
+
+    python -m clients.frame_log data/frames.log | less
+"""
+
+import argparse
+import atexit
+import fcntl
+import os
+import struct
+import threading
+import time
+
+from typing import Iterator, NamedTuple
+
+MAGIC = b"TAKLOG1\n"
+RECORD = struct.Struct("<dqI") # monotonic timestamp, stream, frame length
+
+CONTROL = 0
+SESSION = -1
+
+SAME_CLOCK = 1 # seconds - sessions whose wall-clock and monotonic gaps agree this closely share a timeline
+
+class Frame(NamedTuple):
+
+    time: float  # seconds since the start of the log, with sessions laid end to end
+    stream: int
+    data: str
+
+class FrameLog:
+
+    """
+    Appends frames to the log at `path`. Safe to share between connections, threads and processes.
+    """
+
+    def __init__(self, path: str):
+
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        # only the first process to open a new log writes the header
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                os.write(self.fd, MAGIC)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        self.lock = threading.Lock() # so the fd isn't closed under a write
+
+        self.record(SESSION, repr(time.time()))
+
+        atexit.register(self.close)
+
+    def record(self, stream: int, frame: str):
+
+        data = frame.encode()
+
+        with self.lock:
+
+            if self.fd is not None:
+                os.write(self.fd, RECORD.pack(time.monotonic(), stream, len(data)) + data)
+
+    def close(self):
+
+        with self.lock:
+
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+def read_log(path: str) -> Iterator[Frame]:
+
+    """
+    Yields every frame in the log at `path`, in order. Sessions on the clock of the one before share its timeline,
+    others pick up where it ended.
+    """
+
+    with open(path, "rb") as f:
+
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} isn't a frame log.")
+
+        offset = 0.0 # added to this session's timestamps
+        start = None # first timestamp of this session
+        wall = None  # and its wall-clock time
+        last = 0.0
+
+        while True:
+
+            header = f.read(RECORD.size)
+
+            if len(header) < RECORD.size:
+                return # the end, or a record cut short by a crash
+
+            stamp, stream, length = RECORD.unpack(header)
+            data = f.read(length)
+
+            if len(data) < length:
+                return
+
+            if stream == SESSION:
+
+                now = float(data)
+
+                # another process on the same clock, e.g. a watcher worker - its timestamps already line up
+                if wall is not None and abs((now - wall) - (stamp - start)) < SAME_CLOCK:
+                    continue
+
+                offset, start, wall = last, stamp, now
+                continue
+
+            if start is None: # no session marker, shouldn't happen, but the timestamps are still good relative to each other
+                start = stamp
+
+            last = offset + stamp - start
+
+            yield Frame(last, stream, data.decode(errors="replace"))
+
+# PLAYTAK_LOG turns the log on, for the whole process
+FRAME_LOG = FrameLog(os.environ["PLAYTAK_LOG"]) if os.environ.get("PLAYTAK_LOG") else None
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Print a playtak frame log.")
+    parser.add_argument("path")
+    parser.add_argument("--stream", type=int, default=None, help="only this stream (0 = control, else a game id)")
+
+    args = parser.parse_args()
+
+    for frame in read_log(args.path):
+
+        if args.stream is None or frame.stream == args.stream:
+            print(f"{frame.time:12.3f} {frame.stream:>8} {frame.data}")
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from tak import render
+from tak.board import TakBoard
+
+class ImageRenderer:
+
+    """
+    Renders board images locally, in a pool of worker processes.
+
+    Images are cached by `(size, zobrist_hash, highlight, theme)`, so repeated positions (undos, common openings) are free.
+    Concurrent requests for the same image share a single render.
+
+    Replays of finished games get their own pool and frame cache, so they never queue in front of live images.
+    A replay's frames are split into one chunk per replay worker (up to 4 by default) and rendered side by side.
+    """
+
+    def __init__(self, theme: str, workers: int = 2, cache_size: int = 1024, square: int = 48,
+                 replay_workers: int = None, replay_cache_size: int = 8192, replay_square: int = 32, max_replays: int = 2):
+
+        self.theme = theme
+        self.theme_key = hashlib.sha1(theme.encode()).hexdigest()[:12]
+        self.palette = render.theme_palette(theme)
+
+        self.workers = workers
+        self.cache_size = cache_size
+        self.square = square
+
+        self.cache = OrderedDict()  # key -> PNG bytes, least recently used first
+        self.pending = {}           # key -> future, for renders that are still running
+
+        self.pool = None
+
+        self.replay_workers = replay_workers or min(4, os.cpu_count() or 1)
+        self.replay_cache_size = replay_cache_size
+        self.replay_square = replay_square
+
+        self.frame_cache = OrderedDict()  # key -> GIF image block
+        self.replay_pool = None
+        self.replay_slots = asyncio.Semaphore(max_replays)  # finished games queue here on a busy evening
+
+    def get_pool(self) -> ProcessPoolExecutor:
+
+        # Created lazily, so importing this module doesn't spawn anything.
+        # Spawn, not fork - forking a process that's running an event loop (and discord's threads) is asking for trouble.
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        return self.pool
+
+    def get_replay_pool(self) -> ProcessPoolExecutor:
+
+        if self.replay_pool is None:
+            self.replay_pool = ProcessPoolExecutor(self.replay_workers, mp_context=multiprocessing.get_context("spawn"))
+
+        return self.replay_pool
+
+    def cache_key(self, size: int, zobrist_hash: int, highlight: tuple[int]) -> tuple:
+        return (size, zobrist_hash, highlight, self.theme_key)
+
+    async def render(self, board: TakBoard, highlight: tuple[int] = ()) -> bytes:
+
+        """
+        Returns a PNG of `board`, with the squares in `highlight` highlighted.
+
+        The snapshot is taken immediately, so the board is free to change while the image renders.
+        """
+
+        return await self.render_snapshot(render.snapshot(board), board.size, board.zobrist_hash, highlight)
+
+    async def render_snapshot(self, snapshot: tuple[str], size: int, zobrist_hash: int, highlight: tuple[int] = ()) -> bytes:
+
+        """
+        Like `render`, for a snapshot (`render.snapshot`) taken elsewhere - e.g. on the thread that owns the board.
+        """
+
+        key = self.cache_key(size, zobrist_hash, highlight)
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        if key in self.pending:
+            return await asyncio.shield(self.pending[key])
+
+        loop = asyncio.get_running_loop()
+
+        future = loop.run_in_executor(
+            self.get_pool(),
+            render.render_png,
+            snapshot,
+            size,
+            self.palette,
+            highlight,
+            self.square
+        )
+
+        self.pending[key] = future
+
+        try:
+            png = await asyncio.shield(future)
+        finally:
+            del self.pending[key]
+
+        self.cache[key] = png
+
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return png
+
+    async def render_replay(self, size: int, half_komi: int, moves: list[dict], delay: int = 80, end_delay: int = 400) -> bytes:
+
+        """
+        Renders an animated GIF of a whole game, replaying `moves` (in the `TakBoard` format) from the start.
+
+        `delay` is the time per move and `end_delay` the pause on the final position, both in hundredths of a second.
+        Frames are cached by position, so games sharing an opening only render it once.
+        """
+
+        async with self.replay_slots:
+
+            # replaying is pure python, keep it off the event loop
+            frames = await asyncio.to_thread(replay_snapshots, size, half_komi, moves)
+
+            loop = asyncio.get_running_loop()
+            pool = self.get_replay_pool()
+
+            keys = [(size, zobrist_hash, highlight, self.theme_key) for zobrist_hash, highlight, _ in frames]
+
+            missing = {}
+
+            for key, (_, highlight, board) in zip(keys, frames):
+
+                if key not in self.frame_cache and key not in missing:
+                    missing[key] = (board, highlight)
+
+            # one chunk per worker, so every core gets a share without paying the round trip per frame
+            todo = list(missing.items())
+            chunk = -(-len(todo) // self.replay_workers) or 1
+            chunks = [todo[i:i + chunk] for i in range(0, len(todo), chunk)]
+
+            jobs = [
+                loop.run_in_executor(pool, render_gif_frames, [frame for _, frame in part], size, self.replay_square)
+                for part in chunks
+            ]
+
+            rendered = {}
+
+            for part, blocks in zip(chunks, await asyncio.gather(*jobs)):
+                rendered.update(zip([key for key, _ in part], blocks))
+
+            blocks = []
+
+            for key in keys:
+
+                if key in rendered:
+                    self.frame_cache[key] = rendered[key]
+                else:
+                    self.frame_cache.move_to_end(key)
+
+                blocks.append(self.frame_cache[key])
+
+            while len(self.frame_cache) > self.replay_cache_size:
+                self.frame_cache.popitem(last=False)
+
+        side = size * self.replay_square + 2 * (self.replay_square // 4)
+        delays = [delay] * (len(blocks) - 1) + [end_delay]
+
+        return render.encode_gif(blocks, delays, side, side, self.palette)
+
+    def close(self, wait: bool = False):
+
+        """
+        Shuts the pools down. With `wait`, blocks until their processes have exited - needed if the interpreter's about to,
+        or a process that's still starting can find the pool gone from under it.
+        """
+
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait, cancel_futures=True)
+            self.pool = None
+
+        if self.replay_pool is not None:
+            self.replay_pool.shutdown(wait=wait, cancel_futures=True)
+            self.replay_pool = None
+
+def render_gif_frames(frames: list[tuple[tuple[str], tuple[int]]], size: int, square: int) -> list[bytes]:
+
+    """
+    Renders `(snapshot, highlight)` pairs to GIF image blocks, in a replay worker.
+    """
+
+    return [render.render_gif_frame(board, size, highlight, square) for board, highlight in frames]
+
+def replay_snapshots(size: int, half_komi: int, moves: list[dict]) -> list[tuple[int, tuple[int], tuple[str]]]:
+
+    """
+    Replays `moves` on a fresh board, returning `(zobrist_hash, highlight, snapshot)` for the start and after every move.
+
+    Undos are already folded into a watcher's move list, so playing forward is all that's needed.
+    """
+
+    board = TakBoard(size, half_komi)
+    player = "white"
+
+    frames = [(board.zobrist_hash, (), render.snapshot(board))]
+
+    for move in moves:
+
+        if board.legal_moves is None or not board.make_move(move, player):
+            break # illegal from here on, so there's nothing sensible left to draw
+
+        player = board.invert_player(player)
+
+        frames.append((board.zobrist_hash, render.move_squares(move), render.snapshot(board)))
+
+    return frames
@@ -0,0 +1,112 @@
+"""
+Event-loop lag monitor.
+
+A coroutine wakes up every `LAG_INTERVAL` seconds and measures how late it was woken up - the time the loop
+spent running something else. A watchdog thread watches the same ticks, and when the loop goes quiet for
+longer than `STALL_THRESHOLD` it grabs the loop thread's stack (`sys._current_frames`), catching whatever
+callback is blocking it in the act. Anything that blocks for long enough also holds up the Discord heartbeat.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from collections import deque
+from typing import NamedTuple
+
+from clients import metrics
+from clients.tracing import percentile
+
+LAG_INTERVAL = 0.1    # seconds between ticks
+STALL_THRESHOLD = 0.5 # a tick this late is a stall, and gets its stack captured
+LAG_HISTORY = 36000   # ticks kept for percentiles (an hour, give or take)
+STALL_HISTORY = 50
+
+LOOP_LAG = metrics.Histogram("namako_loop_lag_seconds", "How late the event loop ran a timer.")
+LOOP_STALLS = metrics.Counter("namako_loop_stalls_total", "Times the event loop was blocked for longer than the stall threshold.")
+
+class Stall(NamedTuple):
+
+    started: float # time.time() of the last tick before it
+    stack: str     # the loop thread's stack, at the time the watchdog noticed
+
+class LoopMonitor:
+
+    """
+    Measures event-loop lag, and captures stacks of whatever blocks the loop. Start it with `await monitor.run()`.
+    """
+
+    def __init__(self, interval: float = LAG_INTERVAL, threshold: float = STALL_THRESHOLD):
+
+        self.interval = interval
+        self.threshold = threshold
+
+        self.lags = deque(maxlen=LAG_HISTORY) # (time.monotonic(), lag)
+        self.stalls = deque(maxlen=STALL_HISTORY)
+
+        self.tick = time.monotonic()
+        self.loop_thread = None
+
+    async def run(self):
+
+        self.loop_thread = threading.get_ident()
+        threading.Thread(target=self.watchdog, name="loop-watchdog", daemon=True).start()
+
+        while True:
+
+            start = time.monotonic()
+            self.tick = start
+
+            await asyncio.sleep(self.interval)
+
+            now = time.monotonic()
+            lag = max(0.0, now - start - self.interval)
+
+            self.tick = now
+            self.lags.append((now, lag))
+            LOOP_LAG.observe(lag)
+
+    def watchdog(self):
+
+        caught = None # the tick we've already got a stack for, one per stall is plenty
+
+        while True:
+
+            time.sleep(self.threshold / 2)
+
+            tick = self.tick
+            blocked = time.monotonic() - tick
+
+            if blocked < self.threshold + self.interval or tick == caught:
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread)
+
+            if frame is None:
+                continue
+
+            caught = tick
+            stack = "".join(traceback.format_stack(frame))
+
+            self.stalls.append(Stall(time.time() - blocked, stack))
+            LOOP_STALLS.inc()
+
+            print(f"Event loop blocked for {blocked:.2f}s (so far), in:\n{stack}", file=sys.stderr)
+
+    def summary(self, window: float = 3600) -> dict[str, float]:
+
+        """
+        p50, p99 and max lag (in seconds) over the last `window` seconds. Empty if the monitor hasn't ticked yet.
+        """
+
+        cutoff = time.monotonic() - window
+        lags = sorted(lag for when, lag in list(self.lags) if when >= cutoff)
+
+        if not lags:
+            return {}
+
+        return {"p50": percentile(lags, 50), "p99": percentile(lags, 99), "max": lags[-1]}
+
+LOOP_MONITOR = LoopMonitor()
@@ -0,0 +1,245 @@
+"""
+Counters, gauges and histograms for the bridge, served in the Prometheus text format.
+
+Stdlib only - the endpoint is a bare-bones HTTP server on the bot's event loop:
+
+    curl http://127.0.0.1:9108/metrics
+"""
+
+import asyncio
+import bisect
+import threading
+import time
+
+from contextlib import contextmanager
+
+from tak import profiling
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds - from a fast board update up to a Discord edit that's about to time out
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = [] # every metric, in the order they're rendered
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+
+    """
+    A metric family, with one value per combination of label values. Safe to update from any thread.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+        self.values = {}
+        self.lock = threading.Lock()
+
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labels)
+
+    def remove(self, **labels):
+
+        with self.lock:
+            self.values.pop(self.key(labels), None)
+
+    def samples(self) -> list[str]:
+
+        with self.lock:
+            return [f"{self.name}{format_labels(self.labels, key)} {value:g}" for key, value in self.values.items()]
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples())
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def get(self, **labels) -> float:
+
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def inc(self, amount: float = 1, **labels):
+
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+
+        key = self.key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+
+            counts = self.values.get(key)
+
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0] # per-bucket counts (+Inf last), sum
+
+            counts[0][slot] += 1
+            counts[1] += value
+
+    def count(self, **labels) -> int:
+
+        with self.lock:
+            counts = self.values.get(self.key(labels))
+            return sum(counts[0]) if counts else 0
+
+    @contextmanager
+    def time(self, **labels):
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[str]:
+
+        lines = []
+
+        with self.lock:
+
+            for key, (counts, total) in self.values.items():
+
+                cumulative = 0
+
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    labels = format_labels(self.labels, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total:g}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+
+        return lines
+
+class Collected(Metric):
+
+    """
+    A metric whose values are read from somewhere else (`collect() -> {label values: value}`) whenever it's rendered.
+    """
+
+    def __init__(self, name: str, help: str, kind: str, labels: tuple, collect):
+
+        super().__init__(name, help, labels)
+
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{format_labels(self.labels, key)} {value:g}" for key, value in self.collect().items()]
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+#? The bridge's metrics
+
+FRAMES = Counter("namako_frames_received_total", "Frames received from playtak.", ("source",))
+QUEUE_DEPTH = Gauge("namako_frame_queue_depth", "Frames a watcher found waiting when it last read its queue.", ("game",))
+MAKE_MOVE_TIME = Histogram("namako_make_move_seconds", "Time spent applying a server move to the board.")
+EMBED_BUILD_TIME = Histogram("namako_embed_build_seconds", "Time spent building a game's embed.")
+DISCORD_LATENCY = Histogram("namako_discord_request_seconds", "Discord message send/edit latency.", ("op",))
+DROPPED_EDITS = Counter("namako_discord_dropped_edits_total", "Edits abandoned after timing out.")
+LIVE_WATCHERS = Gauge("namako_live_watchers", "GameWatchers currently running.")
+
+if profiling.ENABLED: # TAK_PROFILE=1, see tak.profiling
+    ENGINE_CALLS = Collected(
+        "namako_engine_calls_total", "TakBoard method calls.", "counter", ("method",),
+        lambda: {(name,): calls for name, (calls, total) in profiling.snapshot().items()}
+    )
+    ENGINE_TIME = Collected(
+        "namako_engine_seconds_total", "Time spent in TakBoard methods (inclusive).", "counter", ("method",),
+        lambda: {(name,): total for name, (calls, total) in profiling.snapshot().items()}
+    )
+
+#? Endpoint
+
+async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+
+    try:
+
+        request = await reader.readline()
+
+        while (await reader.readline()).strip(): # skip the headers
+            pass
+
+        parts = request.decode(errors="replace").split()
+
+        if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+            status, content_type, body = "200 OK", CONTENT_TYPE, render().encode()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"Not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    except ConnectionError:
+        pass
+
+    finally:
+        writer.close()
+
+async def serve(host: str = "127.0.0.1", port: int = 9108):
+
+    """
+    Serves `/metrics` until cancelled.
+    """
+
+    server = await asyncio.start_server(handle_request, host, port)
+
+    async with server:
+        await server.serve_forever()
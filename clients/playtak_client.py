@@ -1,17 +1,63 @@
 
 import aiohttp
 import asyncio
+import json
+import os
+import random
+import time
 import websockets
 
 from typing import Optional
 
+from clients import metrics
+from clients.frame_log import CONTROL, FRAME_LOG
+
+# PLAYTAK_URI points the bot somewhere else, e.g. the local stand-in in `sim.playtak_server`
+URI = os.environ.get("PLAYTAK_URI", "ws://playtak.com:9999/ws")
+
+# NAMAKO_STATE_DIR moves everything the bot writes (state, position index, rankings) out of data/, e.g. for sim.bench
+STATE_DIR = os.environ.get("NAMAKO_STATE_DIR", "data")
+
+# Put on the message queue after every (re)login - the server sends a fresh GameList snapshot right after it
+CONNECTED = "Connected"
+
+PING_INTERVAL = 20  # seconds between PINGs
+LIVENESS_TIMEOUT = 60 # no message from the server for this long means the connection is dead
+LOGIN_TIMEOUT = 30
+
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+HEALTHY_AFTER = 60 # a connection that lasted this long starts the backoff over
+
+# HTTP APIs: one pooled session per client, kept-alive connections, at most HTTP_CONCURRENCY requests in flight
+HTTP_CONNECTIONS = 8
+HTTP_CONCURRENCY = 4
+HTTP_TIMEOUT = 15 # seconds, per request
+
+RANKINGS_URL = "https://playtak.com/ratinglist.json"
+RANKINGS_PATH = os.path.join(STATE_DIR, "rankings.json") # last rankings we got, so startup doesn't wait on the download
+RANKINGS_REFRESH = 3600 # seconds between refreshes
+
+class LoginError(Exception):
+    """
+    The server didn't accept the login (wrong credentials, or a re-login it turned down).
+    """
+
 class PlaytakClient:
     
     def __init__(self):
         
         self.rankings = {}
+        self.rankings_validators = {} # ETag / Last-Modified of the list the rankings came from
+        self.refresher = None
         
         self.ws = None
+        self.messages = asyncio.Queue() # everything the server sends, in order, across reconnects
+        self.last_message = time.monotonic()
+        self.connected_at = None # when the current connection logged in
+        
+        self.session = None # created on first use, it has to be made inside the event loop
+        self.http_slots = asyncio.Semaphore(HTTP_CONCURRENCY)
         
         self.ready = False
     
@@ -25,27 +71,75 @@ class PlaytakClient:
         try:
             msg = await asyncio.wait_for(self.ws.recv(), timeout=timeout)
             msg = msg.decode()[:-1] # Removes the linefeed
+            self.last_message = time.monotonic()
             
         except asyncio.exceptions.TimeoutError:
             return None
 
         return msg
     
+    async def next_message(self) -> str:
+        return await self.messages.get()
+    
     #? Main function loop
     
     async def main(self, username, password):
         
-        async with websockets.connect("ws://playtak.com:9999/ws", subprotocols=["binary"], ping_timeout=None) as ws:
+        self.load_rankings()
+        self.refresher = asyncio.create_task(self.refresh_rankings())
+        
+        attempt = 0
+        
+        while True:
             
-            self.ws = ws
+            self.connected_at = None
+            
+            try:
+                await self.connect(username, password)
+            
+            except (websockets.ConnectionClosed, OSError, asyncio.TimeoutError, LoginError) as e:
+                print(f"Playtak: Lost connection: {e!r}")
+            
+            # Only a connection that stayed up a while resets the backoff - not one the server closes straight away
+            
+            if self.connected_at is not None and time.monotonic() - self.connected_at >= HEALTHY_AFTER:
+                attempt = 0
             
-            await self.log_into_playtak(username, password)
+            # Back off (with jitter) and log in again
             
-            await self.update_rankings()
+            attempt += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+    
+    async def connect(self, username, password):
+        
+        # Runs one connection until it drops
+        
+        async with websockets.connect(URI, subprotocols=["binary"], ping_timeout=None) as ws:
+            
+            self.ws = ws
+            self.last_message = time.monotonic()
+            
+            await asyncio.wait_for(self.log_into_playtak(username, password), timeout=LOGIN_TIMEOUT)
             
             self.ready = True
+            self.connected_at = time.monotonic()
+            self.messages.put_nowait(CONNECTED)
+            
+            tasks = [
+                asyncio.create_task(self.read_messages()),
+                asyncio.create_task(self.keep_alive()), # Makes sure the Tak server gets its oh so important PINGs
+                asyncio.create_task(self.watchdog()),
+            ]
+            
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
             
-            await self.keep_alive() # Keeps the connection alive, makes sure the Tak server gets its oh so important PINGs
+            for task in done:
+                task.result() # raises the ConnectionClosed, if that's what ended it
     
     async def log_into_playtak(self, username: str, password: str):
     
@@ -61,42 +155,154 @@ class PlaytakClient:
         welcome_msg = f"Welcome {username}!" # Once we get this, we know that we've logged in
         login_msg   = await self.rec()
 
-        assert login_msg == welcome_msg, "Invalid username or password!" # If we don't... well, you've messed up the login sequence
+        if login_msg != welcome_msg: # If we don't... well, you've messed up the login sequence
+            raise LoginError(f"Invalid username or password! Expected {welcome_msg!r}, got {login_msg!r}")
 
         print(f"Playtak: Logged in as {username}!") # Show that we've logged into the account
     
+    async def read_messages(self):
+        
+        async for msg in self.ws:
+            metrics.FRAMES.inc(source="control")
+            self.last_message = time.monotonic()
+            msg = msg.decode()[:-1] # Removes the linefeed
+            
+            if FRAME_LOG:
+                FRAME_LOG.record(CONTROL, msg)
+            
+            self.messages.put_nowait(msg)
+    
     async def keep_alive(self):
         
         while True:
             
-            await asyncio.sleep(20)
+            await asyncio.sleep(PING_INTERVAL)
             
             await self.send("PING")
     
+    async def watchdog(self):
+        
+        # The server answers every PING, so a silent connection is a dead one (even if TCP hasn't noticed yet)
+        
+        while True:
+            
+            await asyncio.sleep(PING_INTERVAL)
+            
+            silent = time.monotonic() - self.last_message
+            
+            if silent > LIVENESS_TIMEOUT:
+                raise asyncio.TimeoutError(f"no message from playtak in {silent:.0f}s")
+    
+    #? HTTP
+    
+    def get_session(self) -> aiohttp.ClientSession:
+        
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_CONNECTIONS, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+            )
+        
+        return self.session
+    
+    async def get_json(self, url: str):
+        
+        # Returns None if the request fails, times out or doesn't come back with a 200
+        
+        async with self.http_slots:
+            try:
+                async with self.get_session().get(url) as r:
+                    
+                    if r.status == 200:
+                        return await r.json(content_type=None)
+            
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e: # ValueError: a 200 that isn't JSON, e.g. an error page
+                print(f"Playtak: GET {url} failed: {e!r}")
+        
+        return None
+    
+    async def close(self):
+        
+        if self.refresher is not None:
+            self.refresher.cancel()
+        
+        if self.session is not None:
+            await self.session.close()
+    
     #? Extra features
     
     async def get_playtak_game(self, game_id: int) -> dict:
-
-        url = f"https://api.playtak.com/v1/games-history/{game_id}"
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-
-                if r.status == 200:
-                    js = await r.json()
-                    return js
+        return await self.get_json(f"https://api.playtak.com/v1/games-history/{game_id}")
+    
+    #? Rankings
+    
+    def load_rankings(self):
+        
+        try:
+            with open(RANKINGS_PATH) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return # no snapshot yet, the first refresh fills them in
+        
+        self.rankings = {name: tuple(value) for name, value in snapshot["rankings"].items()}
+        self.rankings_validators = snapshot.get("validators", {})
     
-    async def update_rankings(self):
+    def save_rankings(self):
+        
+        # write then rename, so a crash never leaves half a snapshot behind
+        with open(RANKINGS_PATH + ".tmp", "w") as f:
+            json.dump({"validators": self.rankings_validators, "rankings": self.rankings}, f)
         
-        url = "https://playtak.com/ratinglist.json"
+        os.replace(RANKINGS_PATH + ".tmp", RANKINGS_PATH)
     
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
+    async def refresh_rankings(self):
+        
+        while True:
             
-                if r.status == 200:
-                    js = await r.json()
-                
-        self.rankings = {}
+            try:
+                await self.update_rankings()
+            except Exception as e: # a list we can't make sense of - keep the old one, and try again next time
+                print(f"Playtak: Rankings refresh failed: {e!r}")
+            
+            await asyncio.sleep(RANKINGS_REFRESH)
+    
+    async def update_rankings(self) -> bool:
+        
+        # Conditional GET - if the list hasn't changed since last time, the server just says so (304)
+        # Returns whether the rankings changed
+        
+        headers = {}
+        
+        if "etag" in self.rankings_validators:
+            headers["If-None-Match"] = self.rankings_validators["etag"]
+        if "last_modified" in self.rankings_validators:
+            headers["If-Modified-Since"] = self.rankings_validators["last_modified"]
+        
+        async with self.http_slots:
+            try:
+                async with self.get_session().get(RANKINGS_URL, headers=headers) as r:
+                    
+                    if r.status != 200: # 304, or the server's having a bad day - either way, keep what we've got
+                        return False
+                    
+                    js = await r.json(content_type=None)
+                    validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+            
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                print(f"Playtak: GET {RANKINGS_URL} failed: {e!r}")
+                return False
+        
+        # built on the side and swapped in at once, so ratingStr never sees half a list
+        self.rankings = self.build_rankings(js)
+        self.rankings_validators = {key: value for key, value in validators.items() if value}
+        
+        await asyncio.to_thread(self.save_rankings)
+        
+        return True
+    
+    def build_rankings(self, js: list) -> dict:
+        
+        rankings = {}
         
         rank = 1
         
@@ -105,10 +311,12 @@ class PlaytakClient:
             
             rank_val = rank if name[-3:] != "Bot" else None
             
-            self.rankings[name] = (rank_val, player[1])
+            rankings[name] = (rank_val, player[1])
             
             if rank_val:
                 rank += 1
+        
+        return rankings
     
     def parse_msg(self, msg: str) -> dict:
         
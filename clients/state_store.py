@@ -0,0 +1,122 @@
+import json
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    guild_id   INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS games (
+    game_id  INTEGER PRIMARY KEY,
+    data     TEXT NOT NULL,
+    header   TEXT NOT NULL,
+    moves    TEXT NOT NULL DEFAULT '[]',
+    finished INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    game_id    INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (game_id, channel_id)
+);
+
+CREATE TABLE IF NOT EXISTS filters (
+    guild_id INTEGER PRIMARY KEY,
+    filter   TEXT NOT NULL
+);
+"""
+
+class StateStore:
+
+    """
+    Keeps the bridge's state in a local SQLite database (WAL mode), so a restart can pick up where it left off.
+
+    Stores the output channel and game filter for each guild, and for each game: its parameters, the moves so far
+    (as playtak server moves, e.g. `["P", "A1"]`) and the ids of the messages posted about it.
+
+    Writes are small and happen on the event loop - with WAL and `synchronous=NORMAL` they don't wait on a disk flush.
+    """
+
+    def __init__(self, path: str):
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    #? Guilds
+
+    def load_channels(self) -> dict[int, int]:
+        return dict(self.connection.execute("SELECT guild_id, channel_id FROM channels"))
+
+    def set_channel(self, guild_id: int, channel_id: int):
+
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO channels VALUES (?, ?)", (guild_id, channel_id))
+
+    def load_filters(self) -> dict[int, dict]:
+        return {guild_id: json.loads(saved) for guild_id, saved in self.connection.execute("SELECT guild_id, filter FROM filters")}
+
+    def set_filter(self, guild_id: int, saved: dict | None):
+
+        # None clears it, the guild gets every game again
+        with self.connection:
+            if saved is None:
+                self.connection.execute("DELETE FROM filters WHERE guild_id = ?", (guild_id,))
+            else:
+                self.connection.execute("INSERT OR REPLACE INTO filters VALUES (?, ?)", (guild_id, json.dumps(saved)))
+
+    #? Games
+
+    def save_game(self, game_id: int, data: dict, header: str):
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO games (game_id, data, header) VALUES (?, ?, ?)",
+                (game_id, json.dumps(data), header)
+            )
+
+    def save_message(self, game_id: int, channel_id: int, message_id: int):
+
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO messages VALUES (?, ?, ?)", (game_id, channel_id, message_id))
+
+    def save_moves(self, game_id: int, moves: list[list[str]]):
+
+        # the whole list is rewritten, it's a few hundred bytes at most
+        with self.connection:
+            self.connection.execute("UPDATE games SET moves = ? WHERE game_id = ?", (json.dumps(moves), game_id))
+
+    def finish_game(self, game_id: int):
+
+        with self.connection:
+            self.connection.execute("UPDATE games SET finished = 1 WHERE game_id = ?", (game_id,))
+            self.connection.execute("DELETE FROM messages WHERE game_id = ?", (game_id,))
+
+    def load_games(self) -> list[dict]:
+
+        """
+        Returns every unfinished game as `{"game_id", "data", "header", "moves", "messages": [(channel_id, message_id), ...]}`.
+        """
+
+        games = []
+
+        for game_id, data, header, moves in self.connection.execute("SELECT game_id, data, header, moves FROM games WHERE finished = 0"):
+
+            messages = self.connection.execute("SELECT channel_id, message_id FROM messages WHERE game_id = ?", (game_id,)).fetchall()
+
+            games.append({
+                "game_id": game_id,
+                "data": json.loads(data),
+                "header": header,
+                "moves": json.loads(moves),
+                "messages": messages
+            })
+
+        return games
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,150 @@
+"""
+Per-guild filters on which games get announced, compiled into an index so a new game is matched against
+every guild at once.
+
+Each guild gets a bit. For every filter field the index keeps, per possible value, a mask of the guilds that
+accept it - so matching a game is a handful of dict lookups and a bisect, ANDed together, however many guilds there are.
+Guilds without a filter get everything, as before.
+"""
+
+from bisect import bisect_right
+from typing import NamedTuple
+
+class Filter(NamedTuple):
+
+    sizes: frozenset = frozenset()   # board sizes, empty for any
+    min_rating: int = 0              # both players rated at least this, 0 for any
+    tournament: bool = None          # True for tournament games only, False for none, None for either
+    rated: bool = None               # likewise, for rated games
+    players: frozenset = frozenset() # lowercase names, at least one of them playing, empty for anyone
+
+    def to_dict(self) -> dict:
+        return self._asdict() | {"sizes": sorted(self.sizes), "players": sorted(self.players)}
+
+    @classmethod
+    def from_dict(cls, saved: dict) -> "Filter":
+        return cls(**saved | {"sizes": frozenset(saved["sizes"]), "players": frozenset(saved["players"])})
+
+    def describe(self) -> str:
+
+        parts = []
+
+        if self.sizes:
+            parts.append("sizes " + ", ".join(f"{size}x{size}" for size in sorted(self.sizes)))
+        if self.min_rating:
+            parts.append(f"both players rated {self.min_rating}+")
+        if self.tournament is not None:
+            parts.append("tournament games" if self.tournament else "no tournament games")
+        if self.rated is not None:
+            parts.append("rated games" if self.rated else "unrated games")
+        if self.players:
+            parts.append("games with " + ", ".join(sorted(self.players)))
+
+        return "; ".join(parts) or "every game"
+
+class SubscriptionIndex:
+
+    """
+    The filters for a set of guilds, compiled for matching. Immutable - `Subscriptions` builds a new one on every change.
+    """
+
+    def __init__(self, filters: dict[int, Filter]):
+
+        self.guilds = list(filters)
+
+        self.any_size = 0
+        self.by_size = {}
+
+        self.thresholds = [] # minimum ratings, ascending
+        self.at_most = []    # at_most[i] = guilds whose minimum is thresholds[i] or lower
+
+        self.tournament = {0: 0, 1: 0} # the server's flag -> guilds that accept it
+        self.unrated = {0: 0, 1: 0}
+
+        self.any_player = 0
+        self.by_player = {}
+
+        minimums = []
+
+        for bit, game_filter in enumerate(filters.values()):
+
+            mask = 1 << bit
+
+            if game_filter.sizes:
+                for size in game_filter.sizes:
+                    self.by_size[size] = self.by_size.get(size, 0) | mask
+            else:
+                self.any_size |= mask
+
+            minimums.append((game_filter.min_rating, mask))
+
+            for flag in (0, 1):
+                if game_filter.tournament is None or game_filter.tournament == bool(flag):
+                    self.tournament[flag] |= mask
+                if game_filter.rated is None or game_filter.rated != bool(flag):
+                    self.unrated[flag] |= mask
+
+            if game_filter.players:
+                for player in game_filter.players:
+                    self.by_player[player] = self.by_player.get(player, 0) | mask
+            else:
+                self.any_player |= mask
+
+        accepted = 0
+
+        for minimum, mask in sorted(minimums):
+            accepted |= mask
+            self.thresholds.append(minimum)
+            self.at_most.append(accepted)
+
+    def match(self, data: dict, rating: int) -> list[int]:
+
+        """
+        The guilds that want the game `data` (as from `PlaytakClient.parse_game_params`), whose lower-rated player has `rating`.
+        """
+
+        mask = self.any_size | self.by_size.get(data["size"], 0)
+        mask &= self.tournament.get(data["tournament"], 0) & self.unrated.get(data["unrated"], 0)
+        mask &= self.any_player | self.by_player.get(data["player_1"].lower(), 0) | self.by_player.get(data["player_2"].lower(), 0)
+
+        accepted = bisect_right(self.thresholds, rating)
+        mask &= self.at_most[accepted - 1] if accepted else 0
+
+        return [guild for bit, guild in enumerate(self.guilds) if mask >> bit & 1]
+
+class Subscriptions:
+
+    """
+    Every guild's filter, kept in the state store, with the index rebuilt whenever one changes.
+    """
+
+    def __init__(self, store):
+
+        self.store = store
+        self.filters = {guild: Filter.from_dict(saved) for guild, saved in store.load_filters().items()}
+        self.index = SubscriptionIndex({})
+
+    def rebuild(self, guilds):
+
+        # every guild with a channel is in the index, those without a filter take everything
+        self.index = SubscriptionIndex({guild: self.filters.get(guild, Filter()) for guild in guilds})
+
+    def set(self, guild: int, game_filter: Filter, guilds):
+
+        if game_filter == Filter():
+            self.filters.pop(guild, None)
+            self.store.set_filter(guild, None)
+        else:
+            self.filters[guild] = game_filter
+            self.store.set_filter(guild, game_filter.to_dict())
+
+        self.rebuild(guilds)
+
+    def get(self, guild: int) -> Filter:
+        return self.filters.get(guild, Filter())
+
+    def match(self, data: dict, rankings: dict) -> list[int]:
+
+        ratings = [(rankings.get(data[player]) or (None, None))[1] or 0 for player in ("player_1", "player_2")]
+
+        return self.index.match(data, min(ratings))
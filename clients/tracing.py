@@ -0,0 +1,138 @@
+"""
+End-to-end latency of every move, from the playtak frame arriving to the Discord edit finishing.
+
+Each move gets a `MoveTrace` with four timestamps (`time.monotonic()`), so the total splits into
+time spent queued and in the engine, rendering and building the embed, and waiting on Discord.
+Only moves that made it into at least one message are traced.
+
+Traces are kept for `TRACE_WINDOW` seconds, up to `TRACE_LIMIT` of them - if that's not enough for a busy evening,
+`covered` says how far back they actually go.
+"""
+
+import json
+import math
+import threading
+import time
+
+from collections import deque
+from typing import NamedTuple, Optional
+
+TRACE_WINDOW = 3600   # seconds of traces kept
+TRACE_LIMIT = 200000  # and at most this many, about 40 MB
+
+STAGES = ("engine", "embed", "discord", "total")
+
+class MoveTrace(NamedTuple):
+
+    game: int
+    ply: int
+    received: float  # frame read off the socket
+    applied: float   # move made on the board
+    built: float     # image rendered and embed built
+    edited: float    # every message edited (or given up on)
+
+    @property
+    def stages(self) -> dict[str, float]:
+
+        return {
+            "engine": self.applied - self.received, # includes time spent waiting in the frame queue
+            "embed": self.built - self.applied,
+            "discord": self.edited - self.built,
+            "total": self.edited - self.received
+        }
+
+def percentile(values: list[float], p: float) -> float:
+
+    """
+    Nearest-rank percentile of `values`, which must be sorted.
+    """
+
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+class TraceBuffer:
+
+    """
+    The move traces of the last `window` seconds (at most `limit` of them), oldest first. Safe to use from any thread.
+    """
+
+    def __init__(self, window: float = TRACE_WINDOW, limit: int = TRACE_LIMIT):
+
+        self.window = window
+        self.traces = deque(maxlen=limit)
+        self.lock = threading.Lock()
+
+        self.forward = None # called with every trace instead, e.g. to send a watcher worker's traces to the bot
+
+    def record(self, trace: MoveTrace):
+
+        if self.forward is not None:
+            self.forward(trace)
+            return
+
+        cutoff = time.monotonic() - self.window
+
+        with self.lock:
+
+            self.traces.append(trace)
+
+            while self.traces and self.traces[0].edited < cutoff:
+                self.traces.popleft()
+
+    def covered(self) -> float:
+
+        """
+        How many seconds back the traces go without a gap: `window`, unless `limit` has pushed some of those out.
+        """
+
+        with self.lock:
+
+            if len(self.traces) < self.traces.maxlen:
+                return self.window
+
+            return time.monotonic() - self.traces[0].edited
+
+    def recent(self, window: Optional[float] = None) -> list[MoveTrace]:
+
+        """
+        The traces of moves edited in the last `window` seconds (all of them, if `window` is `None`), oldest first.
+        """
+
+        with self.lock:
+            traces = list(self.traces)
+
+        if window is None:
+            return traces
+
+        cutoff = time.monotonic() - window
+
+        return [trace for trace in traces if trace.edited >= cutoff]
+
+    def summary(self, window: float = 3600) -> dict[str, tuple[float, float]]:
+
+        """
+        p50 and p99 (in seconds) of each stage, for moves in the last `window` seconds. Empty if there were none.
+        """
+
+        traces = self.recent(window)
+
+        if not traces:
+            return {}
+
+        stages = [trace.stages for trace in traces]
+        result = {}
+
+        for stage in STAGES:
+            values = sorted(s[stage] for s in stages)
+            result[stage] = (percentile(values, 50), percentile(values, 99))
+
+        return result
+
+    def dump(self) -> str:
+
+        """
+        Every trace kept as JSON lines, with the stage durations filled in.
+        """
+
+        return "".join(json.dumps(trace._asdict() | trace.stages) + "\n" for trace in self.recent())
+
+TRACES = TraceBuffer()
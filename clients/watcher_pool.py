@@ -0,0 +1,519 @@
+"""
+GameWatchers sharded across worker processes, so a busy evening can use more than one core.
+
+The coordinator (the bot's own process) keeps the Discord connection and the GameList feed, and hands each game
+to worker `game_id % workers`. Workers run ordinary `GameWatcher`s, with a `RemoteDiscordClient` that sends
+their messages and edits back to the coordinator to be made for real. Everything goes over a local Unix socket,
+as length-prefixed pickles.
+
+Workers share the state store (SQLite in WAL mode is fine with several processes), so a worker that dies is
+restarted and picks its games back up just like the whole bot does after a restart.
+
+Workers aren't daemonic - they need their own pools for rendering - so `WatcherPool.close` has to be called on the way out.
+"""
+
+import asyncio
+import io
+import itertools
+import multiprocessing
+import os
+import pickle
+import shutil
+import signal
+import struct
+import tempfile
+
+from collections import OrderedDict
+from typing import NamedTuple
+
+import discord
+
+from clients.tracing import TRACES, MoveTrace
+
+LENGTH = struct.Struct("<I")
+
+STOP_TIMEOUT = 5 # seconds a worker gets to wind down before it's terminated
+
+MESSAGE_CACHE = 4096 # full messages the coordinator keeps for editing, most recently used
+
+#? IPC
+
+async def write_message(writer: asyncio.StreamWriter, message) -> None:
+
+    data = pickle.dumps(message)
+    writer.write(LENGTH.pack(len(data)) + data)
+
+    await writer.drain()
+
+async def read_message(reader: asyncio.StreamReader):
+
+    length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+
+    return pickle.loads(await reader.readexactly(length))
+
+def pack_file(file: discord.File):
+
+    # discord.File wraps a stream, only the bytes survive the trip
+    return None if file is None else (file.filename, file.fp.read())
+
+def unpack_file(packed) -> discord.File:
+    return None if packed is None else discord.File(io.BytesIO(packed[1]), filename=packed[0])
+
+#? Worker side
+
+class RemoteMessage(NamedTuple):
+
+    """
+    A message the coordinator sent for us. Stands in for `discord.Message` - watchers only ever need its id.
+    """
+
+    channel_id: int
+    id: int
+
+class RemoteDiscordClient:
+
+    """
+    The parts of `DiscordClient` a `GameWatcher` uses, done by the coordinator.
+    """
+
+    def __init__(self, worker: "Worker"):
+        self.worker = worker
+
+    async def send(self, channel_num: int, msg_str: str, embed: discord.Embed, file: discord.File = None) -> RemoteMessage:
+
+        message_id = await self.worker.request("send", channel_num, msg_str, embed.to_dict(), pack_file(file))
+
+        return RemoteMessage(channel_num, message_id)
+
+    async def get_message(self, channel_num: int, message_id: int) -> RemoteMessage:
+        return RemoteMessage(channel_num, message_id)
+
+    async def fetch_message(self, channel_num: int, message_id: int) -> RemoteMessage:
+        return RemoteMessage(channel_num, message_id) # the coordinator fetches it when it's first edited
+
+    async def edit(self, message: RemoteMessage, msg_str: str = None, embed: discord.Embed = None, file: discord.File = None, timeout=1) -> RemoteMessage:
+
+        try:
+            edited = await self.worker.request(
+                "edit", message.channel_id, message.id, msg_str, embed.to_dict() if embed is not None else None, pack_file(file), timeout
+            )
+        except ConnectionError: # the coordinator's going away, like any other failed edit
+            return None
+
+        return message if edited else None
+
+class Worker:
+
+    """
+    Runs the watchers for one shard. Lives in its own process, see `worker_main`.
+    """
+
+    def __init__(self, index: int, workers: int, path: str, state_path: str):
+
+        self.index = index
+        self.workers = workers
+        self.path = path
+        self.state_path = state_path
+
+        self.watchers = {} # game id -> (GameWatcher, task)
+        self.restored = {} # game id -> GameWatcher, waiting for the coordinator to resume (or finish) it
+        self.tasks = set()
+
+        self.requests = {} # request id -> future
+        self.ids = itertools.count()
+
+    async def run(self):
+
+        # imported here, so the coordinator doesn't pay for (or spawn) anything a worker needs
+        from clients.GameWatcher import GameWatcher
+        from clients.state_store import StateStore
+
+        self.GameWatcher = GameWatcher
+        self.store = StateStore(self.state_path)
+        self.discord_cl = RemoteDiscordClient(self)
+
+        reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.write_lock = asyncio.Lock()
+
+        await self.send(("hello", self.index))
+
+        # the coordinator keeps the traces, so /latency covers every worker (time.monotonic() is system-wide)
+        TRACES.forward = lambda trace: self.background(self.send(("trace", tuple(trace))))
+
+        self.background(self.restore())
+
+        # terminated by the coordinator, wind down the same way as when it goes away
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+        try:
+            await self.serve(reader)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.shutdown()
+
+    async def serve(self, reader: asyncio.StreamReader):
+
+        while True:
+
+            try:
+                message = await read_message(reader)
+            except asyncio.IncompleteReadError:
+                return # the coordinator's gone, and so are we
+
+            match message:
+
+                case ("reply", request_id, ok, result):
+                    future = self.requests.pop(request_id, None)
+
+                    if future is None: # not one of ours, shouldn't happen since the coordinator drops stale replies
+                        continue
+
+                    if ok:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(RuntimeError(result))
+
+                case ("watch", data, header, guilds):
+                    self.watch(self.GameWatcher(data, header, self.discord_cl, guilds, self.store))
+
+                case ("resume", game_id, guilds) if game_id in self.restored:
+                    gw = self.restored.pop(game_id)
+                    gw.guilds = guilds # only needed if it never got as far as announcing
+                    self.watch(gw)
+
+                case ("finish", game_id, result):
+                    self.background(self.finish(game_id, result))
+
+    async def shutdown(self):
+
+        # the games stay in the state store, to be picked up by whoever watches them next
+        for gw, task in list(self.watchers.values()):
+            await gw.stop(task)
+
+        # and nothing's left to start a render behind the renderer's back
+        tasks = self.tasks | self.GameWatcher.replays
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        from clients.GameWatcher import PLAYTAK_API, RENDERER
+
+        await asyncio.to_thread(RENDERER.close, True) # its processes would outlive us otherwise
+        await PLAYTAK_API.close()
+
+    async def send(self, message):
+
+        async with self.write_lock:
+            await write_message(self.writer, message)
+
+    async def request(self, op: str, *args):
+
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+
+        self.requests[request_id] = future
+        await self.send(("request", request_id, op, args))
+
+        return await future
+
+    def background(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task) # hard reference, like NamakoBot
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def watch(self, gw):
+        task = self.background(gw.start())
+        self.watchers[gw.gameId] = (gw, task)
+        task.add_done_callback(lambda _: self.ended(gw.gameId))
+
+    def ended(self, game_id: int):
+        self.watchers.pop(game_id, None)
+        self.background(self.send(("ended", game_id)))
+
+    async def restore(self):
+
+        # our share of the games that were running before a restart (or before this worker died)
+        for saved in self.store.load_games():
+
+            if saved["game_id"] % self.workers != self.index:
+                continue
+
+            gw = await self.GameWatcher.restore(saved, self.discord_cl, {}, self.store)
+            await gw.reattach(saved["messages"])
+            self.restored[gw.gameId] = gw
+
+        await self.send(("restored", list(self.restored)))
+
+    async def finish(self, game_id: int, result: str):
+
+        if game_id in self.restored:
+            gw = self.restored.pop(game_id)
+
+        elif game_id in self.watchers:
+            gw, task = self.watchers[game_id]
+
+            if gw.finished:
+                return
+
+            await gw.stop(task)
+
+        else:
+            return
+
+        gw.data["result"] = result
+        await gw.cleanUp()
+
+        await self.send(("ended", game_id))
+
+def worker_main(index: int, workers: int, path: str, state_path: str):
+    asyncio.run(Worker(index, workers, path, state_path).run())
+
+async def wait_for_exit(process: multiprocessing.Process):
+
+    # the sentinel becomes readable when the process ends - unlike a thread stuck in join(), this can be cancelled
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+
+    loop.add_reader(process.sentinel, lambda: exited.done() or exited.set_result(None))
+
+    try:
+        await exited
+    finally:
+        loop.remove_reader(process.sentinel)
+
+    process.join()
+
+#? Coordinator side
+
+class WatcherPool:
+
+    """
+    Spawns `workers` worker processes and runs their Discord requests through `discord_cl`.
+
+    Keeps track of which games are being watched (`live`, with the guilds each one goes to) and which were restored
+    and are waiting to be resumed (`restored`).
+    """
+
+    def __init__(self, discord_cl, workers: int, state_path: str):
+
+        self.discord_cl = discord_cl
+        self.workers = workers
+        self.state_path = state_path
+
+        self.path = os.path.join(tempfile.mkdtemp(prefix="namako-"), "workers.sock")
+
+        self.writers = [None] * workers
+        self.ready = [asyncio.Event() for _ in range(workers)] # set while the worker's connected
+        self.locks = [asyncio.Lock() for _ in range(workers)]
+
+        self.reported = set() # workers that have sent their restored games since they started
+        self.all_reported = asyncio.Event()
+
+        self.live = {} # game id -> guilds
+        self.restored = set()
+
+        self.tasks = set()
+
+        # message id -> the full message, as sent (or fetched). Editing with a file needs one, a partial message won't do
+        self.messages = OrderedDict()
+
+        self.server = None
+        self.processes = [None] * workers
+        self.supervisors = []
+
+    def background(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def start(self):
+
+        self.server = await asyncio.start_unix_server(self.handle, self.path)
+
+        self.supervisors = [asyncio.create_task(self.supervise(index)) for index in range(self.workers)]
+
+    async def supervise(self, index: int):
+
+        # spawn, not fork - same reasons as the image renderer
+        context = multiprocessing.get_context("spawn")
+
+        while True:
+
+            process = context.Process(target=worker_main, args=(index, self.workers, self.path, self.state_path))
+            process.start()
+            self.processes[index] = process
+
+            await wait_for_exit(process)
+
+            print(f"Watcher worker {index} exited ({process.exitcode}), restarting it.")
+            await asyncio.sleep(1)
+
+    async def close(self):
+
+        """
+        Stops the workers: they're cut off from the coordinator (and exit by themselves), or terminated if they take too long.
+        """
+
+        for task in self.supervisors:
+            task.cancel()
+
+        await asyncio.gather(*self.supervisors, return_exceptions=True)
+
+        if self.server is not None:
+            self.server.close()
+
+        for writer in self.writers:
+            if writer is not None:
+                writer.close()
+
+        for process in self.processes:
+
+            if process is None:
+                continue
+
+            try:
+                await asyncio.wait_for(wait_for_exit(process), STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.terminate()
+                await wait_for_exit(process)
+
+        shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+
+        _, index = await read_message(reader)
+
+        self.writers[index] = writer
+        self.ready[index].set()
+
+        try:
+
+            while True:
+
+                match await read_message(reader):
+
+                    case ("request", request_id, op, args):
+                        self.background(self.serve(index, writer, request_id, op, args))
+
+                    case ("restored", game_ids):
+                        self.restoredGames(index, game_ids)
+
+                    case ("ended", game_id):
+                        self.live.pop(game_id, None)
+
+                    case ("trace", trace):
+                        TRACES.record(MoveTrace(*trace))
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            self.ready[index].clear()
+            self.writers[index] = None
+
+    def restoredGames(self, index: int, game_ids: list[int]):
+
+        for game_id in game_ids:
+
+            if game_id in self.live: # the worker died mid-game, carry straight on
+                self.background(self.command(index, ("resume", game_id, self.live[game_id])))
+            else:
+                self.restored.add(game_id)
+
+        self.reported.add(index)
+
+        if len(self.reported) == self.workers:
+            self.all_reported.set()
+
+    async def serve(self, index: int, writer: asyncio.StreamWriter, request_id: int, op: str, args: tuple):
+
+        try:
+
+            match op:
+
+                case "send":
+                    channel, content, embed, file = args
+                    message = await self.discord_cl.send(channel, content, embed=discord.Embed.from_dict(embed), file=unpack_file(file))
+                    self.remember(message)
+                    result = message.id
+
+                case "edit":
+                    channel, message_id, content, embed, file, timeout = args
+                    message = await self.message(channel, message_id)
+                    embed = discord.Embed.from_dict(embed) if embed is not None else None
+                    edited = None if message is None else await self.discord_cl.edit(message, content, embed, unpack_file(file), timeout=timeout)
+
+                    if edited is not None:
+                        self.remember(edited)
+
+                    result = edited is not None
+
+            reply = ("reply", request_id, True, result)
+
+        except Exception as e:
+            reply = ("reply", request_id, False, repr(e))
+
+        # request ids start over with every worker, a reply meant for one that's since died must not reach its successor
+        if self.writers[index] is not writer:
+            return
+
+        try:
+            async with self.locks[index]:
+                await write_message(writer, reply)
+        except ConnectionError:
+            pass # it died just now, same thing
+
+    def remember(self, message):
+
+        self.messages[message.id] = message
+        self.messages.move_to_end(message.id)
+
+        if len(self.messages) > MESSAGE_CACHE:
+            self.messages.popitem(last=False)
+
+    async def message(self, channel: int, message_id: int):
+
+        # sent before a restart (or pushed out of the cache), fetch it again
+        if message_id not in self.messages:
+            message = await self.discord_cl.fetch_message(channel, message_id)
+
+            if message is None:
+                return None
+
+            self.remember(message)
+
+        return self.messages[message_id]
+
+    async def command(self, index: int, message):
+
+        await self.ready[index].wait() # a restarting worker gets it once it's back
+
+        async with self.locks[index]:
+            await write_message(self.writers[index], message)
+
+    def shard(self, game_id: int) -> int:
+        return game_id % self.workers
+
+    #? Used by NamakoBot, in place of its own watchers
+
+    async def wait_restored(self):
+        await self.all_reported.wait()
+
+    async def watch(self, data: dict, header: str, guilds: dict):
+        self.live[data["game_no"]] = dict(guilds)
+        await self.command(self.shard(data["game_no"]), ("watch", data, header, dict(guilds)))
+
+    async def resume(self, game_id: int, guilds: dict):
+        self.restored.discard(game_id)
+        self.live[game_id] = dict(guilds)
+        await self.command(self.shard(game_id), ("resume", game_id, dict(guilds)))
+
+    async def finish(self, game_id: int, result: str):
+        self.restored.discard(game_id)
+        self.live.pop(game_id, None)
+        await self.command(self.shard(game_id), ("finish", game_id, result))
@@ -1,14 +1,24 @@
 
 import asyncio
 import discord
+import io
 import json
+import os
 
-from clients.GameWatcher import GameWatcher
+from clients import metrics
+from clients.GameWatcher import GameWatcher, PLAYTAK_API, POSITIONS
+from clients.loop_monitor import LOOP_MONITOR
 from clients.discord_client import DiscordClient
-from clients.playtak_client import PlaytakClient
+from clients.playtak_client import PlaytakClient, CONNECTED, STATE_DIR
+from clients.state_store import StateStore
+from clients.subscriptions import Filter, Subscriptions
+from clients.tracing import TRACES
+from clients.watcher_pool import WatcherPool
 
 from discord import TextChannel
 
+from tak.board import TakBoard, TPSError
+
 
 # Guilds included because global commands take ages to start up.
 # Will be removed once I release 1.0.
@@ -19,6 +29,18 @@ GUILDS   = {1201101141115674694: 1201108655110639626}
 
 UPDATE_IMAGES = False
 
+# Prometheus metrics endpoint (http://127.0.0.1:9108/metrics), local only
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Worker processes to run GameWatchers in (NAMAKO_WORKERS), 0 keeps them all in this process
+WATCHER_WORKERS = int(os.environ.get("NAMAKO_WORKERS", 0))
+
+STATE_PATH = os.path.join(STATE_DIR, "state.db")
+
+# How long to wait for a game to show up in the GameList after (re)connecting, before treating it as finished
+RESTORE_GRACE = 30
+
 RESERVE_COUNTS = {
     3: [10, 0],
     4: [15, 0],
@@ -32,6 +54,14 @@ bot = discord.Bot()
 discord_cl = DiscordClient(bot=bot)
 playtak_cl = PlaytakClient()
 
+# Channels and running games survive restarts
+state_store = StateStore(STATE_PATH)
+GUILDS.update(state_store.load_channels())
+
+# Which games each guild wants announced
+subscriptions = Subscriptions(state_store)
+subscriptions.rebuild(GUILDS)
+
 ready = False
 
 #? Slash commands
@@ -52,9 +82,82 @@ async def ping(ctx):
 async def set_channel(ctx, channel: TextChannel):
     guild = ctx.guild.id
     GUILDS[guild] = channel.id
+    state_store.set_channel(guild, channel.id)
+    subscriptions.rebuild(GUILDS)
     await ctx.respond(f"Output channel set to channel {channel.id}.")
 
 
+@bot.slash_command(guild_ids=KNOWN_GUILDS)
+async def set_filter(ctx, sizes: str = "", min_rating: int = 0, tournament: bool = None, rated: bool = None, players: str = ""):
+    # replaces the guild's filter, leaving everything out gets every game again
+    try:
+        board_sizes = frozenset(int(size) for size in sizes.replace(",", " ").split())
+    except ValueError:
+        await ctx.respond(f"Invalid sizes: {sizes} (try e.g. `5 6`).")
+        return
+
+    if not board_sizes <= RESERVE_COUNTS.keys():
+        await ctx.respond(f"Board sizes go from {min(RESERVE_COUNTS)} to {max(RESERVE_COUNTS)}.")
+        return
+
+    names = frozenset(player.lower() for player in players.replace(",", " ").split())
+    game_filter = Filter(board_sizes, max(min_rating, 0), tournament, rated, names)
+
+    subscriptions.set(ctx.guild.id, game_filter, GUILDS)
+    await ctx.respond(f"Announcing {game_filter.describe()}.")
+
+
+@bot.slash_command(guild_ids=KNOWN_GUILDS)
+async def search_position(ctx, tps: str):
+    try:
+        board = TakBoard.from_TPS(tps, generate_moves=False)
+    except TPSError as e:
+        await ctx.respond(f"Invalid TPS: {e}")
+        return
+
+    games = await asyncio.to_thread(POSITIONS.search, board)
+
+    if not games:
+        await ctx.respond("This position hasn't been played before.")
+        return
+
+    shown = games[-10:] # most recent first
+    links = "\n".join(f"[Game {game_id}](https://playtak.com/games/{game_id}/ninjaviewer), ply {ply}" for game_id, ply in reversed(shown))
+    more = f"\n...and {len(games) - len(shown)} more." if len(games) > len(shown) else ""
+
+    await ctx.respond(f"Played in {len(games)} game(s):\n{links}{more}")
+
+
+@bot.slash_command(guild_ids=KNOWN_GUILDS)
+async def latency(ctx, dump: bool = False):
+    # move-to-Discord latency over the last hour (or as much of it as the traces cover), split by stage
+    window = min(3600, TRACES.covered())
+    period = "hour" if window >= 3600 else f"{window / 60:.0f} minutes"
+
+    summary = TRACES.summary(window)
+
+    if summary:
+        count = len(TRACES.recent(window))
+        lines = "\n".join(f"{stage}: p50 {p50 * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms" for stage, (p50, p99) in summary.items())
+        text = f"Latency over the last {period} ({count} moves):\n```\n{lines}\n```"
+    else:
+        text = f"No moves in the last {period}."
+
+    loop = LOOP_MONITOR.summary(3600)
+
+    if loop:
+        text += f"\nEvent loop lag: p50 {loop['p50'] * 1000:.0f} ms, p99 {loop['p99'] * 1000:.0f} ms, max {loop['max'] * 1000:.0f} ms"
+
+    if LOOP_MONITOR.stalls: # where the loop got stuck last, innermost frame
+        last = LOOP_MONITOR.stalls[-1].stack.strip().splitlines()
+        text += f"\nLast stall ({len(LOOP_MONITOR.stalls)} recorded):\n```\n{chr(10).join(last[-4:])}\n```"
+
+    if dump: # every trace kept, one JSON line each
+        await ctx.respond(text, file=discord.File(io.BytesIO(TRACES.dump().encode()), "traces.jsonl"))
+    else:
+        await ctx.respond(text)
+
+
 def ratingStr(player_name: str, top=25):
     rank, rating = playtak_cl.rankings[player_name] if (player_name in playtak_cl.rankings) else (None, None)
     return (f"{rating}" if rating else "unrated") + (f", #{rank}" if rank and rank <= top else "")
@@ -63,25 +166,47 @@ def ratingStr(player_name: str, top=25):
 
 class NamakoBot:
     
-    def __init__(self):
+    def __init__(self, secrets: dict = None):
+        
+        # secrets can be passed in directly (e.g. by sim.bench), otherwise they come from data/secrets.json
+        if secrets is None:
+            with open("data/secrets.json") as f:
+                secrets = json.loads(f.read())
         
-        with open("data/secrets.json") as f:
-            self.SECRETS = json.loads(f.read())
+        self.SECRETS = secrets
         
         self.current_games = set()
+        self.restored = {} # game id -> GameWatcher, for games that were running before a restart
+        self.watchers = {} # game id -> (GameWatcher, task), for the games being watched
+        self.listed = set() # game ids in the GameList since the last (re)connect
+        self.connections = 0
+        
+        # with workers, the watchers live in the pool instead of `restored` and `watchers`
+        self.pool = WatcherPool(discord_cl, WATCHER_WORKERS, STATE_PATH) if WATCHER_WORKERS else None
 
 
     async def start(self):
         
-        await asyncio.gather(
+        try:
+            await asyncio.gather(
+            
+                # Log into Discord and Playtak
+                discord_cl.main(self.SECRETS["BotToken"]),
+                playtak_cl.main(self.SECRETS["BotUsername"], self.SECRETS["BotPassword"]),
             
-            # Log into Discord and Playtak
-            discord_cl.main(self.SECRETS["BotToken"]),
-            playtak_cl.main(self.SECRETS["BotUsername"], self.SECRETS["BotPassword"]),
+                # Run NamakoBot!
+                self.main(),
             
-            # Run NamakoBot!
-            self.main(),
-        )
+                metrics.serve(METRICS_HOST, METRICS_PORT),
+                LOOP_MONITOR.run(), # watches for anything blocking the loop (and the Discord heartbeat with it)
+            )
+        finally:
+            if self.pool: # the workers aren't daemonic, they'd keep the process alive
+                await self.pool.close()
+
+            # the pooled HTTP sessions, so they don't go out with an "Unclosed client session"
+            await playtak_cl.close()
+            await PLAYTAK_API.close()
     
     async def main(self):
         
@@ -92,8 +217,19 @@ class NamakoBot:
         while not (playtak_cl.ready and discord_cl.ready):
             await asyncio.sleep(1)
         
+        if self.pool:
+            await self.pool.start()
+        
+        await self.restoreGames()
+        
         while True:
-            msg = (await playtak_cl.ws.recv()).decode()[:-1] #no reason to timeout i think?
+            msg = await playtak_cl.next_message() # survives reconnects, the client re-logs in by itself
+
+            if msg == CONNECTED: # a fresh GameList snapshot follows, check it against what we're watching
+                self.listed = set()
+                self.connections += 1
+                self.background(self.reconcile(self.connections))
+                continue
 
             if not msg.startswith("GameList Add"): # The GameWatcher can handle the game end
                 continue
@@ -101,16 +237,107 @@ class NamakoBot:
             data = msg.split()[2:]
             data = playtak_cl.parse_game_params(data)
 
-            # A new game has begun on playtak!
+            self.listed.add(data["game_no"])
+
+            if self.pool and data["game_no"] in self.pool.live:
+                continue
+
+            if self.pool and data["game_no"] in self.pool.restored:
+                await self.pool.resume(data["game_no"], GUILDS)
+                continue
+
+            if data["game_no"] in self.watchers: # still watching it from before the reconnect
+                continue
+
+            if data["game_no"] in self.restored: # we were already watching this one, carry on with the old messages
+                self.watch(self.restored.pop(data["game_no"]))
+                continue
+
+            # A new game has begun on playtak! Only the guilds that want it hear about it
+            guilds = {guild: GUILDS[guild] for guild in subscriptions.match(data, playtak_cl.rankings) if guild in GUILDS}
+
+            if not guilds:
+                continue
+
             player_1_rank = ratingStr(data['player_1'])
             player_2_rank = ratingStr(data['player_2'])
 
             header = f"**{data['player_1']}** ({player_1_rank}) vs. **{data['player_2']}** ({player_2_rank}) is live on [playtak.com](https://playtak.com)!\n"
 
-            gw = GameWatcher(data, header, discord_cl, GUILDS)
-            task = asyncio.create_task(gw.start())
-            self.current_games.add(task) # keep a hard reference here, so the garbage-collector doesn't kill it
-            task.add_done_callback(self.current_games.discard) # task removes itself when done
+            if self.pool:
+                await self.pool.watch(data, header, guilds)
+                continue
+
+            gw = GameWatcher(data, header, discord_cl, guilds, state_store)
+            self.watch(gw)
+
+    def watch(self, gw: GameWatcher):
+        task = self.background(gw.start())
+        self.watchers[gw.gameId] = (gw, task)
+        task.add_done_callback(lambda _: self.watchers.pop(gw.gameId, None))
+
+    def background(self, coro):
+        task = asyncio.create_task(coro)
+        self.current_games.add(task) # keep a hard reference here, so the garbage-collector doesn't kill it
+        task.add_done_callback(self.current_games.discard) # task removes itself when done
+        return task
+
+    async def restoreGames(self):
+        
+        # Reattach to the games we were watching before a restart.
+        # The server lists every running game right after login, so those get picked up in `main`,
+        # and `reconcile` finishes off the rest.
+        
+        if self.pool: # each worker restores its own share
+            await self.pool.wait_restored()
+            
+            if self.pool.restored:
+                print(f"Restored {len(self.pool.restored)} game(s) from before the restart.")
+            
+            return
+        
+        for saved in state_store.load_games():
+            gw = await GameWatcher.restore(saved, discord_cl, GUILDS, state_store)
+            await gw.reattach(saved["messages"])
+            self.restored[gw.gameId] = gw
+        
+        if self.restored:
+            print(f"Restored {len(self.restored)} game(s) from before the restart.")
+    
+    async def reconcile(self, connection: int):
+        
+        # Anything that hasn't shown up in the GameList by now finished while we were disconnected (or down),
+        # so finish its embed off. Watchers can't tell by themselves - observing a game that's over just stays quiet.
+        
+        await asyncio.sleep(RESTORE_GRACE)
+        
+        if connection != self.connections: # reconnected again since, that snapshot is the one to check
+            return
+        
+        if self.pool:
+            for game_id in list(self.pool.restored) + list(self.pool.live):
+                if game_id not in self.listed:
+                    await self.pool.finish(game_id, await self.gameResult(game_id))
+            
+            return
+        
+        for game_id in list(self.restored):
+            if game_id not in self.listed:
+                await self.finishGame(self.restored.pop(game_id))
+        
+        for game_id, (gw, task) in list(self.watchers.items()):
+            if game_id not in self.listed and not gw.finished:
+                await gw.stop(task) # so nothing's still moving the board while it's cleaned up
+                await self.finishGame(gw)
+    
+    async def finishGame(self, gw: GameWatcher):
+        gw.data["result"] = await self.gameResult(gw.gameId)
+        
+        await gw.cleanUp()
+    
+    async def gameResult(self, game_id: int) -> str:
+        game = await playtak_cl.get_playtak_game(game_id)
+        return (game or {}).get("result") or "unknown"
 
 if __name__ == "__main__":
     namako = NamakoBot()
@@ -0,0 +1,125 @@
+"""
+End-to-end throughput benchmark for the bridge.
+
+Runs the real `NamakoBot`, `PlaytakClient`, `GameWatcher`s and `DiscordClient` against the local playtak stand-in
+(`sim.playtak_server`), with Discord replaced by the fake sink (`sim.discord_sink`), and reports moves/sec handled,
+edits sent versus moves coalesced into someone else's edit, and move-to-Discord tail latency.
+
+    python -m sim.bench --games 50 --concurrency 20 --speed 50 --guilds 2
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+def report(name: str, value):
+    print(f"{name:<28} {value}")
+
+async def bench(args):
+
+    # the bridge reads these once, when it's imported - and so do watcher workers, which get a fresh import.
+    # Nothing the bench writes may end up in data/, the fake games would show up in the real bot
+    scratch = tempfile.mkdtemp()
+
+    os.environ["PLAYTAK_URI"] = f"ws://127.0.0.1:{args.port}/ws"
+    os.environ["NAMAKO_STATE_DIR"] = scratch
+    os.environ["NAMAKO_WORKERS"] = str(args.workers)
+
+    import namako
+
+    from clients import metrics
+    from clients.GameWatcher import PLAYTAK_API
+    from clients.tracing import TRACES
+    from sim.discord_sink import FakeBot
+    from sim.playtak_server import FakePlaytak, random_games, recorded_games
+
+    sink = FakeBot(args.latency, args.jitter, args.limit, args.period, args.seed)
+    namako.discord_cl.bot = sink
+
+    namako.GUILDS.clear()
+    namako.GUILDS.update({guild: 1000 + guild for guild in range(args.guilds)})
+    namako.subscriptions.rebuild(namako.GUILDS)
+
+    games = recorded_games(args.archive) if args.archive else random_games(args.seed)
+    server = FakePlaytak(games, args.concurrency, args.speed, args.interval, args.undo_rate, args.games, seed=args.seed)
+
+    bot = namako.NamakoBot(secrets={"BotToken": "bench", "BotUsername": "bench", "BotPassword": "bench"})
+
+    tasks = [
+        asyncio.create_task(namako.discord_cl.main("bench")),
+        asyncio.create_task(namako.playtak_cl.main("bench", "bench")),
+        asyncio.create_task(bot.main()),
+    ]
+
+    start = time.monotonic()
+
+    try:
+        await server.run("127.0.0.1", args.port, wait=args.wait)
+
+        # the last games still have their final edits to make
+        while (bot.pool.live if bot.pool else bot.watchers) and time.monotonic() - start < args.timeout:
+            await asyncio.sleep(0.1)
+
+        elapsed = time.monotonic() - start - args.wait
+
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if bot.pool:
+            await bot.pool.close()
+
+        await namako.playtak_cl.close()
+        await PLAYTAK_API.close()
+
+    traces = TRACES.recent()
+    updates = len({(trace.game, trace.edited) for trace in traces}) # embed updates that carried at least one live move
+    moves = metrics.MAKE_MOVE_TIME.count() if not bot.pool else None # counted in the workers, out of reach
+    latency = TRACES.summary(None).get("total", (0.0, 0.0))
+    discord = sink.stats()
+
+    report("games played", server.finished)
+    report("frames sent", server.frames)
+    report("elapsed", f"{elapsed:.1f} s")
+    report("moves handled", moves if moves is not None else "- (in workers)")
+    report("moves/sec", f"{moves / elapsed:.1f}" if moves is not None and elapsed > 0 else "-")
+    report("live moves", len(traces))
+    report("embed updates", updates)
+    report("moves coalesced", len(traces) - updates)
+    report("edits sent", discord["edits"])
+    report("edits dropped", int(metrics.DROPPED_EDITS.get()))
+    report("messages sent", discord["sends"])
+    report("messages fetched", discord["fetches"])
+    report("rate-limited requests", discord["rate_limited"])
+    report("discord request p50/p99", f"{discord['latency_p50'] * 1000:.0f} / {discord['latency_p99'] * 1000:.0f} ms")
+    report("move-to-discord p50/p99", f"{latency[0] * 1000:.0f} / {latency[1] * 1000:.0f} ms")
+
+    # a run that never got a live move to Discord measured nothing, don't let it pass for a fast one
+    if not traces or not updates:
+        raise SystemExit("No live moves reached Discord - the numbers above are meaningless.")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the bridge against a simulated playtak feed and Discord.")
+    parser.add_argument("--port", type=int, default=9998)
+    parser.add_argument("--archive", default=None, help="PTN archive or games database to replay (default: random games)")
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--speed", type=float, default=50)
+    parser.add_argument("--interval", type=float, default=5, help="seconds between moves at speed 1")
+    parser.add_argument("--undo-rate", type=float, default=0)
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=0, help="watcher worker processes, 0 runs them in the bridge's own")
+    parser.add_argument("--latency", type=float, default=0.1, help="Discord request latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--limit", type=int, default=5, help="requests per channel per --period")
+    parser.add_argument("--period", type=float, default=5)
+    parser.add_argument("--wait", type=float, default=2, help="seconds for the bridge to log in before the first game")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+
+    asyncio.run(bench(parser.parse_args()))
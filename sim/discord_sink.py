@@ -0,0 +1,207 @@
+"""
+A stand-in for the `discord.Bot` behind `DiscordClient`, for benchmarking the bridge offline.
+
+It records every send and edit, and makes them behave roughly like Discord does: each request takes
+`latency` (plus up to `jitter`) seconds, and requests share a rate-limit bucket per channel - `limit`
+requests every `period` seconds, as discord.py waits out a 429 before trying again.
+
+Partial messages (`get_partial_message`) refuse a `file` on edit, like py-cord's, which can't upload one.
+
+    sink = FakeBot(latency=0.15)
+    discord_cl = DiscordClient(bot=sink)
+"""
+
+import asyncio
+import itertools
+import random
+import time
+
+from collections import deque
+
+from clients.tracing import percentile
+
+class RateLimit:
+
+    """
+    A sliding-window limit - at most `limit` requests in any `period` seconds.
+    """
+
+    def __init__(self, limit: int, period: float):
+
+        self.limit = limit
+        self.period = period
+        self.times = deque()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+
+        """
+        Waits for a slot. Returns how long it had to wait.
+        """
+
+        async with self.lock:
+
+            waited = 0.0
+            now = time.monotonic()
+
+            while self.times and now - self.times[0] >= self.period:
+                self.times.popleft()
+
+            if len(self.times) >= self.limit:
+                waited = self.times[0] + self.period - now
+                await asyncio.sleep(waited)
+                self.times.popleft()
+
+            self.times.append(time.monotonic())
+
+            return waited
+
+class FakeMessage:
+
+    def __init__(self, channel: "FakeChannel", message_id: int, content=None, embed=None):
+
+        self.channel = channel
+        self.id = message_id
+        self.content = content
+        self.embed = embed
+        self.edits = 0
+
+    async def edit(self, content=None, embed=None, file=None, attachments=None, **_):
+
+        await self.channel.bot.request("edit", self.channel.id)
+
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+
+        self.edits += 1
+
+        return self
+
+class FakePartialMessage:
+
+    """
+    Like `discord.PartialMessage`: knows its id, and can be edited - but not with a file.
+    """
+
+    def __init__(self, channel: "FakeChannel", message_id: int):
+
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, content=None, embed=None, file=None, **_):
+
+        if file is not None: # py-cord JSON-encodes a partial message's edit, a File in it fails the same way
+            raise TypeError("Object of type File is not JSON serializable")
+
+        return await self.channel.message(self.id).edit(content=content, embed=embed)
+
+class FakeChannel:
+
+    def __init__(self, bot: "FakeBot", channel_id: int):
+
+        self.bot = bot
+        self.id = channel_id
+        self.messages = {}
+
+    async def send(self, content=None, embed=None, file=None, **_) -> FakeMessage:
+
+        await self.bot.request("send", self.id)
+
+        message = FakeMessage(self, next(self.bot.ids), content, embed)
+        self.messages[message.id] = message
+
+        return message
+
+    def message(self, message_id: int) -> FakeMessage:
+
+        # sent before a restart, as far as we know
+        if message_id not in self.messages:
+            self.messages[message_id] = FakeMessage(self, message_id)
+
+        return self.messages[message_id]
+
+    def get_partial_message(self, message_id: int) -> FakePartialMessage:
+        return FakePartialMessage(self, message_id)
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+
+        await self.bot.request("fetch", self.id)
+
+        return self.message(message_id)
+
+class FakeBot:
+
+    """
+    Records and rate-limits everything the bridge sends to Discord. `stats()` has the totals.
+    """
+
+    def __init__(self, latency: float = 0.1, jitter: float = 0.05, limit: int = 5, period: float = 5, seed: int = 0):
+
+        self.latency = latency
+        self.jitter = jitter
+        self.limit = limit
+        self.period = period
+
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+
+        self.channels = {}
+        self.buckets = {}
+
+        self.counts = {"send": 0, "edit": 0, "fetch": 0}
+        self.latencies = []   # seconds per request, rate-limit waits included
+        self.rate_limited = 0 # requests that had to wait for their bucket
+        self.started = time.monotonic()
+
+        self.user = "FakeBot#0000"
+
+    async def request(self, kind: str, channel_id: int):
+
+        start = time.monotonic()
+
+        bucket = self.buckets.get(channel_id)
+
+        if bucket is None:
+            bucket = self.buckets[channel_id] = RateLimit(self.limit, self.period)
+
+        if await bucket.acquire() > 0:
+            self.rate_limited += 1
+
+        await asyncio.sleep(self.latency + self.rng.random() * self.jitter)
+
+        self.counts[kind] += 1
+        self.latencies.append(time.monotonic() - start)
+
+    #? The parts of discord.Bot that DiscordClient uses
+
+    def get_channel(self, channel_id: int) -> FakeChannel:
+
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(self, channel_id)
+
+        return self.channels[channel_id]
+
+    async def fetch_channel(self, channel_id: int) -> FakeChannel:
+        return self.get_channel(channel_id)
+
+    async def start(self, token: str):
+        await asyncio.Event().wait() # "connected" until cancelled
+
+    #? Results
+
+    def stats(self) -> dict:
+
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies) or [0.0]
+
+        return {
+            "sends": self.counts["send"],
+            "edits": self.counts["edit"],
+            "fetches": self.counts["fetch"],
+            "requests_per_second": sum(self.counts.values()) / elapsed if elapsed else 0.0,
+            "rate_limited": self.rate_limited,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p99": percentile(latencies, 99),
+        }
@@ -0,0 +1,296 @@
+"""
+A local stand-in for the playtak server, for testing and load-testing the bridge without the real one.
+
+Speaks enough of the protocol for `PlaytakClient`, `NamakoBot.main` and `GameWatcher`: `Login`, `Login Guest`,
+`PING`, `Observe`, `GameList Add/Remove` and `Game#N P/M/Undo/Time/Over`. Any username and password are accepted.
+
+Games are replayed from an archive (PTN or a games database, see `tak.archive`) or generated at random,
+`--concurrency` at a time. Point the bot at it with `PLAYTAK_URI=ws://127.0.0.1:9999/ws`.
+
+    python -m sim.playtak_server --concurrency 200 --speed 10
+    python -m sim.playtak_server --archive games.db --games 1000 --speed 0
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+
+from typing import Iterator, NamedTuple, Optional
+
+import websockets
+
+from tak.archive import plan_shards, shard_games
+from tak.board import TakBoard
+
+RESERVE_COUNTS = TakBoard.RESERVE_COUNTS
+
+class SimGame(NamedTuple):
+
+    player_1: str
+    player_2: str
+    size: int
+    half_komi: int
+    moves: tuple[str]  # server format, e.g. "P A1", "M A1 A3 1 2"
+    result: str
+
+class LiveGame(NamedTuple):
+
+    params: str         # as sent in the GameList
+    moves: list[str]    # sent so far, for new observers
+    observers: set
+    lock: asyncio.Lock  # held while the moves change or a new observer catches up, so nobody misses a move
+
+#? Game sources
+
+def random_games(seed: int = 0, sizes: tuple = (5, 6), max_plies: int = 120) -> Iterator[SimGame]:
+
+    """
+    Yields random (legal, if not very good) games forever. Games that haven't ended by `max_plies` are aborted (`0-0`).
+    """
+
+    rng = random.Random(seed)
+
+    for number in itertools.count(1):
+
+        size = rng.choice(sizes)
+        board = TakBoard(size, 0)
+        player = "white"
+
+        moves = []
+
+        while board.legal_moves and len(moves) < max_plies:
+
+            # some generated crushes list one square too many in `movement`, and don't survive the trip through server notation
+            candidates = [m for m in board.legal_moves if m["move_type"] == "place" or len(m["movement"]) == len(m["stacks"])]
+            move = rng.choice(candidates)
+            moves.append(board.move_to_server(move))
+
+            board.make_move(move, player)
+            player = board.invert_player(player)
+
+        yield SimGame(f"Bot{number}a", f"Bot{number}b", size, 0, tuple(moves), board.generate_win_str() or "0-0")
+
+def recorded_games(path: str) -> Iterator[SimGame]:
+
+    """
+    Yields the games in an archive, converted to server moves. Games that don't replay are skipped.
+    """
+
+    for part in plan_shards(path, 1):
+
+        for game_id, game in shard_games(part):
+
+            try:
+                board = TakBoard(game.size, game.half_komi)
+            except (KeyError, ValueError):
+                continue
+
+            player = "white"
+            moves = []
+
+            for ptn in game.moves:
+
+                try:
+                    move = board.ptn_to_move(ptn, player)
+                except (KeyError, ValueError, IndexError):
+                    move = None
+
+                if move is None or board.legal_moves is None or not board.make_move(move, player):
+                    break
+
+                moves.append(board.move_to_server(move))
+                player = board.invert_player(player)
+
+            white = game.headers.get("Player1", "White").split()[0] or "White"
+            black = game.headers.get("Player2", "Black").split()[0] or "Black"
+
+            yield SimGame(white, black, game.size, game.half_komi, tuple(moves), game.result or board.generate_win_str() or "0-0")
+
+#? Server
+
+class FakePlaytak:
+
+    """
+    Plays `games` to whoever's connected, `concurrency` at a time.
+
+    Moves are `interval / speed` seconds apart (`speed=0` sends them back to back). With `undo_rate`, that fraction
+    of moves is taken back and played again, like an accepted undo request.
+    """
+
+    def __init__(self, games: Iterator[SimGame], concurrency: int = 10, speed: float = 1, interval: float = 5,
+                 undo_rate: float = 0, limit: Optional[int] = None, first_id: int = 1, seed: int = 0):
+
+        self.games = iter(games) if limit is None else itertools.islice(games, limit)
+        self.concurrency = concurrency
+        self.delay = interval / speed if speed else 0
+        self.undo_rate = undo_rate
+
+        self.ids = itertools.count(first_id)
+        self.guests = itertools.count(1)
+        self.rng = random.Random(seed)
+
+        self.sessions = set()  # logged-in connections, they get the GameList
+        self.live = {}         # game id -> LiveGame
+
+        self.started = 0
+        self.finished = 0
+        self.frames = 0
+
+    async def send(self, ws, msg: str):
+
+        try:
+            await ws.send(f"{msg}\n".encode())
+            self.frames += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def broadcast(self, connections, msg: str):
+
+        for ws in list(connections):
+            await self.send(ws, msg)
+
+    #? Connections
+
+    async def handle(self, ws, *_):
+
+        await self.send(ws, "Welcome!")
+        await self.send(ws, "Login or Register")
+
+        try:
+
+            async for raw in ws:
+
+                msg = (raw.decode() if isinstance(raw, bytes) else raw).strip()
+                tokens = msg.split()
+
+                match tokens:
+
+                    case ["PING"]:
+                        await self.send(ws, "OK")
+
+                    case ["Login", "Guest", *_]:
+                        await self.login(ws, f"Guest{next(self.guests)}")
+
+                    case ["Login", username, *_]:
+                        await self.login(ws, username)
+
+                    case ["Observe", game_id] if game_id.isnumeric():
+                        await self.observe(ws, int(game_id))
+
+                    case ["Unobserve", game_id] if game_id.isnumeric() and int(game_id) in self.live:
+                        self.live[int(game_id)].observers.discard(ws)
+
+        finally:
+
+            self.sessions.discard(ws)
+
+            for live in self.live.values():
+                live.observers.discard(ws)
+
+    async def login(self, ws, name: str):
+
+        await self.send(ws, f"Welcome {name}!")
+        self.sessions.add(ws)
+
+        for live in list(self.live.values()):
+            await self.send(ws, f"GameList Add {live.params}")
+
+    async def observe(self, ws, game_id: int):
+
+        if game_id not in self.live:
+            return # like the real thing, observing a game that's over gets you nothing
+
+        live = self.live[game_id]
+
+        async with live.lock:
+
+            await self.send(ws, f"Observe {live.params}")
+
+            for move in live.moves:
+                await self.send(ws, f"Game#{game_id} {move}")
+
+            live.observers.add(ws)
+
+    #? Games
+
+    async def play(self, game: SimGame):
+
+        game_id = next(self.ids)
+        pieces, capstones = RESERVE_COUNTS[game.size]
+
+        params = f"{game_id} {game.player_1} {game.player_2} {game.size} 900 10 {game.half_komi} {pieces} {capstones} 0 0 0 0"
+        live = self.live[game_id] = LiveGame(params, [], set(), asyncio.Lock())
+        self.started += 1
+
+        await self.broadcast(self.sessions, f"GameList Add {params}")
+
+        for move in game.moves:
+
+            await asyncio.sleep(self.delay)
+
+            if self.undo_rate and live.moves and self.rng.random() < self.undo_rate:
+
+                async with live.lock:
+                    undone = live.moves.pop()
+                    await self.broadcast(live.observers, f"Game#{game_id} Undo")
+
+                await asyncio.sleep(self.delay)
+
+                async with live.lock:
+                    live.moves.append(undone)
+                    await self.broadcast(live.observers, f"Game#{game_id} {undone}")
+
+            async with live.lock:
+                live.moves.append(move)
+                await self.broadcast(live.observers, f"Game#{game_id} {move}")
+                await self.broadcast(live.observers, f"Game#{game_id} Time 900 900")
+
+        await asyncio.sleep(self.delay)
+
+        async with live.lock:
+            await self.broadcast(live.observers, f"Game#{game_id} Over {game.result}")
+            del self.live[game_id]
+        self.finished += 1
+
+        await self.broadcast(self.sessions, f"GameList Remove {params}")
+
+    async def lane(self):
+
+        # one game after another, until the source runs dry
+        for game in self.games:
+            await self.play(game)
+
+    async def run(self, host: str = "127.0.0.1", port: int = 9999, wait: float = 0):
+
+        """
+        Serves until every game's been played. `wait` gives the clients time to connect before the first game starts.
+        """
+
+        async with websockets.serve(self.handle, host, port, subprotocols=["binary"]):
+
+            await asyncio.sleep(wait)
+            await asyncio.gather(*(self.lane() for _ in range(self.concurrency)))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the playtak server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--archive", default=None, help="PTN archive or games database to replay (default: random games)")
+    parser.add_argument("--games", type=int, default=None, help="stop after this many games")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--speed", type=float, default=1, help="0 for no delay at all")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between moves at speed 1")
+    parser.add_argument("--undo-rate", type=float, default=0)
+    parser.add_argument("--wait", type=float, default=5, help="seconds to wait for clients before starting")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    games = recorded_games(args.archive) if args.archive else random_games(args.seed)
+    server = FakePlaytak(games, args.concurrency, args.speed, args.interval, args.undo_rate, args.games, seed=args.seed)
+
+    asyncio.run(server.run(args.host, args.port, args.wait))
+
+    print(f"{server.finished} games played, {server.frames} frames sent")
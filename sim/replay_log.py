@@ -0,0 +1,101 @@
+"""
+Plays a recorded frame log (see `clients.frame_log`) back to the bridge, as if it were the playtak server.
+
+Control frames go to every logged-in (non-guest) client, and each game's frames go to whoever observes it -
+a watcher that observes late gets that game's frames so far first, like the real server's backlog.
+Timing follows the log, scaled by `--speed` (0 sends everything as fast as possible).
+
+    PLAYTAK_URI=ws://127.0.0.1:9999/ws python namako.py   # in one terminal
+    python -m sim.replay_log data/frames.log --speed 10     # in another
+"""
+
+import argparse
+import asyncio
+import time
+
+import websockets
+
+from clients.frame_log import CONTROL, read_log
+from sim.playtak_server import FakePlaytak, LiveGame
+
+class LogServer(FakePlaytak):
+
+    def __init__(self, path: str, speed: float = 1):
+
+        super().__init__(iter(()))
+
+        self.path = path
+        self.speed = speed
+
+    async def login(self, ws, name: str):
+
+        # no GameList here - the control stream has the one that was sent at the time
+        await self.send(ws, f"Welcome {name}!")
+
+        if not name.startswith("Guest"):
+            self.sessions.add(ws)
+
+    async def observe(self, ws, game_id: int):
+
+        live = self.stream(game_id)
+
+        async with live.lock:
+
+            for frame in live.moves:
+                await self.send(ws, frame)
+
+            live.observers.add(ws)
+
+    def stream(self, game_id: int) -> LiveGame:
+
+        if game_id not in self.live:
+            self.live[game_id] = LiveGame("", [], set(), asyncio.Lock())
+
+        return self.live[game_id]
+
+    async def run(self, host: str = "127.0.0.1", port: int = 9999, wait: float = 0):
+
+        """
+        Serves until the whole log has been played back.
+        """
+
+        async with websockets.serve(self.handle, host, port, subprotocols=["binary"]):
+
+            await asyncio.sleep(wait)
+
+            start = time.monotonic()
+
+            for frame in read_log(self.path):
+
+                if self.speed:
+                    delay = start + frame.time / self.speed - time.monotonic()
+
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                if frame.stream == CONTROL:
+                    await self.broadcast(self.sessions, frame.data)
+                    continue
+
+                live = self.stream(frame.stream)
+
+                async with live.lock:
+                    live.moves.append(frame.data)
+                    await self.broadcast(live.observers, frame.data)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay a playtak frame log to the bridge.")
+    parser.add_argument("path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--speed", type=float, default=1, help="1 for real time, 10 for 10x, 0 for as fast as possible")
+    parser.add_argument("--wait", type=float, default=5, help="seconds to wait for the bridge to log in before starting")
+
+    args = parser.parse_args()
+
+    server = LogServer(args.path, args.speed)
+
+    asyncio.run(server.run(args.host, args.port, args.wait))
+
+    print(f"{server.frames} frames sent")
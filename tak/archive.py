@@ -0,0 +1,389 @@
+"""
+Batch replay of game archives across a process pool.
+
+An archive is either PTN (see `tak.ptn.iter_lines`) or a local SQLite copy of playtak's game database.
+It's cut into shards, every shard is replayed through `TakBoard` in a worker process by a `ReplayCollector`,
+and the per-shard collectors are merged. Finished shards are checkpointed, so an interrupted job picks up where it left off.
+
+    python -m tak.archive games.db --workers 8 --checkpoint data/replay_checkpoint
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from tak import profiling
+from tak.board import TakBoard
+from tak.ptn import PTNGame, is_plain, iter_lines, iter_range, read_games, replay, split_offsets
+
+class Shard(NamedTuple):
+
+    """
+    A slice of an archive.
+
+    For PTN, the games in bytes `start` to `end` of a single file, or the whole file if `end` is `None`
+    (compressed files and zips can't be read from the middle, so they're one shard each).
+    For databases, the games with `start <= id < end`.
+    """
+
+    kind: str  # "ptn" or "db"
+    path: str
+    start: int
+    end: Optional[int]
+
+    @property
+    def key(self) -> str:
+
+        # files in different directories can share a name
+        digest = hashlib.sha1(os.path.abspath(self.path).encode()).hexdigest()[:8]
+
+        return f"{self.kind}-{os.path.basename(self.path)}-{digest}-{self.start}-{self.end}"
+
+class ReplayCollector:
+
+    """
+    Gathers results while games are replayed. Subclass it, and override whichever hooks you need.
+
+    Collectors are pickled between processes, so keep them to plain data.
+    """
+
+    def __init__(self):
+
+        self.games = 0
+        self.plies = 0
+        self.errors = 0
+
+        self.profile = {} # TakBoard method -> (calls, seconds), with TAK_PROFILE set
+
+    def start_game(self, game_id, game: PTNGame) -> None:
+        pass
+
+    def position(self, game_id, ply: int, move: str, board: TakBoard) -> None:
+        pass
+
+    def end_game(self, game_id, game: PTNGame, board: TakBoard) -> None:
+        pass
+
+    def merge(self, other: "ReplayCollector") -> None:
+
+        """
+        Folds the results of `other` (another shard) into this collector.
+        """
+
+        self.games += other.games
+        self.plies += other.plies
+        self.errors += other.errors
+
+        profiling.merge(self.profile, getattr(other, "profile", {})) # older checkpoints don't have one
+
+class ResultCollector(ReplayCollector):
+
+    """
+    Counts results by board size. Mostly here as an example (and a sanity check for a new archive).
+    """
+
+    def __init__(self):
+
+        super().__init__()
+        self.results = {}
+
+    def end_game(self, game_id, game, board):
+
+        key = (game.size, game.result or board.generate_win_str() or "unknown")
+        self.results[key] = self.results.get(key, 0) + 1
+
+    def merge(self, other):
+
+        super().merge(other)
+
+        for key, count in other.results.items():
+            self.results[key] = self.results.get(key, 0) + count
+
+#? Sources
+
+def server_to_ptn(server_move: str) -> str:
+
+    """
+    Converts a playtak server move (`P A1 C`, `M A1 A3 1 2`) to a compact PTN string (`Ca1`, `3a1+12`).
+    """
+
+    tokens = server_move.split()
+
+    if tokens[0] == "P":
+        stone = {"W": "S", "C": "C"}.get(tokens[2], "") if len(tokens) > 2 else ""
+        return stone + tokens[1].lower()
+
+    start, end, drops = tokens[1].lower(), tokens[2].lower(), tokens[3:]
+
+    if start[0] == end[0]:
+        direction = "+" if end[1] > start[1] else "-"
+    else:
+        direction = ">" if end[0] > start[0] else "<"
+
+    count = sum(int(i) for i in drops)
+
+    return f"{count if count > 1 else ''}{start}{direction}{''.join(drops) if len(drops) > 1 else ''}"
+
+def db_games(path: str, low: int = 0, high: Optional[int] = None) -> Iterator[tuple[int, PTNGame]]:
+
+    """
+    Yields `(id, game)` for every game in a playtak games database with `low <= id < high`, streamed off a cursor.
+
+    The `notation` column holds the game as comma-separated server moves (`P A1,P F6,M A1 A2 1,...`).
+    """
+
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    query = "SELECT id, size, komi, player_white, player_black, result, notation FROM games WHERE id >= ?"
+    params = [low]
+
+    if high is not None:
+        query += " AND id < ?"
+        params.append(high)
+
+    try:
+
+        for game_id, size, komi, white, black, result, notation in connection.execute(query + " ORDER BY id", params):
+
+            headers = {
+                "Size": str(size),
+                "Komi": f"{(komi or 0) / 2:g}", # playtak stores half-komi
+                "Player1": white,
+                "Player2": black,
+            }
+
+            moves = tuple(server_to_ptn(move) for move in notation.split(",") if move) if notation else ()
+
+            yield game_id, PTNGame(headers, moves, result)
+
+    finally:
+        connection.close()
+
+def ptn_game_id(game: PTNGame) -> Optional[int]:
+
+    """
+    The playtak game id in the `Id` (or `GameId`) header, `None` if there isn't one.
+    """
+
+    value = game.headers.get("Id", game.headers.get("GameId"))
+
+    return int(value) if value is not None and value.isdigit() else None
+
+def shard_games(shard: Shard) -> Iterator[tuple[Optional[int], PTNGame]]:
+
+    """
+    Yields `(id, game)` for every game in `shard`. PTN games without an id header get `None`.
+    """
+
+    if shard.kind == "db":
+        yield from db_games(shard.path, shard.start, shard.end)
+        return
+
+    lines = iter_lines(shard.path) if shard.end is None else iter_range(shard.path, shard.start, shard.end)
+
+    for game in read_games(lines, strict=False):
+        yield ptn_game_id(game), game
+
+def ptn_files(path: str) -> list[str]:
+
+    # the same files as `iter_lines`, in the same order
+    if not os.path.isdir(path):
+        return [path]
+
+    files = []
+
+    for root, dirs, names in os.walk(path):
+
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith((".ptn", ".ptn.gz", ".zip")))
+
+    return files
+
+def plan_shards(path: str, shards: int) -> list[Shard]:
+
+    """
+    Cuts the archive at `path` into (roughly) `shards` shards. Files ending in `.db` or `.sqlite` are treated as databases.
+
+    Plain PTN files are cut at game boundaries, into shards of about the same number of bytes.
+    """
+
+    if not path.endswith((".db", ".sqlite")):
+
+        files = ptn_files(path)
+        total = sum(os.path.getsize(file) for file in files) or 1
+        plan = []
+
+        for file in files:
+
+            if not is_plain(file):
+                plan.append(Shard("ptn", file, 0, None))
+                continue
+
+            offsets = split_offsets(file, max(round(shards * os.path.getsize(file) / total), 1))
+            plan.extend(Shard("ptn", file, start, end) for start, end in zip(offsets, offsets[1:]))
+
+        return plan
+
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    try:
+        low, high = connection.execute("SELECT MIN(id), MAX(id) FROM games").fetchone()
+    finally:
+        connection.close()
+
+    if low is None:
+        return []
+
+    step = max((high - low + 1) // shards, 1)
+    bounds = list(range(low, high + 1, step)) + [high + 1]
+
+    return [Shard("db", path, start, end) for start, end in zip(bounds, bounds[1:])]
+
+#? Replaying
+
+def replay_shard(shard: Shard, collector_factory: Callable[[], ReplayCollector]) -> tuple[Shard, ReplayCollector]:
+
+    """
+    Replays every game in `shard` through `TakBoard`. Runs in a worker process.
+    """
+
+    collector = collector_factory()
+    boards = {} # one board per size, reused between games
+
+    for game_id, game in shard_games(shard):
+
+        board = None
+
+        try:
+
+            collector.start_game(game_id, game)
+
+            for ply, move, board in replay(game, boards.get(game.size)):
+                collector.position(game_id, ply, move, board)
+                collector.plies += 1
+
+        except ValueError: # PTNError, or a header that isn't a number
+            collector.errors += 1
+            continue
+
+        if board is None: # no moves, nothing got replayed
+            continue
+
+        boards[game.size] = board
+        collector.end_game(game_id, game, board)
+        collector.games += 1
+
+    if profiling.ENABLED: # workers replay several shards, so only take this one's share
+        collector.profile = profiling.snapshot(reset=True)
+
+    return shard, collector
+
+def load_checkpoint(path: str, kind: type) -> Optional[ReplayCollector]:
+
+    """
+    The collector saved at `path`, or `None` if it's unreadable or not a `kind` - written by an older version, say.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            collector = pickle.load(f)
+    except Exception as e: # unpickling can raise just about anything
+        print(f"Ignoring checkpoint {path}: {e!r}", file=sys.stderr)
+        return None
+
+    if not isinstance(collector, kind):
+        print(f"Ignoring checkpoint {path}: it's a {type(collector).__name__}, not a {kind.__name__}", file=sys.stderr)
+        return None
+
+    return collector
+
+def run_job(path: str, collector_factory: Callable[[], ReplayCollector], workers: int = None,
+            shards: int = None, checkpoint: Optional[str] = None, progress: bool = True) -> ReplayCollector:
+
+    """
+    Replays the archive at `path` across `workers` processes and returns the merged collector.
+
+    `collector_factory` must be picklable (a class or a module-level function).
+    With `checkpoint` set to a directory, each finished shard is saved there (under the collector's name, so different jobs
+    can share it) and skipped when the job is re-run. Checkpoints that no longer load are replayed again.
+    """
+
+    workers = workers or os.cpu_count()
+    plan = plan_shards(path, shards or workers * 4) # a few shards per worker keeps them all busy until the end
+
+    merged = collector_factory()
+    done = 0
+
+    if checkpoint:
+        checkpoint = os.path.join(checkpoint, f"{collector_factory.__module__}.{collector_factory.__qualname__}")
+        os.makedirs(checkpoint, exist_ok=True)
+
+    todo = []
+
+    for shard in plan:
+
+        saved = os.path.join(checkpoint, shard.key + ".pickle") if checkpoint else None
+        collector = load_checkpoint(saved, type(merged)) if saved and os.path.exists(saved) else None
+
+        if collector is not None:
+            merged.merge(collector)
+            done += 1
+            continue
+
+        todo.append(shard)
+
+    start = time.monotonic()
+    games_at_start = merged.games
+
+    with ProcessPoolExecutor(workers) as pool:
+
+        jobs = [pool.submit(replay_shard, shard, collector_factory) for shard in todo]
+
+        for job in as_completed(jobs):
+
+            shard, collector = job.result()
+            merged.merge(collector)
+            done += 1
+
+            if checkpoint:
+
+                # write then rename, so a crash never leaves half a checkpoint behind
+                saved = os.path.join(checkpoint, shard.key + ".pickle")
+
+                with open(saved + ".tmp", "wb") as f:
+                    pickle.dump(collector, f)
+
+                os.replace(saved + ".tmp", saved)
+
+            if progress:
+                elapsed = time.monotonic() - start
+                rate = (merged.games - games_at_start) / elapsed if elapsed else 0
+
+                print(f"[{done}/{len(plan)}] {merged.games} games, {merged.plies} plies, {merged.errors} errors ({rate:.0f} games/s)", file=sys.stderr)
+
+    return merged
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay a PTN archive or playtak games database through TakBoard.")
+    parser.add_argument("path")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shards", type=int, default=None)
+    parser.add_argument("--checkpoint", default=None)
+
+    args = parser.parse_args()
+
+    result = run_job(args.path, ResultCollector, args.workers, args.shards, args.checkpoint)
+
+    for (size, outcome), count in sorted(result.results.items()):
+        print(f"{size}s {outcome}: {count}")
+
+    if profiling.ENABLED:
+        profiling.dump(result.profile)
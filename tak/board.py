@@ -2,9 +2,16 @@
 from itertools import permutations
 from copy import deepcopy
 
+from tak import profiling
+
 RANDOM_SEED = [3141592653589, 644204232404]
 
-def getrandbits(bits: int) -> int:
+# Zobrist keys only depend on the board size, so every board of a given size shares (and hashes with) the same table.
+# That keeps `zobrist_hash` comparable between games, which is what makes it usable as a cache key.
+ZOBRIST_SEED  = (3141592653589, 644204232404)
+ZOBRIST_CACHE = {}
+
+def getrandbits(bits: int, state: list[int] = RANDOM_SEED) -> int:
     
     """
     Get a psuedo-random number given two random int seeds.
@@ -12,21 +19,21 @@ def getrandbits(bits: int) -> int:
     Implements XOR-shift algorithm. Exists because I don't want to mess up the `random` library.
     
     And may be vaguely faster.
-    """
     
-    global RANDOM_SEED
+    Pass your own `state` (a list of two ints) to get a reproducible sequence without touching `RANDOM_SEED`.
+    """
     
     limit = 1 << bits - 1
     
-    seed = RANDOM_SEED[0]
+    seed = state[0]
     
     seed ^= seed >> 12
     seed ^= seed << 25
     seed ^= seed >> 27
-    seed ^= RANDOM_SEED[1] - (RANDOM_SEED[1] >> 5)
+    seed ^= state[1] - (state[1] >> 5)
     
-    RANDOM_SEED.append(seed)
-    del RANDOM_SEED[0]
+    state.append(seed)
+    del state[0]
     
     return seed % limit
 
@@ -119,6 +126,12 @@ class Stack:
     def __eq__(self, other):
         return (self.top == other.top) and (self.stack == other.stack)
 
+class TPSError(ValueError):
+    
+    """
+    Raised when a TPS string can't be loaded.
+    """
+
 class TakBoard:
     
     """
@@ -127,24 +140,28 @@ class TakBoard:
     `board_size` is the length of one side - a 6x6 board (6s) would be `board_size=6`.
     """
     
+    RESERVE_COUNTS = {
+        3: [10, 0],
+        4: [15, 0],
+        5: [21, 1],
+        6: [30, 1],
+        7: [40, 2],
+        8: [50, 2]
+    }
+    
     def __init__(self, board_size: int, half_komi: int) -> None:
         
         self.size = board_size
         self.half_komi = half_komi
         self.state = [Stack() for i in range(board_size ** 2)]
         self.ply = 0
+        
+        # Encoded TPS for each rank (rank 1 first), only re-encoded when a move touches it
+        self.tps_rows   = [None] * board_size
+        self.dirty_rows = set(range(board_size))
                 
         self.SPREAD_PRECALC = self._precalc_move_distances()
         
-        self.RESERVE_COUNTS = {
-            3: [10, 0],
-            4: [15, 0],
-            5: [21, 1],
-            6: [30, 1],
-            7: [40, 2],
-            8: [50, 2]
-        }
-        
         self.player_reserves = {n:self.RESERVE_COUNTS[self.size].copy() for n in ["white", "black"]}
         self.std_reserves    = self.RESERVE_COUNTS[self.size]
         self.terminal = False
@@ -212,6 +229,17 @@ class TakBoard:
         
         return "black" if player == "white" else "white"
     
+    def mark_dirty(self, move: dict) -> None:
+        
+        """
+        Marks every rank `move` touches as needing its TPS re-encoded.
+        """
+        
+        self.dirty_rows.add(move["position"] // self.size)
+        
+        if move["move_type"] == "spread":
+            self.dirty_rows.update(i // self.size for i in move["movement"])
+    
     def count_flats(self) -> dict[str: int]:
         
         """
@@ -325,27 +353,15 @@ class TakBoard:
 
                     dist = len(movement["squares"])
                     
-                    if movement["cap"] and (dist >= 1) and (stones > 1) and (stones >= dist):
-                        
-                        if dist == stones:
-                            
-                            temp = [{
-                                "move_type": "spread",
-                                "position": pos,
-                                "movement": tuple(list(spaces) + [movement["cap"]]),
-                                "stacks": tuple(1 for _ in range(dist))
-                            }]
-                        
-                        else:
-                            
-                            temp = [{
-                                "move_type": "spread",
-                                "position": pos,
-                                "movement": tuple(list(spaces) + [movement["cap"]]),
-                                "stacks": tuple(list(stack_move) + [1])
-                            } for stack_move in self.SPREAD_PRECALC[dist, stones - 1] ]
+                    # a crush needs a stone for every square on the way, and the cap left over for the wall
+                    if movement["cap"] and (dist >= 1) and (stones > dist):
                         
-                        stack_moves += temp
+                        stack_moves += [{
+                            "move_type": "spread",
+                            "position": pos,
+                            "movement": tuple(list(spaces) + [movement["cap"]]),
+                            "stacks": tuple(list(stack_move) + [1])
+                        } for stack_move in self.SPREAD_PRECALC[dist, stones - 1] ]
         
         
         for m, move in enumerate(stack_moves):
@@ -394,7 +410,6 @@ class TakBoard:
         
             hori_check = abs(movement) == 1
             current = pos
-            cap = False
             
             if hori_check: # E/W
                 row = pos // self.size
@@ -550,12 +565,14 @@ class TakBoard:
         
         if move in self.legal_moves:
             
+            self.mark_dirty(move)
+            
             if move["move_type"] == "place":
                 
                 if move["stone_type"] in ["flat", "wall"]:
-                    self.player_reserves[player][0] -= 1
+                    self.player_reserves[move["colour"]][0] -= 1
                 else:
-                    self.player_reserves[player][1] -= 1
+                    self.player_reserves[move["colour"]][1] -= 1
                 
                 self.state[move["position"]].add_stone(Stone(move["colour"], move["stone_type"]))
                 
@@ -563,7 +580,7 @@ class TakBoard:
                 
                 self.zobrist_hash ^= self.get_zobrist_piece_key(move["position"], 0, move["stone_type"], move["colour"])
             
-            elif move["move_type"] == "spread": #! Zobrist is currently broken
+            elif move["move_type"] == "spread":
                 
                 # Get stones
                 
@@ -642,12 +659,14 @@ class TakBoard:
         ###### [Note from dayofni: this f****** function had so many bugs istg-]
         """
         
+        self.mark_dirty(move)
+        
         if move["move_type"] == "place":
             
             self.state[move["position"]].stack = []
             self.state[move["position"]].top   = None
             
-            self.player_reserves[player][1 if move["stone_type"] == "cap" else 0] += 1
+            self.player_reserves[move["colour"]][1 if move["stone_type"] == "cap" else 0] += 1
             
             self.zobrist_hash ^= self.get_zobrist_piece_key(move["position"], 0, move["stone_type"], move["colour"])
         
@@ -727,7 +746,7 @@ class TakBoard:
     def ptn_to_move(self, ptn_string: str, player: str) -> dict:
         
         """
-        Converts a given PTN string to the `TakBoard` internal format.
+        Converts a given PTN string to the `TakBoard` internal format. Returns `None` if it isn't a move in this position.
         
         Internal move formats are below:
         
@@ -826,7 +845,6 @@ class TakBoard:
         #? Ensure that the stack has pieces
         
         if not self.state[position].stack:
-            print("Position fail")
             return None
         
         #? Normalise arrow format
@@ -844,7 +862,6 @@ class TakBoard:
                 ptn_string = ptn_string[1:]
 
             if sum(stacks) != num_stones:
-                print("Stones != movement!")
                 return None
         
         else: stacks = [num_stones]
@@ -855,12 +872,10 @@ class TakBoard:
         
         #? Check that the move doesn't go out of bounds.
         
-        if any([i < 0 or i > len(self.state) for i in movement]):
-            print("OOB vertical")
+        if any([i < 0 or i >= len(self.state) for i in movement]):
             return None
             
         if direction in "<>" and any([(i // self.size) != (position // self.size) for i in movement]):
-            print("OOB horizontal")
             return None
         
         #? Is the move a cap crush?
@@ -1072,142 +1087,187 @@ class TakBoard:
 
         """
         Creates a string representation of the current position using the TPS (Tak Position Notation) format.
+        
+        Ranks are cached, and only the ones marked dirty since the last call (see `TakBoard.mark_dirty`) are re-encoded.
         """
         
-        tps_string = []
+        for row in self.dirty_rows:
+            self.tps_rows[row] = self._encode_TPS_row(row)
         
-        for row_num in range(self.size):
-            
-            current = []
-            
-            current_row = self.size - row_num - 1
+        self.dirty_rows.clear()
+        
+        player = (self.ply) % 2 + 1
+        current_round = self.ply // 2 + 1 # move numbers start at 1
+        
+        return "/".join(reversed(self.tps_rows)) + f" {player} {current_round}"
+    
+    def _encode_TPS_row(self, row_num: int) -> str:
+        
+        """
+        Encodes a single rank (0 is rank 1) as TPS. Used by `TakBoard.position_to_TPS`.
+        """
+        
+        current = []
+        
+        start, end = (self.size * row_num), (self.size * row_num + self.size)
+        row = self.state[start:end]
+        
+        # Collapse
+        
+        x_num = 0
+        
+        for pos in row:
             
-            start, end = (self.size * current_row), (self.size * current_row + self.size)
-            row = self.state[start:end]
+            if pos.top is None:
+                x_num += 1
+                continue
             
-            # Collapse
+            elif x_num:
+                add = str(x_num if x_num > 1 else "")
+                current.append(f"x{add}")
+                x_num = 0
             
-            x_num = 0
-            stack = ""
+            stack = "".join(["1" if stone.colour == "white" else "2" for stone in pos.stack])
             
-            for pos in row:
-                
-                if pos.top is None:
-                    x_num += 1
-                    continue
-                
-                elif x_num:
-                    add = str(x_num if x_num > 1 else "")
-                    current.append(f"x{add}")
-                    x_num = 0
-                
-                stack = ""
-                
-                for stone in pos.stack:
-                    stack += str(1 if stone.colour == "white" else 2)
-                
-                if pos.top.stone_type == "cap":
-                    stack += "C"
-                
-                if pos.top.stone_type == "wall":
-                    stack += "S"
-                
-                current.append(stack)
-                stack = ""
+            if pos.top.stone_type == "cap":
+                stack += "C"
             
-            if x_num:
-                add = str(x_num if x_num > 1 else "")
-                current.append(f"x{add}")
+            if pos.top.stone_type == "wall":
+                stack += "S"
             
-            if stack:
-                current.append(stack)
-                stack = ""
-                
-            tps_string.append(",".join(current))
+            current.append(stack)
         
-        player = (self.ply) % 2 + 1
-        current_round = self.ply // 2
+        if x_num:
+            add = str(x_num if x_num > 1 else "")
+            current.append(f"x{add}")
         
-        return "/".join(tps_string) + f" {player} {current_round}"
+        return ",".join(current)
 
-    def load_from_TPS(self, tps_string: str) -> None:
+    def load_from_TPS(self, tps_string: str, generate_moves: bool = True) -> None:
         
         """
-        ### WARNING: BUGGY!
+        Loads a position from a TPS (Tak Positional Notation) string representation, e.g. `x5/x5/x2,1,x2/x5/2,x4 1 2`.
         
-        Loads a position from a TPS (Tak Positional Notation) string representation.
+        Rebuilds the whole board state in one pass - stacks, reserves, ply, Zobrist hash and the TPS cache.
+        Raises `TPSError` (with the offending rank/square) on malformed input, and leaves the board untouched if it does.
         
+        Set `generate_moves=False` to skip move generation (`TakBoard.legal_moves` is then `[]`) when bulk-loading positions.
         """
         
-        tps_string = tps_string.upper().strip()
+        fields = tps_string.strip().split()
         
-        position, player_turn, ply = tps_string.split(" ")
+        if len(fields) != 3:
+            raise TPSError(f"Expected '<position> <player> <move>', got {len(fields)} field(s).")
         
-        player_turn = "white" if int(player_turn) == 1 else "black"
-        self.ply = int(ply)
+        position, player_turn, move_number = fields
         
-        # generate position
+        if player_turn not in ("1", "2"):
+            raise TPSError(f"Player to move must be 1 or 2, got '{player_turn}'.")
+        
+        if not move_number.isdigit() or int(move_number) < 1:
+            raise TPSError(f"Move number must be a positive integer, got '{move_number}'.")
+        
+        ply = 2 * (int(move_number) - 1) + int(player_turn) - 1
+        player_turn = "white" if player_turn == "1" else "black"
         
         rows = position.split("/")
         
-        if self.size != len(rows):
-            return False
+        if len(rows) != self.size:
+            raise TPSError(f"Expected {self.size} ranks, got {len(rows)}.")
         
         new_state = []
+        used = {"white": [0, 0], "black": [0, 0]} # [flats + walls, caps] taken from the reserves
         
-        # row construction
+        COLOURS = {"1": "white", "2": "black"}
+        TOPS    = {"S": "wall", "C": "cap"}
         
-        for row in reversed(rows):
+        for rank in range(self.size):
             
-            row_data = row.split(",")
+            row = rows[self.size - rank - 1] # TPS starts from the top rank
             
-            new_row = []
+            row_start = len(new_state)
             
-            for pos in row_data:
+            for square in row.split(","):
                 
-                if pos[0] == "X" and len(pos) > 1:
-                    for _ in range(int(pos[1])): new_row.append(Stack())
-                    continue
+                if not square:
+                    raise TPSError(f"Empty square in rank {rank + 1}.")
                 
-                elif pos[0] == "X":
-                    new_row.append(Stack())
+                if square[0] in "xX":
+                    
+                    count = square[1:] or "1"
+                    
+                    if not count.isdigit() or int(count) < 1:
+                        raise TPSError(f"Invalid empty run '{square}' in rank {rank + 1}.")
+                    
+                    new_state += [Stack() for _ in range(int(count))]
                     continue
                 
-                new_row.append(Stack())
+                top = TOPS.get(square[-1].upper(), "flat")
+                colours = square[:-1] if top != "flat" else square
                 
-                if pos[-1].isalpha():                        # pos -1 is a letter, ergo must be SC
-                    top = {"S": "wall", "C": "cap"}[pos[-1]] # hehe dictionary go brrrrr
-                    pos = pos[:-1]
-                else:
-                    top = "flat"
+                if not colours or colours.strip("12"):
+                    raise TPSError(f"Invalid stack '{square}' in rank {rank + 1}.")
                 
-                for s, stone in enumerate(pos):
-                    
-                    if s == len(pos) - 1:
-                        stone = Stone("white" if stone == "1" else "black", top)
-                    else:
-                        stone = Stone("white" if stone == "1" else "black", "flat")
-
-                    # Subtract from supply
-                    # If supply == 0
-                    
-                    reserve = 1 if stone.stone_type == "cap" else 0
-                    supply = self.player_reserves[stone.colour][reserve]
-                    
-                    if supply == 0: return False
-                    
-                    self.player_reserves[stone.colour][reserve] -= 1
-                    
-                    new_row[-1].add_stone(stone)
+                stack = Stack()
                 
+                for colour in colours[:-1]:
+                    stack.stack.append(Stone(COLOURS[colour], "flat"))
+                
+                stack.top = Stone(COLOURS[colours[-1]], top)
+                stack.stack.append(stack.top)
+                
+                for colour in colours[:-1]:
+                    used[COLOURS[colour]][0] += 1
+                
+                used[stack.top.colour][1 if top == "cap" else 0] += 1
+                
+                new_state.append(stack)
+            
+            if len(new_state) - row_start != self.size:
+                raise TPSError(f"Rank {rank + 1} has {len(new_state) - row_start} squares, expected {self.size}.")
+        
+        reserves = {}
+        
+        for colour, (stones, caps) in used.items():
             
-            new_state += new_row
+            flats_left, caps_left = self.std_reserves[0] - stones, self.std_reserves[1] - caps
             
+            if flats_left < 0 or caps_left < 0:
+                raise TPSError(f"{colour.capitalize()} has more pieces on the board than a {self.size}s reserve allows.")
+            
+            reserves[colour] = [flats_left, caps_left]
+        
+        # Everything's valid, swap it in
+        
         self.state = new_state
+        self.ply = ply
+        self.player_reserves = reserves
+        
+        self.terminal = False
+        self.winning_player = None
+        self.win_type = None
         
-        self.legal_moves = self.get_valid_moves(player_turn)
+        self.zobrist_hash = self.generate_zobrist_hash(player_turn)
+        self.dirty_rows.update(range(self.size))
         
-        # determine legal moves for player 
+        self.legal_moves = self.get_valid_moves(player_turn) if generate_moves else []
+    
+    @classmethod
+    def from_TPS(cls, tps_string: str, half_komi: int = 0, generate_moves: bool = True) -> "TakBoard":
+        
+        """
+        Creates a board from a TPS string. The board size is taken from the number of ranks.
+        """
+        
+        size = tps_string.count("/", 0, tps_string.strip().find(" ")) + 1
+        
+        if size not in cls.RESERVE_COUNTS:
+            raise TPSError(f"Unsupported board size {size}.")
+        
+        board = cls(size, half_komi)
+        board.load_from_TPS(tps_string, generate_moves)
+        
+        return board
     
     #? Win determination
     
@@ -1484,8 +1544,14 @@ class TakBoard:
         
         """
         Generates all Zobrist keys required for the Zobrist hashing function.
+        
+        Keys are generated from `ZOBRIST_SEED`, so they're identical for every board of the same size.
+        They're also cached in `ZOBRIST_CACHE` - generating them took seconds on a 6s board.
         """
         
+        if self.size in ZOBRIST_CACHE:
+            return ZOBRIST_CACHE[self.size]
+        
         ZOBRIST_BITS = 64
         
         reserves = self.std_reserves
@@ -1499,21 +1565,22 @@ class TakBoard:
             "black_to_move": None
         }
         
-        used_keys = []
+        state     = list(ZOBRIST_SEED) # reset random seed
+        used_keys = set()
         
         while len(ZOBRIST_KEYS["stack"]) < (board_size * stone_number * max_height):
-            key = getrandbits(ZOBRIST_BITS)
+            key = getrandbits(ZOBRIST_BITS, state)
             
             if key in used_keys:
                 continue
             
-            used_keys.append(key)
+            used_keys.add(key)
             ZOBRIST_KEYS["stack"].append(key)
 
         ZOBRIST_KEYS["stack"] = tuple(ZOBRIST_KEYS["stack"])
 
         while not ZOBRIST_KEYS["black_to_move"]:
-            key = getrandbits(ZOBRIST_BITS)
+            key = getrandbits(ZOBRIST_BITS, state)
             
             if key in used_keys:
                 continue
@@ -1521,7 +1588,8 @@ class TakBoard:
             ZOBRIST_KEYS["black_to_move"] = key
         
         # Number of different stones * board size * max height + current_player
-        # reset random seed
+        
+        ZOBRIST_CACHE[self.size] = ZOBRIST_KEYS
         
         return ZOBRIST_KEYS
     
@@ -1577,6 +1645,32 @@ class TakBoard:
         
         return current_hash
     
+    def generate_canonical_hash(self, player: str) -> int:
+        
+        """
+        Generates the smallest Zobrist hash over all 8 symmetries of the position.
+        
+        Rotated or mirrored copies of a position share a canonical hash, so they can be looked up as one.
+        """
+        
+        to_move = self.ZOBRIST_CONSTANTS["black_to_move"] if player == "black" else 0
+        
+        hashes = []
+        
+        for transform in self.TRANSFORMATIONS.values():
+            
+            current_hash = to_move
+            
+            for position, source in enumerate(transform):
+                
+                if not self.state[source].stack: continue
+                
+                current_hash ^= self.get_zobrist_stack_key(position, self.state[source])
+            
+            hashes.append(current_hash)
+        
+        return min(hashes)
+    
     def __hash__(self):
         
         """
@@ -1674,6 +1768,7 @@ class TakBoard:
         """
         
         self.state = [self.state[i] for i in self.TRANSFORMATIONS[(board, rotation)]]
+        self.dirty_rows.update(range(self.size))
         
         self.legal_moves = [self.transform_move(m, board, rotation) for m in self.legal_moves]
 
@@ -1705,6 +1800,7 @@ class TakBoard:
         """
         
         self.state = [self.state[i] for i in transform]
+        self.dirty_rows.update(range(self.size))
         
         self.legal_moves = [self.transform_move_free(m, transform) for m in self.legal_moves]
     
@@ -1754,4 +1850,8 @@ class TakBoard:
             
             move["movement"] = tuple(pos_to_new(i) for i in move["movement"])
         
-        return move
\ No newline at end of file
+        return move
+
+# TAK_PROFILE=1 wraps the hot paths with call counters and timers - see `tak.profiling`
+if profiling.ENABLED:
+    profiling.install(TakBoard)
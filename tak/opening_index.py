@@ -0,0 +1,226 @@
+"""
+Opening explorer: how often a position has been reached, and how White scored from it.
+
+The index is built by replaying an archive (see `tak.archive`) and keyed by `TakBoard.zobrist_hash`.
+Each board size gets its own file - Zobrist tables are per size, so hashes aren't comparable across sizes.
+
+On disk it's a short header followed by fixed-width records sorted by hash, so a lookup is
+a binary search over a memory-mapped file - no parsing, no loading, microseconds per query.
+
+    python -m tak.opening_index games.db data/ --workers 8
+"""
+
+import argparse
+import functools
+import mmap
+import os
+import struct
+
+from typing import NamedTuple, Optional
+
+from tak.archive import ReplayCollector, run_job
+
+MAGIC = b"TAKOPEN1"
+HEADER = struct.Struct("<8sII")   # magic, board size, record count
+RECORD = struct.Struct("<QIIII")  # hash, games, white wins, black wins, draws
+
+WHITE_WINS = {"R-0", "F-0", "1-0"}
+BLACK_WINS = {"0-R", "0-F", "0-1"}
+DRAWS      = {"1/2-1/2"}
+
+class OpeningStats(NamedTuple):
+
+    games: int
+    white: int
+    black: int
+    draws: int
+
+    @property
+    def white_score(self) -> float:
+
+        """
+        White's score from this position, counting draws as half a point.
+        """
+
+        return (self.white + self.draws / 2) / self.games
+
+class OpeningCollector(ReplayCollector):
+
+    """
+    Counts games and results for every position in the first `max_ply` plies of each game, per board size.
+
+    A position reached twice in the same game (e.g. after a repetition) only counts once.
+    """
+
+    def __init__(self, max_ply: int = 40):
+
+        super().__init__()
+
+        self.max_ply = max_ply
+        self.positions = {} # size -> {hash: [games, white, black, draws]}
+
+        self.seen = set()
+
+    def start_game(self, game_id, game):
+        self.seen = set()
+
+    def position(self, game_id, ply, move, board):
+
+        if ply <= self.max_ply:
+            self.seen.add(board.zobrist_hash)
+
+    def end_game(self, game_id, game, board):
+
+        result = game.result or board.generate_win_str()
+
+        if result in WHITE_WINS:
+            outcome = 1
+        elif result in BLACK_WINS:
+            outcome = 2
+        elif result in DRAWS:
+            outcome = 3
+        else:
+            return # aborted or unknown, doesn't tell us anything
+
+        table = self.positions.setdefault(game.size, {})
+
+        for zobrist_hash in self.seen:
+
+            counts = table.setdefault(zobrist_hash, [0, 0, 0, 0])
+            counts[0] += 1
+            counts[outcome] += 1
+
+    def merge(self, other):
+
+        super().merge(other)
+
+        for size, positions in other.positions.items():
+
+            table = self.positions.setdefault(size, {})
+
+            for zobrist_hash, counts in positions.items():
+
+                if zobrist_hash in table:
+                    table[zobrist_hash] = [a + b for a, b in zip(table[zobrist_hash], counts)]
+                else:
+                    table[zobrist_hash] = counts
+
+def index_path(directory: str, size: int) -> str:
+    return os.path.join(directory, f"openings_{size}.idx")
+
+def write_index(path: str, size: int, positions: dict[int, list[int]], min_games: int = 1) -> int:
+
+    """
+    Writes `positions` (hash -> counts) to `path` in the sorted on-disk format. Returns the number of records written.
+
+    The file is written alongside and renamed into place, so a running bot never maps half an index.
+    """
+
+    records = sorted((h, c) for h, c in positions.items() if c[0] >= min_games)
+
+    with open(path + ".tmp", "wb") as f:
+
+        f.write(HEADER.pack(MAGIC, size, len(records)))
+
+        for zobrist_hash, counts in records:
+            f.write(RECORD.pack(zobrist_hash, *counts))
+
+    os.replace(path + ".tmp", path)
+
+    return len(records)
+
+class OpeningIndex:
+
+    """
+    A memory-mapped opening index for one board size.
+    """
+
+    def __init__(self, path: str):
+
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.size, self.count = HEADER.unpack_from(self.map, 0)
+
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't an opening index.")
+
+    def lookup(self, zobrist_hash: int) -> Optional[OpeningStats]:
+
+        """
+        Returns the stats for the position with `zobrist_hash`, or `None` if it isn't in the index.
+        """
+
+        low, high = 0, self.count
+
+        while low < high:
+
+            middle = (low + high) // 2
+            key = struct.unpack_from("<Q", self.map, HEADER.size + middle * RECORD.size)[0]
+
+            if key < zobrist_hash:
+                low = middle + 1
+            elif key > zobrist_hash:
+                high = middle
+            else:
+                return OpeningStats(*RECORD.unpack_from(self.map, HEADER.size + middle * RECORD.size)[1:])
+
+        return None
+
+    def close(self):
+        self.map.close()
+
+class OpeningBook:
+
+    """
+    Every opening index in a directory, one per board size. Sizes without an index just return `None`.
+    """
+
+    def __init__(self, directory: str):
+
+        self.indexes = {}
+
+        for size in range(3, 9):
+
+            path = index_path(directory, size)
+
+            if os.path.exists(path):
+                self.indexes[size] = OpeningIndex(path)
+
+    def lookup(self, size: int, zobrist_hash: int) -> Optional[OpeningStats]:
+
+        index = self.indexes.get(size)
+
+        return index.lookup(zobrist_hash) if index else None
+
+def build_index(archive: str, directory: str, workers: int = None, max_ply: int = 40, min_games: int = 1, checkpoint: Optional[str] = None) -> dict[int, int]:
+
+    """
+    Replays `archive` and writes an index per board size to `directory`. Returns the number of positions per size.
+    """
+
+    collector = run_job(archive, functools.partial(OpeningCollector, max_ply), workers, checkpoint=checkpoint)
+
+    os.makedirs(directory, exist_ok=True)
+
+    return {
+        size: write_index(index_path(directory, size), size, positions, min_games)
+        for size, positions in collector.positions.items()
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build opening explorer indexes from a game archive.")
+    parser.add_argument("archive")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-ply", type=int, default=40)
+    parser.add_argument("--min-games", type=int, default=1)
+    parser.add_argument("--checkpoint", default=None)
+
+    args = parser.parse_args()
+
+    written = build_index(args.archive, args.directory, args.workers, args.max_ply, args.min_games, args.checkpoint)
+
+    for size, count in sorted(written.items()):
+        print(f"{size}s: {count} positions")
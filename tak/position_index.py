@@ -0,0 +1,262 @@
+"""
+Position search: every (game id, ply) at which a position has been reached.
+
+An inverted index from canonical position hash (`TakBoard.generate_canonical_hash`) to a compressed postings list,
+stored in SQLite. Built from the archive with the parallel replay job, then kept up to date as live games finish.
+
+Postings are sorted by game id and stored as varints - the gap to the previous game id, then the ply -
+so a typical entry is a couple of bytes, and new games (with larger ids) are appended without decoding anything.
+Games that finish out of id order are merged in, which means decoding and re-encoding that position's list.
+
+    python -m tak.position_index games.db data/positions.db --workers 8
+"""
+
+import argparse
+import sqlite3
+import threading
+
+from typing import Iterable, Optional
+
+from tak.archive import ReplayCollector, plan_shards, run_job, shard_games
+from tak.board import TakBoard
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    size      INTEGER NOT NULL,
+    hash      INTEGER NOT NULL,
+    last_game INTEGER NOT NULL,
+    count     INTEGER NOT NULL,
+    data      BLOB NOT NULL,
+    PRIMARY KEY (size, hash)
+) WITHOUT ROWID
+"""
+
+#? Postings encoding
+
+def encode_varint(value: int, out: bytearray) -> None:
+
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    out.append(value)
+
+def encode_postings(postings: Iterable[tuple[int, int]], last_game: int = 0) -> bytes:
+
+    """
+    Encodes sorted `(game_id, ply)` pairs. `last_game` is the game id the gaps start from (for appending).
+    """
+
+    out = bytearray()
+
+    for game_id, ply in postings:
+        encode_varint(game_id - last_game, out)
+        encode_varint(ply, out)
+        last_game = game_id
+
+    return bytes(out)
+
+def decode_postings(data: bytes) -> list[tuple[int, int]]:
+
+    """
+    Decodes a postings list back to `(game_id, ply)` pairs.
+    """
+
+    values = []
+    value, shift = 0, 0
+
+    for byte in data:
+
+        value |= (byte & 0x7f) << shift
+
+        if byte & 0x80:
+            shift += 7
+            continue
+
+        values.append(value)
+        value, shift = 0, 0
+
+    postings = []
+    game_id = 0
+
+    for gap, ply in zip(values[::2], values[1::2]):
+        game_id += gap
+        postings.append((game_id, ply))
+
+    return postings
+
+#? Building
+
+class PositionCollector(ReplayCollector):
+
+    """
+    Collects `(game_id, ply)` postings for every position, by `(size, canonical hash)`.
+
+    Game ids must be playtak's - a game without one (PTN with no `Id` header) is counted as an error and left out.
+    """
+
+    def __init__(self):
+
+        super().__init__()
+        self.postings = {}
+
+    def start_game(self, game_id, game):
+
+        if not isinstance(game_id, int):
+            raise ValueError("No game id.")
+
+    def position(self, game_id, ply, move, board):
+
+        player = "white" if board.ply % 2 == 0 else "black"
+        key = (board.size, board.generate_canonical_hash(player))
+
+        self.postings.setdefault(key, []).append((game_id, ply))
+
+    def merge(self, other):
+
+        super().merge(other)
+
+        for key, postings in other.postings.items():
+            self.postings.setdefault(key, []).extend(postings)
+
+class PositionIndex:
+
+    """
+    The position search index. Safe to share between threads - every query takes the connection lock.
+    """
+
+    def __init__(self, path: str):
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+        self.lock = threading.Lock()
+
+    def add_postings(self, postings: dict[tuple[int, int], list[tuple[int, int]]]) -> None:
+
+        """
+        Adds postings (`(size, hash) -> [(game_id, ply), ...]`) to the index in one transaction.
+
+        Postings newer than everything indexed for a position are appended. Anything else (live games finish
+        out of order, an archive rebuild meets games already indexed) is merged in, skipping duplicates.
+        """
+
+        with self.lock, self.connection:
+
+            for (size, position_hash), new in postings.items():
+
+                new = sorted(new)
+
+                row = self.connection.execute(
+                    "SELECT last_game, count, data FROM postings WHERE size = ? AND hash = ?", (size, position_hash)
+                ).fetchone()
+
+                if row is None:
+                    self.connection.execute(
+                        "INSERT INTO postings VALUES (?, ?, ?, ?, ?)",
+                        (size, position_hash, new[-1][0], len(new), encode_postings(new))
+                    )
+                    continue
+
+                last_game, count, data = row
+
+                if new[0][0] <= last_game:
+                    merged = sorted(set(decode_postings(data)).union(new))
+
+                    self.connection.execute(
+                        "UPDATE postings SET last_game = ?, count = ?, data = ? WHERE size = ? AND hash = ?",
+                        (merged[-1][0], len(merged), encode_postings(merged), size, position_hash)
+                    )
+                    continue
+
+                # the gaps carry on from the last indexed game, so the old postings are never decoded
+                self.connection.execute(
+                    "UPDATE postings SET last_game = ?, count = ?, data = ? WHERE size = ? AND hash = ?",
+                    (new[-1][0], count + len(new), data + encode_postings(new, last_game), size, position_hash)
+                )
+
+    def add_game(self, game_id: int, size: int, half_komi: int, moves: list[dict]) -> None:
+
+        """
+        Indexes a finished game, given its moves in the `TakBoard` format.
+        """
+
+        board = TakBoard(size, half_komi)
+        player = "white"
+
+        postings = {}
+
+        for ply, move in enumerate(moves, 1):
+
+            if board.legal_moves is None or not board.make_move(move, player):
+                break
+
+            player = board.invert_player(player)
+            postings.setdefault((size, board.generate_canonical_hash(player)), []).append((game_id, ply))
+
+        if postings:
+            self.add_postings(postings)
+
+    def search(self, board: TakBoard) -> list[tuple[int, int]]:
+
+        """
+        Returns every `(game_id, ply)` where the position on `board` (or a rotation/reflection of it) was reached.
+        """
+
+        player = "white" if board.ply % 2 == 0 else "black"
+        return self.search_hash(board.size, board.generate_canonical_hash(player))
+
+    def search_hash(self, size: int, position_hash: int) -> list[tuple[int, int]]:
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM postings WHERE size = ? AND hash = ?", (size, position_hash)
+            ).fetchone()
+
+        return decode_postings(row[0]) if row else []
+
+    def close(self):
+        self.connection.close()
+
+def build_index(archive: str, path: str, workers: int = None, checkpoint: Optional[str] = None) -> int:
+
+    """
+    Replays `archive` and adds every position to the index at `path`. Returns the number of distinct positions.
+
+    PTN archives need an `Id` header on every game, to link the positions back to playtak.
+    """
+
+    # worth finding out before the whole archive's been replayed
+    for shard in plan_shards(archive, 1):
+
+        for game_id, game in shard_games(shard):
+
+            if game_id is None:
+                raise ValueError(f"{shard.path} has games without an Id header, their positions couldn't be linked to anything.")
+
+            break
+
+    collector = run_job(archive, PositionCollector, workers, checkpoint=checkpoint)
+
+    index = PositionIndex(path)
+
+    try:
+        index.add_postings(collector.postings)
+    finally:
+        index.close()
+
+    return len(collector.postings)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build the position search index from a game archive.")
+    parser.add_argument("archive")
+    parser.add_argument("path")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--checkpoint", default=None)
+
+    args = parser.parse_args()
+
+    print(f"{build_index(args.archive, args.path, args.workers, args.checkpoint)} positions indexed")
@@ -0,0 +1,101 @@
+"""
+Opt-in profiling of `TakBoard`'s hot paths: call counts and cumulative time per method.
+
+Set `TAK_PROFILE=1` in the environment and the methods in `PROFILED` get wrapped when `tak.board` is imported.
+Without it nothing is wrapped, so there's no cost at all. Times are inclusive - `get_valid_moves` includes its
+`get_valid_spreads` calls. Stats are per process (worker processes inherit the variable, and keep their own).
+
+    TAK_PROFILE=1 python -m tak.archive games.db --workers 8
+"""
+
+import functools
+import os
+import sys
+import threading
+import time
+
+ENABLED = os.environ.get("TAK_PROFILE", "") not in ("", "0")
+
+PROFILED = (
+    "get_valid_moves",
+    "get_valid_spreads",
+    "make_move",
+    "undo_move",
+    "find_connections",
+    "position_to_TPS",
+)
+
+STATS = {} # method -> [calls, total seconds]
+LOCK = threading.Lock()
+
+def profiled(name: str, method):
+
+    stats = STATS.setdefault(name, [0, 0.0])
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+
+        start = time.perf_counter()
+
+        try:
+            return method(*args, **kwargs)
+
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with LOCK:
+                stats[0] += 1
+                stats[1] += elapsed
+
+    return wrapper
+
+def install(cls) -> None:
+
+    """
+    Wraps the `PROFILED` methods of `cls` (i.e. `TakBoard`). Called by `tak.board` when profiling is on.
+    """
+
+    for name in PROFILED:
+        setattr(cls, name, profiled(name, getattr(cls, name)))
+
+def snapshot(reset: bool = False) -> dict[str, tuple[int, float]]:
+
+    """
+    Returns `{method: (calls, total seconds)}`. With `reset`, the counters start again from zero.
+    """
+
+    with LOCK:
+
+        result = {name: tuple(stats) for name, stats in STATS.items()}
+
+        if reset:
+            for stats in STATS.values():
+                stats[0], stats[1] = 0, 0.0
+
+    return result
+
+def merge(into: dict, other: dict) -> dict:
+
+    """
+    Adds the snapshot `other` (e.g. from another process) into `into`, and returns it.
+    """
+
+    for name, (calls, total) in other.items():
+        old_calls, old_total = into.get(name, (0, 0.0))
+        into[name] = (old_calls + calls, old_total + total)
+
+    return into
+
+def dump(stats: dict = None, file=sys.stderr) -> None:
+
+    """
+    Prints a table of `stats` (by default, this process's) to `file`, slowest method first.
+    """
+
+    stats = snapshot() if stats is None else stats
+
+    print(f"{'method':<20} {'calls':>12} {'total s':>10} {'per call':>10}", file=file)
+
+    for name, (calls, total) in sorted(stats.items(), key=lambda item: -item[1][1]):
+        per_call = f"{total / calls * 1e6:.1f}us" if calls else "-"
+        print(f"{name:<20} {calls:>12} {total:>10.3f} {per_call:>10}", file=file)
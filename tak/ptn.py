@@ -0,0 +1,308 @@
+"""
+Streaming reader for PTN (Portable Tak Notation) game files, and a replay engine to go with it.
+
+Everything here is lazy - files are read line by line and games are yielded one at a time,
+so replaying years of archives never needs more than a single game in memory.
+"""
+
+import gzip
+import os
+import re
+import zipfile
+
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from tak.board import TakBoard, TPSError
+
+HEADER = re.compile(r'^\s*\[(\w+)\s+"(.*)"\s*\]\s*$')
+
+MOVE = re.compile(r"^([1-8]?)([FSCfsc]?)([a-hA-H][1-8])([-+<>]?)([1-8]*)\*?['\"!?]*$")
+
+MOVE_NUMBER = re.compile(r"^\d+\.$")
+
+RESULTS = {"R-0", "0-R", "F-0", "0-F", "1-0", "0-1", "1/2-1/2", "0-0"}
+
+class PTNError(ValueError):
+
+    """
+    Raised when a PTN game can't be parsed or replayed.
+    """
+
+class PTNGame(NamedTuple):
+
+    """
+    A single game from a PTN file.
+
+    Moves are kept as compact, normalised PTN strings - stone letter upper case, square lower case,
+    no annotations (e.g., `Sc3`, `3c3>12`).
+    """
+
+    headers: dict[str, str]
+    moves: tuple[str]
+    result: Optional[str]
+
+    @property
+    def size(self) -> int:
+        return int(self.headers.get("Size", 0))
+
+    @property
+    def half_komi(self) -> int:
+        return round(float(self.headers.get("Komi", 0)) * 2)
+
+#? Parsing
+
+def normalise_move(token: str) -> Optional[str]:
+
+    """
+    Returns the normalised form of the PTN move `token`, or `None` if it isn't a move.
+    """
+
+    match = MOVE.match(token)
+
+    if match is None:
+        return None
+
+    count, stone, square, direction, drops = match.groups()
+
+    if direction and stone:
+        return None # stones are only given for placements
+
+    if not direction and (count or drops):
+        return None # and counts only for spreads
+
+    return f"{count}{stone.upper()}{square.lower()}{direction}{drops}"
+
+def read_games(lines: Iterable[str], strict: bool = True) -> Iterator[PTNGame]:
+
+    """
+    Lazily parses PTN games from `lines` (any iterable of strings, e.g. an open file).
+
+    A new game starts at the first header after some moves. Comments (`{...}`) may span lines.
+
+    Unparseable move text raises `PTNError`, unless `strict=False`, in which case that game is skipped.
+    """
+
+    headers = {}
+    moves = []
+    result = None
+
+    in_comment = False
+    broken = False
+
+    for number, line in enumerate(lines, 1):
+
+        if not in_comment:
+
+            header = HEADER.match(line)
+
+            if header:
+
+                if (moves or result) and not broken:
+                    yield PTNGame(headers, tuple(moves), result)
+
+                if moves or result or broken:
+                    headers, moves, result = {}, [], None
+                    broken = False
+
+                headers[header[1]] = header[2]
+                continue
+
+        # strip comments, keeping track of ones that carry on to the next line
+
+        text = ""
+
+        for char in line:
+
+            if in_comment:
+                in_comment = char != "}"
+
+            elif char == "{":
+                in_comment = True
+
+            else:
+                text += char
+
+        for token in text.split():
+
+            if MOVE_NUMBER.match(token):
+                continue
+
+            if token in RESULTS:
+                result = token
+                continue
+
+            move = normalise_move(token)
+
+            if move is None and strict:
+                raise PTNError(f"Line {number}: '{token}' isn't a move.")
+
+            if move is None:
+                broken = True
+                break
+
+            moves.append(move)
+
+    if (headers or moves or result) and not broken:
+        yield PTNGame(headers, tuple(moves), result)
+
+def iter_lines(path: str) -> Iterator[str]:
+
+    """
+    Yields every line of PTN in `path` - a `.ptn` file, a gzipped `.ptn.gz`, a `.zip` of PTN files, or a directory of any of those.
+    """
+
+    if os.path.isdir(path):
+
+        for root, dirs, files in os.walk(path):
+
+            dirs.sort()
+
+            for name in sorted(files):
+
+                if name.endswith((".ptn", ".ptn.gz", ".zip")):
+                    yield from iter_lines(os.path.join(root, name))
+
+    elif path.endswith(".gz"):
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            yield from f
+
+    elif path.endswith(".zip"):
+
+        with zipfile.ZipFile(path) as archive:
+
+            for name in sorted(archive.namelist()):
+
+                if not name.endswith(".ptn"):
+                    continue
+
+                with archive.open(name) as f:
+
+                    for line in f:
+                        yield line.decode("utf-8")
+
+    else:
+
+        with open(path, encoding="utf-8") as f:
+            yield from f
+
+def is_plain(path: str) -> bool:
+
+    """
+    Whether `path` is a single uncompressed PTN file - the only kind that can be read from the middle.
+    """
+
+    return not os.path.isdir(path) and not path.endswith((".gz", ".zip"))
+
+def split_offsets(path: str, parts: int) -> list[int]:
+
+    """
+    Byte offsets that cut the plain PTN file at `path` into (roughly) `parts` pieces, each starting at the first header of a game.
+
+    Starts with 0 and ends with the size of the file. Small files, or ones with few games, may get fewer pieces.
+    """
+
+    size = os.path.getsize(path)
+    offsets = [0]
+
+    with open(path, "rb") as f:
+
+        for part in range(1, parts):
+
+            f.seek(max(size * part // parts, offsets[-1]))
+            f.readline() # most likely landed mid-line
+
+            previous_header = True # not a game's first header, as far as we know
+
+            while True:
+
+                offset = f.tell()
+                line = f.readline()
+
+                if not line:
+                    break
+
+                header = HEADER.match(line.decode("utf-8", errors="replace")) is not None
+
+                if header and not previous_header:
+                    break
+
+                previous_header = header
+
+            if not line: # no more games after this point
+                break
+
+            offsets.append(offset)
+
+    return offsets + [size]
+
+def iter_range(path: str, start: int, end: int) -> Iterator[str]:
+
+    """
+    Yields the lines of the plain PTN file at `path` that start at or after byte `start` and before `end`.
+    """
+
+    with open(path, "rb") as f:
+
+        f.seek(start)
+
+        while start < end:
+
+            line = f.readline()
+
+            if not line:
+                return
+
+            start += len(line)
+
+            yield line.decode("utf-8")
+
+def read_archive(path: str, strict: bool = True) -> Iterator[PTNGame]:
+
+    """
+    Lazily parses every game in `path`. See `iter_lines` for what counts as an archive.
+    """
+
+    return read_games(iter_lines(path), strict)
+
+#? Replaying
+
+def replay(game: PTNGame, board: Optional[TakBoard] = None) -> Iterator[tuple[int, str, TakBoard]]:
+
+    """
+    Plays through `game`, yielding `(ply, move, board)` after every move.
+
+    The same board is yielded each time and keeps changing, so copy out anything you want to keep.
+    Pass a `board` of the right size to reuse it between games (it's reset first).
+
+    Raises `PTNError` if a move is illegal.
+    """
+
+    size = game.size
+
+    if size not in TakBoard.RESERVE_COUNTS:
+        raise PTNError(f"Unsupported board size '{game.headers.get('Size')}'.")
+
+    if board is None or board.size != size:
+        board = TakBoard(size, game.half_komi)
+    else:
+        board.half_komi = game.half_komi
+
+    try:
+        board.load_from_TPS(game.headers.get("TPS", f"{'/'.join(['x' + str(size)] * size)} 1 1"))
+    except TPSError as e:
+        raise PTNError(f"Bad TPS header: {e}") from None
+
+    for ptn in game.moves:
+
+        player = "white" if board.ply % 2 == 0 else "black"
+
+        try:
+            move = board.ptn_to_move(ptn, player)
+        except (ValueError, AssertionError, IndexError):
+            move = None
+
+        if move is None or board.legal_moves is None or not board.make_move(move, player):
+            raise PTNError(f"Illegal move '{ptn}' at ply {board.ply}.")
+
+        yield board.ply, ptn, board
@@ -0,0 +1,387 @@
+"""
+Tiny board renderer for `TakBoard` positions. Standard library only, so it runs happily in worker processes.
+
+Positions are passed around as *snapshots* - a tuple with one string per square (same order as `TakBoard.state`).
+Each string is the stack from bottom to top in TPS style: "" is an empty square, "121S" is a stack topped by a white wall.
+"""
+
+import json
+import struct
+import zlib
+
+# Palette slots, in the order they're written to the PNG palette.
+PALETTE_KEYS = (
+    "bg",
+    "board1",
+    "board2",
+    "board3",
+    "primary",
+    "player1flat",
+    "player1special",
+    "player1border",
+    "player2flat",
+    "player2special",
+    "player2border",
+)
+
+SLOT = {key: n for n, key in enumerate(PALETTE_KEYS)}
+
+# Fallbacks if the theme is missing a colour.
+DEFAULT_COLOURS = {
+    "bg": "#000000",
+    "board1": "#b39976",
+    "board2": "#a8906f",
+    "board3": "#998365",
+    "primary": "#ff388b",
+    "player1flat": "#f2f2f2",
+    "player1special": "#f2f2f2",
+    "player1border": "#000000",
+    "player2flat": "#474747",
+    "player2special": "#474747",
+    "player2border": "#000000",
+}
+
+#max stones drawn in the stack strip on the side of a square
+MAX_STRIP = 10
+
+#? Snapshots
+
+def encode_stack(stack) -> str:
+
+    """
+    Encodes a `Stack` as a snapshot string. (e.g., "1221C")
+    """
+
+    if not stack.stack:
+        return ""
+
+    colours = "".join("1" if stone.colour == "white" else "2" for stone in stack.stack)
+
+    return colours + {"flat": "", "wall": "S", "cap": "C"}[stack.top.stone_type]
+
+def snapshot(board) -> tuple[str]:
+
+    """
+    Takes a picklable snapshot of `board` for the renderer.
+    """
+
+    return tuple(encode_stack(stack) for stack in board.state)
+
+def move_squares(move: dict) -> tuple[int]:
+
+    """
+    Returns every square touched by `move` (in the `TakBoard` format), for highlighting.
+    """
+
+    if move is None:
+        return ()
+
+    if move["move_type"] == "place":
+        return (move["position"],)
+
+    return (move["position"], *move["movement"])
+
+#? Themes
+
+def parse_colour(colour: str) -> tuple[int, int, int]:
+
+    """
+    Converts a "#rrggbb" or "#rrggbbaa" string to an RGB tuple. Alpha is dropped, the PNG is opaque.
+    """
+
+    colour = colour.lstrip("#")
+
+    return tuple(int(colour[i:i + 2], 16) for i in (0, 2, 4))
+
+def theme_palette(theme: str) -> tuple[tuple[int, int, int]]:
+
+    """
+    Builds the render palette from a ptn.ninja theme string (the contents of `data/theme.json`).
+    """
+
+    colours = DEFAULT_COLOURS | json.loads(theme).get("colors", {})
+
+    return tuple(parse_colour(colours[key]) for key in PALETTE_KEYS)
+
+#? Rasterising
+
+class Canvas:
+
+    """
+    A paletted image. Pixels are palette indices, stored row-major in a single `bytearray`.
+    """
+
+    def __init__(self, width: int, height: int, fill: int = 0) -> None:
+
+        self.width = width
+        self.height = height
+        self.pixels = bytearray([fill]) * (width * height)
+
+    def fill_rect(self, x0: int, y0: int, x1: int, y1: int, colour: int) -> None:
+
+        """
+        Fills the rectangle [x0, x1) x [y0, y1).
+        """
+
+        x0, x1 = max(x0, 0), min(x1, self.width)
+        y0, y1 = max(y0, 0), min(y1, self.height)
+
+        if x0 >= x1:
+            return
+
+        span = bytes([colour]) * (x1 - x0)
+
+        for y in range(y0, y1):
+            start = y * self.width + x0
+            self.pixels[start:start + len(span)] = span
+
+    def frame_rect(self, x0: int, y0: int, x1: int, y1: int, colour: int, width: int = 1) -> None:
+
+        """
+        Draws the outline of the rectangle [x0, x1) x [y0, y1), `width` pixels thick.
+        """
+
+        self.fill_rect(x0, y0, x1, y0 + width, colour)
+        self.fill_rect(x0, y1 - width, x1, y1, colour)
+        self.fill_rect(x0, y0, x0 + width, y1, colour)
+        self.fill_rect(x1 - width, y0, x1, y1, colour)
+
+    def fill_circle(self, cx: int, cy: int, r: int, colour: int) -> None:
+
+        """
+        Fills a circle centred on (cx, cy) with radius `r`.
+        """
+
+        for dy in range(-r, r + 1):
+            dx = int((r * r - dy * dy) ** 0.5)
+            self.fill_rect(cx - dx, cy + dy, cx + dx + 1, cy + dy + 1, colour)
+
+def draw_stone(canvas: Canvas, x: int, y: int, square: int, player: str, stone_type: str) -> None:
+
+    """
+    Draws the top stone of a stack in the square whose top-left corner is (x, y).
+    """
+
+    fill   = SLOT[f"player{player}flat"] if stone_type == "flat" else SLOT[f"player{player}special"]
+    border = SLOT[f"player{player}border"]
+
+    cx, cy = x + square // 2, y + square // 2
+
+    if stone_type == "cap":
+        r = square * 3 // 10
+        canvas.fill_circle(cx, cy, r, border)
+        canvas.fill_circle(cx, cy, r - 2, fill)
+
+    elif stone_type == "wall":
+        w, h = square // 10, square * 3 // 10
+        canvas.fill_rect(cx - w, cy - h, cx + w, cy + h, border)
+        canvas.fill_rect(cx - w + 2, cy - h + 2, cx + w - 2, cy + h - 2, fill)
+
+    else:
+        h = square * 3 // 10
+        canvas.fill_rect(cx - h, cy - h, cx + h, cy + h, border)
+        canvas.fill_rect(cx - h + 2, cy - h + 2, cx + h - 2, cy + h - 2, fill)
+
+def draw_strip(canvas: Canvas, x: int, y: int, square: int, stack: str) -> None:
+
+    """
+    Draws the stones under the top of a stack as a strip of bars down the right side of the square.
+    """
+
+    below = stack.rstrip("SC")[:-1][-MAX_STRIP:]
+
+    bar = max(square // (MAX_STRIP + 2), 2)
+    x0, x1 = x + square - square // 6, x + square - square // 16
+
+    for n, player in enumerate(reversed(below)): # top of the stack first
+        y0 = y + square // 12 + n * bar
+
+        canvas.fill_rect(x0, y0, x1, y0 + bar, SLOT[f"player{player}border"])
+        canvas.fill_rect(x0 + 1, y0 + 1, x1 - 1, y0 + bar - 1, SLOT[f"player{player}flat"])
+
+def rasterise(board: tuple[str], size: int, highlight: tuple[int] = (), square: int = 48, checker: bool = False) -> Canvas:
+
+    """
+    Draws the snapshot `board` of a `size`x`size` board. `highlight` squares get a frame in the theme's primary colour.
+    """
+
+    pad = square // 4
+    canvas = Canvas(size * square + 2 * pad, size * square + 2 * pad, SLOT["bg"])
+
+    for index, stack in enumerate(board):
+
+        rank, file = divmod(index, size)
+        x, y = pad + file * square, pad + (size - rank - 1) * square # rank 1 at the bottom
+
+        tile = SLOT["board2"] if checker and (rank + file) % 2 else SLOT["board1"]
+
+        canvas.fill_rect(x, y, x + square, y + square, tile)
+        canvas.frame_rect(x, y, x + square, y + square, SLOT["board3"])
+
+        if index in highlight:
+            canvas.frame_rect(x + 1, y + 1, x + square - 1, y + square - 1, SLOT["primary"], width=3)
+
+        if not stack:
+            continue
+
+        stone_type = {"S": "wall", "C": "cap"}.get(stack[-1], "flat")
+        player     = stack.rstrip("SC")[-1]
+
+        draw_stone(canvas, x, y, square, player, stone_type)
+        draw_strip(canvas, x, y, square, stack)
+
+    return canvas
+
+#? Encoding
+
+def png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def encode_png(canvas: Canvas, palette: tuple[tuple[int, int, int]]) -> bytes:
+
+    """
+    Encodes `canvas` as an 8-bit paletted PNG.
+    """
+
+    width = canvas.width
+
+    # every scanline is prefixed with filter type 0 (none)
+    raw = b"".join(b"\x00" + canvas.pixels[y * width:(y + 1) * width] for y in range(canvas.height))
+
+    header = struct.pack(">IIBBBBB", width, canvas.height, 8, 3, 0, 0, 0)
+    plte   = b"".join(bytes(colour) for colour in palette)
+
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        png_chunk(b"IHDR", header),
+        png_chunk(b"PLTE", plte),
+        png_chunk(b"IDAT", zlib.compress(raw, 6)),
+        png_chunk(b"IEND", b""),
+    ])
+
+def render_png(board: tuple[str], size: int, palette: tuple[tuple[int, int, int]], highlight: tuple[int] = (), square: int = 48, checker: bool = False) -> bytes:
+
+    """
+    Renders the snapshot `board` to PNG bytes. Module-level so it can be shipped to a process pool.
+    """
+
+    return encode_png(rasterise(board, size, highlight, square, checker), palette)
+
+#? Animated GIFs
+
+# GIF palettes must have a power-of-two size. 16 slots leaves room for the whole theme.
+GIF_COLOUR_BITS = 4
+
+def lzw_encode(pixels: bytes, min_code_size: int) -> bytes:
+
+    """
+    GIF-flavoured LZW compression of `pixels` (variable code width, LSB-first packing).
+    """
+
+    clear, end = 1 << min_code_size, (1 << min_code_size) + 1
+
+    out = bytearray()
+    bits, bit_count = 0, 0
+
+    code_size = min_code_size + 1
+    next_code = end + 1
+    table = {}
+
+    def emit(code):
+        nonlocal bits, bit_count
+
+        bits |= code << bit_count
+        bit_count += code_size
+
+        while bit_count >= 8:
+            out.append(bits & 0xff)
+            bits >>= 8
+            bit_count -= 8
+
+    emit(clear)
+
+    current = pixels[0]
+
+    for pixel in pixels[1:]:
+
+        key = (current << 8) | pixel
+
+        if key in table:
+            current = table[key]
+            continue
+
+        emit(current)
+
+        if next_code < 4096:
+            table[key] = next_code
+
+            if next_code == 1 << code_size and code_size < 12:
+                code_size += 1
+
+            next_code += 1
+
+        else: # table's full, start again
+            emit(clear)
+
+            code_size = min_code_size + 1
+            next_code = end + 1
+            table = {}
+
+        current = pixel
+
+    emit(current)
+    emit(end)
+
+    if bit_count:
+        out.append(bits & 0xff)
+
+    return bytes(out)
+
+def gif_sub_blocks(data: bytes) -> bytes:
+
+    """
+    Splits `data` into GIF sub-blocks (at most 255 bytes each), followed by the block terminator.
+    """
+
+    blocks = b"".join(bytes([len(data[i:i + 255])]) + data[i:i + 255] for i in range(0, len(data), 255))
+
+    return blocks + b"\x00"
+
+def encode_gif_frame(canvas: Canvas) -> bytes:
+
+    """
+    Encodes `canvas` as a GIF image block (descriptor + compressed data), without a graphic control extension.
+    
+    Frames don't carry their delay, so the same frame can be reused in any animation.
+    """
+
+    descriptor = b"," + struct.pack("<HHHHB", 0, 0, canvas.width, canvas.height, 0)
+
+    return descriptor + bytes([GIF_COLOUR_BITS]) + gif_sub_blocks(lzw_encode(canvas.pixels, GIF_COLOUR_BITS))
+
+def render_gif_frame(board: tuple[str], size: int, highlight: tuple[int] = (), square: int = 32, checker: bool = False) -> bytes:
+
+    """
+    Renders the snapshot `board` to a GIF image block. Module-level so it can be shipped to a process pool.
+    """
+
+    return encode_gif_frame(rasterise(board, size, highlight, square, checker))
+
+def encode_gif(frames: list[bytes], delays: list[int], width: int, height: int, palette: tuple[tuple[int, int, int]]) -> bytes:
+
+    """
+    Assembles image blocks from `encode_gif_frame` into a looping animated GIF. `delays` are in hundredths of a second.
+    """
+
+    table_size = 1 << GIF_COLOUR_BITS
+    colours    = b"".join(bytes(colour) for colour in palette) + b"\x00\x00\x00" * (table_size - len(palette))
+
+    screen = struct.pack("<HHBBB", width, height, 0x80 | (GIF_COLOUR_BITS - 1), 0, 0)
+    loop   = b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", 0) + b"\x00"
+
+    body = b"".join(
+        b"\x21\xf9\x04\x00" + struct.pack("<H", delay) + b"\x00\x00" + frame
+        for frame, delay in zip(frames, delays)
+    )
+
+    return b"GIF89a" + screen + colours + loop + body + b";"
@@ -0,0 +1,105 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from tak.archive import ReplayCollector, ResultCollector, plan_shards, run_job, shard_games
+from tak.ptn import read_archive
+
+OPENINGS = ["a1 e5", "e1 a5", "c3 b2", "a1 b1", "d4 c3"]
+
+def ptn_game(number: int) -> str:
+
+    moves = OPENINGS[number % len(OPENINGS)].split()
+    comment = " {a comment\nthat runs on}" if number % 3 == 0 else ""
+
+    return f'[Id "{number}"]\n[Size "5"]\n[Komi "0"]\n\n1. {moves[0]} {moves[1]}{comment} 0-R\n\n'
+
+class CountingCollector(ReplayCollector):
+
+    def __init__(self):
+
+        super().__init__()
+        self.ids = []
+
+    def start_game(self, game_id, game):
+        self.ids.append(game_id)
+
+    def merge(self, other):
+
+        super().merge(other)
+        self.ids += other.ids
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "games.ptn")
+
+        with open(self.path, "w") as f:
+            f.write("".join(ptn_game(number) for number in range(1, 41)))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ptn_shards_split_at_game_boundaries(self):
+
+        plan = plan_shards(self.path, 7)
+
+        self.assertGreater(len(plan), 1)
+        self.assertEqual(plan[0].start, 0)
+        self.assertEqual(plan[-1].end, os.path.getsize(self.path))
+
+        for before, after in zip(plan, plan[1:]):
+            self.assertEqual(before.end, after.start)
+
+        # every game exactly once, whole
+        games = [game for shard in plan for _, game in shard_games(shard)]
+        self.assertEqual(games, list(read_archive(self.path)))
+
+    def test_ptn_ids_come_from_the_headers(self):
+
+        ids = [game_id for shard in plan_shards(self.path, 4) for game_id, _ in shard_games(shard)]
+        self.assertEqual(ids, list(range(1, 41)))
+
+    def test_compressed_files_are_one_shard_each(self):
+
+        with open(self.path, "rb") as f, gzip.open(os.path.join(self.directory.name, "more.ptn.gz"), "wb") as g:
+            g.write(f.read())
+
+        plan = plan_shards(self.directory.name, 8)
+
+        self.assertEqual([shard.end for shard in plan if shard.path.endswith(".gz")], [None])
+        self.assertEqual(sum(1 for shard in plan for _ in shard_games(shard)), 80)
+
+    def test_checkpoints_are_kept_per_collector(self):
+
+        checkpoint = os.path.join(self.directory.name, "checkpoint")
+
+        results = run_job(self.path, ResultCollector, workers=2, shards=4, checkpoint=checkpoint, progress=False)
+        counted = run_job(self.path, CountingCollector, workers=2, shards=4, checkpoint=checkpoint, progress=False)
+
+        self.assertEqual(sum(results.results.values()), 40)
+        self.assertEqual(sorted(counted.ids), list(range(1, 41)))
+
+        # and a re-run is served from them
+        again = run_job(self.path, CountingCollector, workers=2, shards=4, checkpoint=checkpoint, progress=False)
+        self.assertEqual(sorted(again.ids), list(range(1, 41)))
+
+    def test_broken_checkpoints_are_replayed(self):
+
+        checkpoint = os.path.join(self.directory.name, "checkpoint")
+        run_job(self.path, CountingCollector, workers=2, shards=4, checkpoint=checkpoint, progress=False)
+
+        directory = os.path.join(checkpoint, f"{CountingCollector.__module__}.{CountingCollector.__qualname__}")
+        broken = sorted(os.listdir(directory))[0]
+
+        with open(os.path.join(directory, broken), "wb") as f:
+            f.write(b"not a pickle")
+
+        counted = run_job(self.path, CountingCollector, workers=2, shards=4, checkpoint=checkpoint, progress=False)
+        self.assertEqual(sorted(counted.ids), list(range(1, 41)))
+
+if __name__ == "__main__":
+    unittest.main()
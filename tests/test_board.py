@@ -0,0 +1,189 @@
+import random
+import unittest
+
+from tak.board import TakBoard, TPSError
+
+POSITIONS = [
+    "x5/x5/x5/x5/x5 1 1",
+    "x5/x5/x2,1,x2/x5/2,x4 1 2",
+    "2,x4/x,1S,x3/x2,12C,x2/x3,21,x/1,x3,2 2 5",
+    "x6/x6/x2,2S,1,x2/x,221,x4/x6/1C,x4,2C 2 9",
+    "x3/x,1,x/2,x2 1 2",
+    "1121S,x5/x6/x6/x6/x6/x5,2 1 4",
+]
+
+SIZES = (3, 4, 5, 6) # bigger boards take seconds just to set up
+
+def random_games(count: int, seed: int = 0):
+
+    """
+    Yields `(board, moves)` after every move of `count` random games on random sizes. The board changes as the game goes on.
+    """
+
+    rng = random.Random(seed)
+
+    for _ in range(count):
+
+        board = TakBoard(rng.choice(SIZES), 0)
+        player = "white"
+        moves = []
+
+        while board.legal_moves and len(moves) < 150:
+
+            move = rng.choice(board.legal_moves)
+            assert board.make_move(move, player)
+
+            moves.append((move, player))
+            player = board.invert_player(player)
+
+            yield board, moves
+
+class Scratch:
+
+    """
+    One board per size to load positions into, instead of setting up a new one every time.
+    """
+
+    def __init__(self):
+        self.boards = {}
+
+    def load(self, tps: str) -> TakBoard:
+
+        size = tps.count("/", 0, tps.find(" ")) + 1
+
+        if size not in self.boards:
+            self.boards[size] = TakBoard(size, 0)
+
+        self.boards[size].load_from_TPS(tps, generate_moves=False)
+
+        return self.boards[size]
+
+class TPSTest(unittest.TestCase):
+
+    def test_round_trip(self):
+
+        for tps in POSITIONS:
+            with self.subTest(tps=tps):
+                self.assertEqual(TakBoard.from_TPS(tps).position_to_TPS(), tps)
+
+    def test_load_sets_ply_reserves_and_hash(self):
+
+        board = TakBoard.from_TPS("2,x4/x,1S,x3/x2,12C,x2/x3,21,x/1,x3,2 2 5")
+
+        self.assertEqual(board.ply, 9)
+        self.assertEqual(board.player_reserves, {"white": [17, 1], "black": [18, 0]})
+        self.assertEqual(board.zobrist_hash, board.generate_zobrist_hash("black"))
+
+    def test_errors(self):
+
+        cases = [
+            (5, "x5/x5/x5/x5/x5 1", "Expected '<position> <player> <move>', got 2 field(s)."),
+            (5, "x5/x5/x5/x5/x5 3 1", "Player to move must be 1 or 2, got '3'."),
+            (5, "x5/x5/x5/x5/x5 1 0", "Move number must be a positive integer, got '0'."),
+            (5, "x5/x5/x5/x5 1 1", "Expected 5 ranks, got 4."),
+            (5, "x5/x5/x5/x5/1,,x3 1 1", "Empty square in rank 1."),
+            (5, "x5/x5/x5/x0,x5/x5 1 1", "Invalid empty run 'x0' in rank 2."),
+            (5, "x5/x5/3,x4/x5/x5 1 1", "Invalid stack '3' in rank 3."),
+            (5, "x5/x5/x5/x5/x4 1 1", "Rank 1 has 4 squares, expected 5."),
+            (5, "x5/x5/x5/x5/x5,1 1 1", "Rank 1 has 6 squares, expected 5."),
+            (3, "1111111111,x2/x3/1,x2 1 1", "White has more pieces on the board than a 3s reserve allows."),
+            (4, "x4/x4/x4/2C,x3 1 1", "Black has more pieces on the board than a 4s reserve allows."),
+        ]
+
+        for size, tps, message in cases:
+
+            with self.subTest(tps=tps):
+
+                board = TakBoard(size, 0)
+                before = board.position_to_TPS()
+
+                with self.assertRaises(TPSError) as caught:
+                    board.load_from_TPS(tps)
+
+                self.assertEqual(str(caught.exception), message)
+                self.assertEqual(board.position_to_TPS(), before) # untouched
+
+    def test_unsupported_size(self):
+
+        with self.assertRaisesRegex(TPSError, "Unsupported board size 2."):
+            TakBoard.from_TPS("x2/x2 1 1")
+
+class RandomGameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = Scratch()
+
+    def test_cached_tps_matches_a_full_encode(self):
+
+        for board, _ in random_games(30):
+
+            tps = board.position_to_TPS() # only the ranks the last move touched are re-encoded
+
+            board.dirty_rows.update(range(board.size))
+            self.assertEqual(board.position_to_TPS(), tps)
+
+            self.assertEqual(self.scratch.load(tps).position_to_TPS(), tps)
+
+    def test_incremental_hash_matches_full_hash(self):
+
+        for board, _ in random_games(30, seed=1):
+
+            player = "white" if board.ply % 2 == 0 else "black"
+
+            self.assertEqual(board.zobrist_hash, board.generate_zobrist_hash(player))
+            self.assertEqual(board.zobrist_hash, self.scratch.load(board.position_to_TPS()).zobrist_hash)
+
+    def test_canonical_hash_is_the_same_for_every_symmetry(self):
+
+        for board, moves in random_games(10, seed=2):
+
+            if len(moves) % 10: # every 10th position is plenty
+                continue
+
+            player = "white" if board.ply % 2 == 0 else "black"
+            canonical = board.generate_canonical_hash(player)
+
+            for transform in board.TRANSFORMATIONS:
+
+                copy = self.scratch.load(board.position_to_TPS())
+                copy.transform_board(*transform)
+
+                self.assertEqual(copy.generate_canonical_hash(player), canonical)
+
+    def test_undo_restores_the_position(self):
+
+        rng = random.Random(3)
+
+        for size in SIZES:
+
+            board = TakBoard(size, 0)
+            player = "white"
+            history = []
+
+            while board.legal_moves and len(history) < 150:
+
+                move = rng.choice(board.legal_moves)
+                history.append((move, player, board.position_to_TPS(), board.zobrist_hash))
+
+                board.make_move(move, player)
+                player = board.invert_player(player)
+
+            for move, player, tps, zobrist_hash in reversed(history):
+
+                board.undo_move(move, player)
+
+                self.assertEqual(board.position_to_TPS(), tps)
+                self.assertEqual(board.zobrist_hash, zobrist_hash)
+
+    def test_spreads_drop_a_stone_on_every_square(self):
+
+        for board, _ in random_games(30, seed=4):
+
+            for move in board.legal_moves or []:
+
+                if move["move_type"] == "spread":
+                    self.assertEqual(len(move["movement"]), len(move["stacks"]), move)
+                    self.assertTrue(all(stones >= 1 for stones in move["stacks"]), move)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+os.environ.setdefault("NAMAKO_STATE_DIR", tempfile.mkdtemp()) # before the import, so the position index isn't made in data/
+
+from clients import GameWatcher as watcher_module
+from clients.GameWatcher import FENCE, GameWatcher
+from clients.tracing import TraceBuffer
+
+DATA = {
+    "game_no": 7, "player_1": "alice", "player_2": "bob", "size": 5, "time": 900, "increment": 10, "half_komi": 0,
+    "pieces": 21, "capstones": 1, "unrated": 0, "tournament": 0, "extra_time_move": 0, "extra_time_amount": 0, "result": None
+}
+
+# placements that never make a road
+SQUARES = ["A1", "E5", "C3", "B2", "D4", "A5", "E1", "B4", "D2", "C5", "A3", "E3", "B1", "D5"]
+
+def placements(count: int) -> list[str]:
+    return [f"Game#7 P {square}" for square in SQUARES[:count]]
+
+class WatcherTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+
+        self.gw = GameWatcher(dict(DATA), "header", None, {})
+        await watcher_module.BOARD_EXECUTOR.run(self.gw.gameId, self.gw.resetBoard)
+
+        self.edits = [] # moves on the board at each embed update
+        self.cleaned = False
+
+        async def update_embed():
+            self.edits.append(len(self.gw.moves))
+            self.gw.pending = []
+            await asyncio.sleep(self.edit_time)
+
+        async def clean_up():
+            self.cleaned = True
+
+        self.edit_time = 0
+        self.gw.updateEmbed = update_embed
+        self.gw.cleanUp = clean_up
+
+        self.frames = asyncio.Queue()
+
+    def tearDown(self):
+        self.gw.tokens.remove(self.gw.token)
+
+    async def feed(self, messages: list[str], interval: float):
+
+        for msg in messages:
+            self.frames.put_nowait((time.monotonic(), msg))
+            await asyncio.sleep(interval)
+
+    async def watch(self, backlog: list[str], live: list[str], interval: float):
+
+        """
+        Runs the catch-up and main loop the way `observe` does, with `backlog` (and the fence) up front
+        and `live` arriving every `interval` seconds.
+        """
+
+        for msg in backlog + [FENCE]:
+            self.frames.put_nowait((time.monotonic(), msg))
+
+        feeder = asyncio.create_task(self.feed(live, interval))
+
+        before = (len(self.gw.moves), self.gw.engine.zobrist_hash)
+        self.gw.stale = True
+
+        end, rest = await self.gw.catchUp(self.frames, before)
+        caught_up = len(self.gw.moves)
+
+        if end is None:
+            await asyncio.wait_for(self.gw.mainLoop(self.frames, rest), timeout=10)
+
+        await feeder
+
+        return caught_up
+
+    async def test_backlog_ends_at_the_fence_with_fast_live_moves(self):
+
+        # 20 frames/s, far faster than any quiet-period rule would allow
+        caught_up = await self.watch(placements(4), placements(12)[4:] + ["Game#7 Over R-0"], interval=0.05)
+
+        self.assertEqual(caught_up, 4)
+        self.assertEqual(self.edits[0], 4) # the backlog gets one edit
+        self.assertGreater(len(self.edits), 2) # and the live moves get theirs while the game's going
+        self.assertEqual(len(self.gw.moves), 12)
+        self.assertTrue(self.cleaned)
+
+    async def test_live_moves_are_coalesced_under_a_steady_stream(self):
+
+        # edits take longer than the gap between moves, so moves pile up behind each edit
+        self.edit_time = 0.2
+
+        await self.watch([], placements(14) + ["Game#7 Over R-0"], interval=0.025)
+
+        self.assertEqual(len(self.gw.moves), 14)
+        self.assertLess(len(self.edits), 14)
+        self.assertGreater(len(self.edits), 1)
+        self.assertEqual(self.edits, sorted(self.edits))
+        self.assertTrue(self.cleaned)
+
+    async def test_live_frames_behind_the_fence_are_not_swallowed(self):
+
+        for msg in placements(2) + [FENCE] + placements(3)[2:]:
+            self.frames.put_nowait((time.monotonic(), msg))
+
+        self.gw.stale = True
+        end, rest = await self.gw.catchUp(self.frames, (0, self.gw.engine.zobrist_hash))
+
+        self.assertIsNone(end)
+        self.assertEqual(len(self.gw.moves), 2)
+        self.assertEqual([msg for _, msg in rest], placements(3)[2:])
+
+    async def test_game_over_during_the_gap_keeps_the_board(self):
+
+        for msg in placements(3):
+            self.gw.makeMove(msg.split()[1:])
+
+        self.gw.checkEnded = mock.AsyncMock(return_value=True)
+        self.frames.put_nowait((time.monotonic(), FENCE)) # nothing to replay, the game's gone
+
+        self.gw.stale = True
+        end, _ = await self.gw.catchUp(self.frames, (3, self.gw.engine.zobrist_hash))
+
+        self.assertEqual(end, "over")
+        self.assertTrue(self.cleaned)
+        self.assertEqual(len(self.gw.moves), 3)
+
+    async def test_missing_fence_gives_up_after_the_deadline(self):
+
+        self.frames.put_nowait((time.monotonic(), placements(1)[0]))
+        self.gw.stale = True
+
+        with mock.patch.object(watcher_module, "CATCHUP_MAX", 0.2):
+            end, rest = await self.gw.catchUp(self.frames, (0, self.gw.engine.zobrist_hash))
+
+        self.assertIsNone(end)
+        self.assertEqual(rest, [])
+        self.assertEqual(len(self.gw.moves), 1)
+
+class EditTraceTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+
+        self.gw = GameWatcher(dict(DATA), "header", mock.Mock(), {})
+        await watcher_module.BOARD_EXECUTOR.run(self.gw.gameId, self.gw.resetBoard)
+
+        self.gw.renderImage = mock.AsyncMock(return_value=None)
+        self.gw.messages = ["first", "second"]
+
+    def tearDown(self):
+        self.gw.tokens.remove(self.gw.token)
+
+    async def update(self, results: list) -> list:
+
+        self.gw.discord_cl.edit = mock.AsyncMock(side_effect=results)
+        self.gw.pending = [(1, time.monotonic(), time.monotonic())]
+
+        with mock.patch.object(watcher_module, "TRACES", TraceBuffer()) as traces:
+            await self.gw.updateEmbed()
+
+        return traces.recent()
+
+    async def test_moves_are_traced_once_an_edit_lands(self):
+        self.assertEqual(len(await self.update([None, "second"])), 1)
+
+    async def test_moves_are_not_traced_when_every_edit_failed(self):
+        self.assertEqual(await self.update([None, None]), [])
+
+class TraceBufferTest(unittest.TestCase):
+
+    def trace(self, edited: float):
+        return watcher_module.MoveTrace(7, 1, edited, edited, edited, edited)
+
+    def test_traces_older_than_the_window_are_dropped(self):
+
+        traces = TraceBuffer(window=60)
+        now = time.monotonic()
+
+        traces.record(self.trace(now - 90))
+        traces.record(self.trace(now - 30))
+        traces.record(self.trace(now))
+
+        self.assertEqual([trace.edited for trace in traces.recent()], [now - 30, now])
+        self.assertEqual(traces.covered(), 60)
+
+    def test_a_full_buffer_reports_what_it_covers(self):
+
+        traces = TraceBuffer(window=3600, limit=2)
+        now = time.monotonic()
+
+        for age in (300, 200, 100):
+            traces.record(self.trace(now - age))
+
+        self.assertAlmostEqual(traces.covered(), 200, delta=1)
+
+if __name__ == "__main__":
+    unittest.main()
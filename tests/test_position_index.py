@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+
+from tak.board import TakBoard
+from tak.position_index import PositionIndex, build_index, decode_postings, encode_postings
+
+GAME = '[Size "5"]\n[Komi "0"]\n\n1. a1 e5 2. c3 0-R\n\n'
+
+class PositionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = PositionIndex(os.path.join(self.directory.name, "positions.db"))
+
+    def tearDown(self):
+
+        self.index.close()
+        self.directory.cleanup()
+
+    def test_postings_round_trip(self):
+
+        postings = [(1, 3), (2, 0), (300, 12), (70000, 1)]
+        self.assertEqual(decode_postings(encode_postings(postings)), postings)
+
+    def test_games_added_in_order_are_appended(self):
+
+        self.index.add_postings({(5, 7): [(100, 2)]})
+        self.index.add_postings({(5, 7): [(101, 4)]})
+
+        self.assertEqual(self.index.search_hash(5, 7), [(100, 2), (101, 4)])
+
+    def test_games_added_out_of_order_are_merged(self):
+
+        # live games finish out of id order, and share their opening positions
+        self.index.add_postings({(5, 7): [(101, 2)], (5, 8): [(101, 3)]})
+        self.index.add_postings({(5, 7): [(100, 2)], (5, 9): [(100, 3)]})
+        self.index.add_postings({(5, 7): [(99, 2), (102, 2)]})
+
+        self.assertEqual(self.index.search_hash(5, 7), [(99, 2), (100, 2), (101, 2), (102, 2)])
+        self.assertEqual(self.index.search_hash(5, 8), [(101, 3)])
+        self.assertEqual(self.index.search_hash(5, 9), [(100, 3)])
+
+        # and appending still carries on from the merged list
+        self.index.add_postings({(5, 7): [(103, 2)]})
+        self.assertEqual(self.index.search_hash(5, 7)[-2:], [(102, 2), (103, 2)])
+
+    def test_reindexing_a_game_adds_nothing(self):
+
+        # e.g. an archive rebuild into a database that already has the live games
+        self.index.add_postings({(5, 7): [(100, 2), (101, 2)]})
+        self.index.add_postings({(5, 7): [(100, 2), (101, 2), (102, 6)]})
+
+        self.assertEqual(self.index.search_hash(5, 7), [(100, 2), (101, 2), (102, 6)])
+
+    def test_add_game_out_of_order(self):
+
+        board = TakBoard(5, 0)
+        moves = []
+
+        for ptn, player in (("a1", "white"), ("e5", "black"), ("c3", "white")):
+            move = board.ptn_to_move(ptn, player)
+            board.make_move(move, player)
+            moves.append(move)
+
+        self.index.add_game(101, 5, 0, moves)
+        self.index.add_game(100, 5, 0, moves)
+
+        self.assertEqual(self.index.search(board), [(100, 3), (101, 3)])
+
+    def write_archive(self, games: list[str]) -> str:
+
+        path = os.path.join(self.directory.name, "games.ptn")
+
+        with open(path, "w") as f:
+            f.write("".join(games))
+
+        return path
+
+    def test_build_index_takes_ids_from_the_headers(self):
+
+        archive = self.write_archive([f'[Id "{game_id}"]\n' + GAME for game_id in (300, 12)])
+        self.index.close()
+
+        build_index(archive, os.path.join(self.directory.name, "positions.db"), workers=1)
+        self.index = PositionIndex(os.path.join(self.directory.name, "positions.db"))
+
+        board = TakBoard(5, 0)
+
+        for ptn, player in (("a1", "white"), ("e5", "black")):
+            board.make_move(board.ptn_to_move(ptn, player), player)
+
+        self.assertEqual(self.index.search(board), [(12, 2), (300, 2)])
+
+    def test_build_index_rejects_ptn_without_ids(self):
+
+        archive = self.write_archive([GAME, GAME])
+
+        with self.assertRaises(ValueError):
+            build_index(archive, os.path.join(self.directory.name, "other.db"), workers=1)
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "other.db")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from tak.ptn import PTNError, iter_lines, normalise_move, read_archive, read_games, replay
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "games.ptn")
+
+class ReadTest(unittest.TestCase):
+
+    def test_headers_moves_and_results(self):
+
+        first, *_ = read_archive(FIXTURE, strict=False)
+
+        self.assertEqual(first.headers["Player1"], "alice")
+        self.assertEqual(first.headers["Id"], "101")
+        self.assertEqual((first.size, first.half_komi), (5, 4))
+        self.assertEqual(first.result, "0-R")
+
+    def test_comments_are_skipped_even_across_lines(self):
+
+        first, *_ = read_archive(FIXTURE, strict=False)
+
+        # the comment mentions a1 and 3c3>, neither of them is a move
+        self.assertEqual(first.moves, ("a1", "e5", "c3", "Sd4", "Cb2", "1d4-"))
+
+    def test_malformed_game_raises_when_strict(self):
+
+        with self.assertRaisesRegex(PTNError, "Line 18: 'x9' isn't a move."):
+            list(read_archive(FIXTURE))
+
+    def test_malformed_game_is_skipped_when_not_strict(self):
+
+        games = list(read_archive(FIXTURE, strict=False))
+
+        self.assertEqual([game.headers["Id"] for game in games], ["101", "103", "104"])
+
+    def test_games_without_moves_or_headers(self):
+
+        self.assertEqual(list(read_games([])), [])
+        self.assertEqual([game.moves for game in read_games(["1. a1 e5\n", "2. c3 R-0\n"])], [("a1", "e5", "c3")])
+
+    def test_normalise_move(self):
+
+        cases = {
+            "a1": "a1", "C3": "c3", "sA1": "Sa1", "cb2": "Cb2",
+            "3c3>12": "3c3>12", "3c3>12*": "3c3>12", "a1'!": "a1",
+            "Sa1+": None, "3a1": None, "a1+1x": None, "i1": None, "1.": None,
+        }
+
+        for token, expected in cases.items():
+            with self.subTest(token=token):
+                self.assertEqual(normalise_move(token), expected)
+
+class ArchiveFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_gzip_zip_and_directories_read_the_same(self):
+
+        with open(FIXTURE, "rb") as f:
+            data = f.read()
+
+        with gzip.open(os.path.join(self.directory, "a.ptn.gz"), "wb") as f:
+            f.write(data)
+
+        with zipfile.ZipFile(os.path.join(self.directory, "b.zip"), "w") as archive:
+            archive.writestr("games.ptn", data)
+            archive.writestr("readme.txt", "not PTN")
+
+        os.makedirs(os.path.join(self.directory, "c"))
+        shutil.copy(FIXTURE, os.path.join(self.directory, "c", "games.ptn"))
+
+        expected = list(read_archive(FIXTURE, strict=False))
+
+        self.assertEqual(list(read_archive(os.path.join(self.directory, "a.ptn.gz"), strict=False)), expected)
+        self.assertEqual(list(read_archive(os.path.join(self.directory, "b.zip"), strict=False)), expected)
+        self.assertEqual(list(read_archive(self.directory, strict=False)), expected * 3)
+
+        self.assertEqual(len(list(iter_lines(self.directory))), 3 * len(data.decode().splitlines()))
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.games = {game.headers["Id"]: game for game in read_archive(FIXTURE, strict=False)}
+
+    def test_replay(self):
+
+        plies = [(ply, move) for ply, move, _ in replay(self.games["101"])]
+
+        self.assertEqual(plies, list(enumerate(self.games["101"].moves, 1)))
+
+    def test_replay_from_a_tps_header(self):
+
+        *_, (ply, move, board) = replay(self.games["104"])
+
+        self.assertEqual((ply, move), (6, "d4"))
+        self.assertEqual(board.position_to_TPS(), "x3,2/x4/x,1,2,x/1,x3 1 4")
+
+    def test_illegal_move_raises(self):
+
+        with self.assertRaisesRegex(PTNError, "Illegal move '3b2\\+21' at ply 3."):
+            list(replay(self.games["103"]))
+
+    def test_bad_size_and_tps_raise(self):
+
+        game = self.games["104"]
+
+        with self.assertRaisesRegex(PTNError, "Unsupported board size '9'."):
+            list(replay(game._replace(headers=game.headers | {"Size": "9"})))
+
+        with self.assertRaisesRegex(PTNError, "Bad TPS header: Expected 4 ranks, got 3."):
+            list(replay(game._replace(headers=game.headers | {"TPS": "x4/x4/x4 1 1"})))
+
+if __name__ == "__main__":
+    unittest.main()
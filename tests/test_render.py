@@ -0,0 +1,98 @@
+import io
+import random
+import unittest
+
+from tak import render
+from tak.board import TakBoard
+
+try:
+    from PIL import Image
+except ImportError: # Pillow isn't a dependency, it's only here to check our output against a real decoder
+    Image = None
+
+PALETTE = render.theme_palette("{}")
+COLOURS = PALETTE + ((0, 0, 0),) * ((1 << render.GIF_COLOUR_BITS) - len(PALETTE)) # the colour table, padded with black
+
+def canvas_from(width: int, height: int, pixels) -> render.Canvas:
+
+    canvas = render.Canvas(width, height)
+    canvas.pixels[:] = bytes(pixels)
+
+    return canvas
+
+@unittest.skipIf(Image is None, "needs Pillow")
+class GIFTest(unittest.TestCase):
+
+    def decode(self, canvases: list[render.Canvas], delays: list[int] = None) -> "Image.Image":
+
+        frames = [render.encode_gif_frame(canvas) for canvas in canvases]
+        width, height = canvases[0].width, canvases[0].height
+
+        return Image.open(io.BytesIO(render.encode_gif(frames, delays or [10] * len(frames), width, height, PALETTE)))
+
+    def assertFrame(self, image: "Image.Image", canvas: render.Canvas):
+
+        # compared as colours, Pillow may hand later frames back as RGB
+        expected = b"".join(bytes(COLOURS[index]) for index in canvas.pixels)
+
+        self.assertEqual(image.size, (canvas.width, canvas.height))
+        self.assertEqual(image.convert("RGB").tobytes(), expected)
+
+    def test_patterns(self):
+
+        rng = random.Random(0)
+
+        cases = {
+            "one pixel": (1, 1, [3]),
+            "flat": (64, 64, [0] * 64 * 64),
+            "stripes": (37, 23, [(x // 3) % 16 for x in range(37 * 23)]),
+            "two colours": (50, 50, [rng.choice((1, 9)) for _ in range(50 * 50)]),
+            "every colour": (16, 1, range(16)),
+        }
+
+        for name, (width, height, pixels) in cases.items():
+
+            with self.subTest(name):
+                canvas = canvas_from(width, height, pixels)
+                self.assertFrame(self.decode([canvas]), canvas)
+
+    def test_code_table_overflow(self):
+
+        # noise barely compresses, so the 4096-entry table fills (and is cleared) several times over
+        rng = random.Random(1)
+        canvas = canvas_from(200, 200, [rng.randrange(16) for _ in range(200 * 200)])
+
+        data = render.lzw_encode(canvas.pixels, render.GIF_COLOUR_BITS)
+        self.assertGreater(len(data) * 8 // 12, 2 * 4096) # more codes than fit in two tables, even at the widest
+
+        self.assertFrame(self.decode([canvas]), canvas)
+
+    def test_rendered_board(self):
+
+        board = TakBoard.from_TPS("2,x4/x,1S,x3/x2,12C,x2/x3,21,x/1,x3,2 2 5")
+        snapshot = render.snapshot(board)
+
+        canvas = render.rasterise(snapshot, 5, (12,), 32)
+        image = Image.open(io.BytesIO(render.encode_gif([render.render_gif_frame(snapshot, 5, (12,))], [10], canvas.width, canvas.width, PALETTE)))
+
+        self.assertFrame(image, canvas)
+
+    def test_animation(self):
+
+        rng = random.Random(2)
+        canvases = [canvas_from(24, 24, [rng.randrange(16) for _ in range(24 * 24)]) for _ in range(3)]
+
+        image = self.decode(canvases, [10, 20, 300])
+
+        self.assertEqual(image.n_frames, 3)
+        self.assertEqual(image.info["loop"], 0)
+
+        for frame, (canvas, delay) in enumerate(zip(canvases, [10, 20, 300])):
+
+            with self.subTest(frame=frame):
+                image.seek(frame)
+                self.assertEqual(image.info["duration"], delay * 10)
+                self.assertFrame(image, canvas)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+from clients.state_store import StateStore
+from clients.subscriptions import Filter, Subscriptions
+
+GAME = {
+    "game_no": 1, "player_1": "Alice", "player_2": "bob", "size": 6, "time": 900, "increment": 10, "half_komi": 4,
+    "pieces": 30, "capstones": 1, "unrated": 0, "tournament": 0, "extra_time_move": 0, "extra_time_amount": 0, "result": None
+}
+
+RANKINGS = {"Alice": (3, 1800), "bob": (40, 1500), "carol": (90, 1200)}
+
+# filter, changes to GAME, whether the game gets through
+CASES = [
+    ("empty", Filter(), {}, True),
+    ("empty, unranked players", Filter(), {"player_1": "dave", "player_2": "erin"}, True),
+
+    ("size", Filter(sizes=frozenset({6})), {}, True),
+    ("other size", Filter(sizes=frozenset({6})), {"size": 5}, False),
+    ("one of several sizes", Filter(sizes=frozenset({5, 7})), {"size": 7}, True),
+
+    ("rating, both above", Filter(min_rating=1400), {}, True),
+    ("rating, exactly", Filter(min_rating=1500), {}, True),
+    ("rating, one below", Filter(min_rating=1600), {}, False),
+    ("rating, unranked player", Filter(min_rating=1000), {"player_2": "dave"}, False),
+
+    ("tournament only, tournament game", Filter(tournament=True), {"tournament": 1}, True),
+    ("tournament only, casual game", Filter(tournament=True), {}, False),
+    ("no tournaments, casual game", Filter(tournament=False), {}, True),
+    ("no tournaments, tournament game", Filter(tournament=False), {"tournament": 1}, False),
+
+    ("rated only, rated game", Filter(rated=True), {}, True),
+    ("rated only, unrated game", Filter(rated=True), {"unrated": 1}, False),
+    ("unrated only, unrated game", Filter(rated=False), {"unrated": 1}, True),
+    ("unrated only, rated game", Filter(rated=False), {}, False),
+
+    ("player, first", Filter(players=frozenset({"alice"})), {}, True),
+    ("player, second", Filter(players=frozenset({"bob"})), {}, True),
+    ("player, not playing", Filter(players=frozenset({"carol"})), {}, False),
+    ("one of several players", Filter(players=frozenset({"carol", "bob"})), {}, True),
+
+    ("everything matches", Filter(frozenset({6}), 1500, False, True, frozenset({"alice"})), {}, True),
+    ("everything but the size", Filter(frozenset({5}), 1500, False, True, frozenset({"alice"})), {}, False),
+]
+
+class SubscriptionsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = StateStore(os.path.join(self.directory.name, "state.db"))
+        self.subscriptions = Subscriptions(self.store)
+
+    def tearDown(self):
+
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_filters(self):
+
+        for name, game_filter, changes, expected in CASES:
+
+            with self.subTest(name):
+
+                self.subscriptions.set(1, game_filter, {1: 100})
+                self.assertEqual(self.subscriptions.match(GAME | changes, RANKINGS) == [1], expected)
+
+    def test_filters_side_by_side(self):
+
+        # every case is a guild of its own in one index, each guild's bit has to stay out of the others' way
+        guilds = {guild: 100 + guild for guild in range(len(CASES))}
+
+        for guild, (_, game_filter, _, _) in enumerate(CASES):
+            self.subscriptions.set(guild, game_filter, guilds)
+
+        for guild, (name, _, changes, expected) in enumerate(CASES):
+
+            with self.subTest(name):
+                self.assertEqual(guild in self.subscriptions.match(GAME | changes, RANKINGS), expected)
+
+    def test_no_guilds(self):
+        self.assertEqual(self.subscriptions.match(GAME, RANKINGS), [])
+
+    def test_filters_are_saved(self):
+
+        game_filter = Filter(frozenset({5, 6}), 1500, True, None, frozenset({"alice"}))
+        self.subscriptions.set(1, game_filter, {1: 100})
+
+        self.assertEqual(Subscriptions(self.store).get(1), game_filter)
+
+        # clearing it drops it from the store too
+        self.subscriptions.set(1, Filter(), {1: 100})
+        self.assertEqual(Subscriptions(self.store).filters, {})
+
+    def test_rebuild_after_set_channel(self):
+
+        guilds = {1: 100}
+        self.subscriptions.set(2, Filter(sizes=frozenset({5})), guilds) # filtered before it had a channel
+        self.subscriptions.rebuild(guilds)
+
+        self.assertEqual(self.subscriptions.match(GAME | {"size": 5}, RANKINGS), [1])
+
+        # what /set_channel does
+        guilds[2] = 200
+        self.store.set_channel(2, 200)
+        self.subscriptions.rebuild(guilds)
+
+        self.assertEqual(self.subscriptions.match(GAME | {"size": 5}, RANKINGS), [1, 2])
+        self.assertEqual(self.subscriptions.match(GAME, RANKINGS), [1])
+
+    def test_describe(self):
+
+        self.assertEqual(Filter().describe(), "every game")
+        self.assertEqual(
+            Filter(frozenset({6, 5}), 1500, False, True, frozenset({"bob", "alice"})).describe(),
+            "sizes 5x5, 6x6; both players rated 1500+; no tournament games; rated games; games with alice, bob"
+        )
+
+if __name__ == "__main__":
+    unittest.main()